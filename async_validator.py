@@ -0,0 +1,95 @@
+import asyncio
+
+from batch_planner import resolve_graph
+from dmarc_syntaxchecker import validate_dmarc
+from dns_cache import Deadline
+from spf_record_validator import LOOKUP_LIMIT, validate_spf
+
+# The asynchronous entry points resolve every name the synchronous validators
+# are going to query concurrently into the shared DNS cache, one level of the
+# lookup tree at a time (see batch_planner), and then run the synchronous
+# checks on warm data in a worker thread. Names the prefetch could not leave in
+# the cache, answers with a TTL of 0, macro names, evicted entries or the rest
+# of a prefetch cut short, are then queried there and never block the loop.
+# An observer sees the prefetch queries first, then the events of the
+# synchronous pass. A timeout covers both passes, prefetch queries are bounded
+# by lifetime.
+
+
+async def prefetch_spf(
+    spf_record: str, curr_domain: str, observer=None, lifetime: float = None
+):
+    # Warm the cache with every lookup validate_spf makes for this record.
+    # Nothing deeper than the lookup limit can be evaluated, so the walk
+    # stops there
+    result = validate_spf(spf_record, curr_domain, resolve=False)
+    nodes = [node for node in result["dependencies"] if "%" not in node[0]]
+    await resolve_graph(
+        nodes, observer=observer, lifetime=lifetime, max_levels=LOOKUP_LIMIT
+    )
+
+
+async def prefetch_dmarc(
+    record: str, domain: str, observer=None, lifetime: float = None
+):
+    # Warm the cache with the report authorization records of rua/ruf hosts
+    result = validate_dmarc(record, domain, resolve=False)
+    await resolve_graph(result["dependencies"], observer=observer, lifetime=lifetime)
+
+
+async def _prefetch_until(prefetch, deadline: Deadline):
+    # A prefetch cut short by the deadline leaves the rest to the
+    # synchronous pass, which then times out on its own
+    try:
+        await asyncio.wait_for(prefetch, deadline.remaining())
+    except asyncio.TimeoutError:
+        pass
+
+
+async def validate_spf_async(
+    spf_record: str,
+    curr_domain: str,
+    observer=None,
+    timings: bool = False,
+    timeout: float = None,
+    query_timeout: float = None,
+):
+    deadline = Deadline(timeout, query_timeout)
+    await _prefetch_until(
+        prefetch_spf(
+            spf_record, curr_domain, observer=observer, lifetime=query_timeout
+        ),
+        deadline,
+    )
+    return await asyncio.to_thread(
+        validate_spf,
+        spf_record,
+        curr_domain,
+        observer=observer,
+        timings=timings,
+        timeout=deadline.remaining(),
+        query_timeout=query_timeout,
+    )
+
+
+async def validate_dmarc_async(
+    record: str,
+    domain: str,
+    observer=None,
+    timings: bool = False,
+    timeout: float = None,
+    query_timeout: float = None,
+):
+    deadline = Deadline(timeout, query_timeout)
+    await _prefetch_until(
+        prefetch_dmarc(record, domain, observer, query_timeout), deadline
+    )
+    return await asyncio.to_thread(
+        validate_dmarc,
+        record,
+        domain,
+        observer=observer,
+        timings=timings,
+        timeout=deadline.remaining(),
+        query_timeout=query_timeout,
+    )
@@ -0,0 +1,104 @@
+import asyncio
+
+from dmarc_syntaxchecker import validate_dmarc
+from dns_cache import resolve_async, txt_string
+from spf_record_validator import LOOKUP_LIMIT, validate_spf
+
+# Batch planning. Instead of every domain walking its own lookup tree, the
+# names a whole batch needs are laid out as one graph of (name, rdtype)
+# nodes: the SPF and DMARC records of every domain first, then the names
+# those records depend on, level by level. Every level is resolved
+# concurrently into the shared DNS cache and a name is resolved once however
+# many domains depend on it. The validators then run on warm data.
+
+# Deeper levels cannot be evaluated within the lookup limit
+MAX_LEVELS = LOOKUP_LIMIT + 2
+
+
+class BatchPlan:
+    # The lookup graph of a batch
+    #   graph  - (name, rdtype) -> list of the nodes its answer depends on
+    #   levels - nodes in the order they were resolved, one list per level
+
+    def __init__(self):
+        self.graph = {}
+        self.levels = []
+
+    def __len__(self):
+        return len(self.graph)
+
+    def dependents(self):
+        # (name, rdtype) -> number of nodes that depend on it, the names
+        # shared by many domains come first
+        counts = {}
+        for children in self.graph.values():
+            for child in children:
+                counts[child] = counts.get(child, 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def root_nodes(domain: str):
+    return [(domain, "TXT"), ("_dmarc." + domain, "TXT")]
+
+
+def node_dependencies(name: str, rdtype: str, records: list):
+    # The names an answer makes the validators query next
+    nodes = []
+    if rdtype == "MX":
+        nodes = [(record.split(" ")[1], "A") for record in records]
+    elif rdtype == "TXT":
+        for record in records:
+            record = txt_string(record)
+            if record.startswith("v=spf1"):
+                nodes += validate_spf(record, name, [], resolve=False)["dependencies"]
+            elif record.startswith("v=DMARC1") and name.startswith("_dmarc."):
+                domain = name[len("_dmarc.") :]
+                nodes += validate_dmarc(record, domain, resolve=False)["dependencies"]
+    # Names with macros are only known at evaluation time
+    return [node for node in nodes if "%" not in node[0]]
+
+
+async def _fetch(name: str, rdtype: str, observer=None, lifetime: float = None):
+    # Errors are left to the validators, which report them as issues
+    try:
+        return await resolve_async(name, rdtype, observer=observer, lifetime=lifetime)
+    except Exception:
+        return []
+
+
+async def resolve_graph(
+    nodes: list,
+    plan: BatchPlan = None,
+    observer=None,
+    lifetime: float = None,
+    max_levels: int = MAX_LEVELS,
+):
+    # Resolve nodes and everything they depend on, one level at a time.
+    # Returns the plan, extended in place when one is given
+    if plan is None:
+        plan = BatchPlan()
+    level = [node for node in dict.fromkeys(nodes) if node not in plan.graph]
+    for _ in range(max_levels):
+        if not level:
+            break
+        plan.levels.append(level)
+        for node in level:
+            plan.graph[node] = []
+        answers = await asyncio.gather(
+            *(_fetch(name, rdtype, observer, lifetime) for name, rdtype in level)
+        )
+        following = {}
+        for node, records in zip(level, answers):
+            children = node_dependencies(*node, records)
+            plan.graph[node] = children
+            for child in children:
+                if child not in plan.graph:
+                    following[child] = None
+        level = list(following)
+    return plan
+
+
+async def plan_batch(domains, observer=None, lifetime: float = None):
+    # Resolve the lookup graph of a batch of domains into the DNS cache
+    nodes = [node for domain in domains for node in root_nodes(domain)]
+    return await resolve_graph(nodes, observer=observer, lifetime=lifetime)
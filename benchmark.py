@@ -0,0 +1,286 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import dns_cache
+import report_authorization
+import spf_record_validator
+from dmarc_syntaxchecker import validate_dmarc
+from dns_backends import ZoneResolver
+from dns_cache import DNSCache
+from spf_record_validator import validate_spf
+
+# Measures validation throughput and lookup cost over a synthetic corpus of
+# records shaped like the ones seen in the wild, resolved against a
+# ZoneResolver with simulated latency:
+#
+#     python benchmark.py --records 200 --latency 0.002 --output run.json
+#     python benchmark.py --compare run.json
+#
+# Every path reports records/sec, p50/p99 latency per record, DNS queries
+# per record and the peak memory allocated while it runs.
+
+PATHS = ("sync", "cached", "parallel")
+SHAPES = ("include_chain", "ip_list", "provider", "dmarc")
+PROVIDERS = 4
+CHAIN_DEPTH = 7
+IP_LIST_LENGTH = 80
+REPORT_HOSTS = 10
+
+
+def _provider_records(records: dict):
+    # Include targets shared by many domains, like the big mail providers
+    for number in range(PROVIDERS):
+        networks = " ".join(f"ip4:64.{number}.{n}.0/24" for n in range(12))
+        records[f"_spf{number}.provider.example"] = {
+            "TXT": [f"v=spf1 include:_net{number}.provider.example {networks} ~all"]
+        }
+        records[f"_net{number}.provider.example"] = {
+            "TXT": [f"v=spf1 ip6:2a00:{number + 1}::/32 ip4:66.{number}.0.0/16 ~all"]
+        }
+
+
+def _include_chain(records: dict, domain: str):
+    names = [f"_c{depth}.{domain}" for depth in range(CHAIN_DEPTH)]
+    for name, target in zip(names, names[1:]):
+        records[name] = {"TXT": [f"v=spf1 include:{target} ip4:8.8.4.4 -all"]}
+    records[names[-1]] = {"TXT": ["v=spf1 ip4:8.8.8.0/24 -all"]}
+    return f"v=spf1 include:{names[0]} -all"
+
+
+def _ip_list(index: int):
+    networks = " ".join(
+        f"ip4:{11 + index % 80}.{n}.0.0/16" for n in range(IP_LIST_LENGTH)
+    )
+    return f"v=spf1 {networks} ip6:2001:4860::/32 -all"
+
+
+def _provider(records: dict, domain: str, index: int):
+    records[domain] = {
+        "A": [f"93.184.{index % 256}.1"],
+        "MX": [f"10 mx1.{domain}.", f"20 mx2.{domain}."],
+    }
+    records[f"mx1.{domain}"] = {"A": [f"64.233.{index % 256}.1"]}
+    records[f"mx2.{domain}"] = {"A": [f"64.233.{index % 256}.2"]}
+    return (
+        f"v=spf1 a mx include:_spf{index % PROVIDERS}.provider.example "
+        f"include:_spf{(index + 1) % PROVIDERS}.provider.example ~all"
+    )
+
+
+def _dmarc(records: dict, domain: str):
+    hosts = [f"reports{number}.example" for number in range(REPORT_HOSTS)]
+    for host in hosts:
+        records[f"{domain}._report._dmarc.{host}"] = {"TXT": ["v=DMARC1"]}
+    rua = ",".join(f"mailto:rua@{host}" for host in hosts)
+    ruf = ",".join(f"mailto:ruf@{host}" for host in hosts[: REPORT_HOSTS // 2])
+    return f"v=DMARC1; p=reject; sp=quarantine; rua={rua}; ruf={ruf}; fo=1;"
+
+
+def build_corpus(size: int = 200):
+    # Returns the zone records and the cases to validate, a case is a tuple
+    # (kind, domain, record) with kind "spf" or "dmarc"
+    records = {}
+    cases = []
+    _provider_records(records)
+    for index in range(size):
+        domain = f"domain{index}.example"
+        shape = SHAPES[index % len(SHAPES)]
+        if shape == "include_chain":
+            cases.append(("spf", domain, _include_chain(records, domain)))
+        elif shape == "ip_list":
+            cases.append(("spf", domain, _ip_list(index)))
+        elif shape == "provider":
+            cases.append(("spf", domain, _provider(records, domain, index)))
+        else:
+            cases.append(("dmarc", domain, _dmarc(records, domain)))
+    return records, cases
+
+
+def _validate(case):
+    kind, domain, record = case
+    start = time.perf_counter()
+    if kind == "spf":
+        validate_spf(record, domain, [])
+    else:
+        validate_dmarc(record, domain)
+    return time.perf_counter() - start
+
+
+def _clear_caches():
+    dns_cache.set_default_cache(DNSCache())
+    spf_record_validator.subtree_cache.clear()
+    report_authorization.authorization_cache.clear()
+
+
+def _run_sync(cases: list, workers: int):
+    # Every record starts from empty caches
+    timings = []
+    for case in cases:
+        _clear_caches()
+        timings.append(_validate(case))
+    return timings
+
+
+def _warm_up(cases: list):
+    _clear_caches()
+    for case in cases:
+        _validate(case)
+
+
+def _run_cached(cases: list, workers: int):
+    # Caches were warmed by a first pass that is not measured
+    return [_validate(case) for case in cases]
+
+
+def _run_parallel(cases: list, workers: int):
+    # One set of caches shared by a thread pool
+    _clear_caches()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_validate, cases))
+
+
+RUNNERS = {"sync": _run_sync, "cached": _run_cached, "parallel": _run_parallel}
+
+
+def percentile(values: list, fraction: float):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(path: str, cases: list, resolver: ZoneResolver, workers: int = 16):
+    # Time one path and count the queries it sends, then run it again under
+    # tracemalloc without latency for the peak memory, so that tracing does
+    # not distort the timings
+    runner = RUNNERS[path]
+    if path == "cached":
+        _warm_up(cases)
+    resolver.reset_stats()
+    start = time.perf_counter()
+    timings = runner(cases, workers)
+    elapsed = time.perf_counter() - start
+    queries = resolver.queries
+
+    latency = resolver.latency
+    resolver.latency = 0.0
+    tracemalloc.start()
+    try:
+        runner(cases, workers)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        resolver.latency = latency
+
+    return {
+        "records": len(cases),
+        "seconds": round(elapsed, 6),
+        "records_per_second": round(len(cases) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "queries_per_record": round(queries / len(cases), 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def run_benchmark(
+    size: int = 200, latency: float = 0.001, workers: int = 16, paths=PATHS
+):
+    records, cases = build_corpus(size)
+    resolver = ZoneResolver(records, latency=latency)
+    previous_resolver = dns_cache.get_resolver()
+    previous_cache = dns_cache.get_default_cache()
+    dns_cache.set_resolver(resolver)
+    try:
+        results = {path: measure(path, cases, resolver, workers) for path in paths}
+    finally:
+        dns_cache.set_resolver(previous_resolver)
+        dns_cache.set_default_cache(previous_cache)
+        spf_record_validator.subtree_cache.clear()
+        report_authorization.authorization_cache.clear()
+    return {
+        "python": platform.python_version(),
+        "records": size,
+        "latency": latency,
+        "workers": workers,
+        "paths": results,
+    }
+
+
+# Metrics where a higher value is better, the others regress when they grow
+HIGHER_IS_BETTER = ("records_per_second",)
+COMPARED = (
+    "records_per_second",
+    "p50_ms",
+    "p99_ms",
+    "queries_per_record",
+    "peak_memory_kb",
+)
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1):
+    # Returns a list of regressions worse than tolerance (a fraction) between
+    # two benchmark results
+    regressions = []
+    for path, metrics in current["paths"].items():
+        before = baseline.get("paths", {}).get(path)
+        if before is None:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(
+                    {"path": path, "metric": metric, "baseline": old, "current": new}
+                )
+    return regressions
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark SPF and DMARC validation against a simulated resolver"
+    )
+    parser.add_argument("--records", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.001, help="seconds per DNS query"
+    )
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--output", default="-", help="JSON output file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed regression fraction"
+    )
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.records, args.latency, args.workers, args.paths)
+    text = json.dumps(result, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), result, args.tolerance)
+        for regression in regressions:
+            print(
+                "{path} {metric}: {baseline} -> {current}".format(**regression),
+                file=sys.stderr,
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
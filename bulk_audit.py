@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import queue
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from async_validator import validate_dmarc_async, validate_spf_async
+from batch_planner import plan_batch
+from persistent_cache import (
+    open_default_store,
+    validate_dmarc_cached,
+    validate_spf_cached,
+)
+from records import find_records, find_records_async, missing_record
+from results import dumps, jsonable
+
+
+def audit_spf(domain: str, records: list = None, timeout: float = None):
+    # timeout bounds every DNS query in seconds
+    if records is None:
+        records = find_records("spf", domain, timeout)
+    if len(records) != 1:
+        return missing_record("spf", records)
+    result = validate_spf_cached(records[0], domain, query_timeout=timeout)
+    return {"record": records[0], **result}
+
+
+def audit_dmarc(domain: str, records: list = None, timeout: float = None):
+    if records is None:
+        records = find_records("dmarc", domain, timeout)
+    if len(records) != 1:
+        return missing_record("dmarc", records)
+    result = validate_dmarc_cached(records[0], domain, query_timeout=timeout)
+    return {"record": records[0], **result}
+
+
+def audit_domain(domain: str, index: int = None, timeout: float = None):
+    # Fetch and validate the SPF and DMARC records of one domain
+    return {
+        "index": index,
+        "domain": domain,
+        "spf": audit_spf(domain, timeout=timeout),
+        "dmarc": audit_dmarc(domain, timeout=timeout),
+    }
+
+
+async def audit_spf_async(domain: str, timeout: float = None):
+    records = await find_records_async("spf", domain, timeout)
+    if len(records) != 1:
+        return missing_record("spf", records)
+    result = await validate_spf_async(records[0], domain, query_timeout=timeout)
+    return {"record": records[0], **result}
+
+
+async def audit_dmarc_async(domain: str, timeout: float = None):
+    records = await find_records_async("dmarc", domain, timeout)
+    if len(records) != 1:
+        return missing_record("dmarc", records)
+    result = await validate_dmarc_async(records[0], domain, query_timeout=timeout)
+    return {"record": records[0], **result}
+
+
+async def audit_domain_async(domain: str, index: int = None, timeout: float = None):
+    try:
+        spf, dmarc = await asyncio.wait_for(
+            asyncio.gather(
+                audit_spf_async(domain, timeout), audit_dmarc_async(domain, timeout)
+            ),
+            timeout,
+        )
+    except asyncio.TimeoutError:
+        return {"index": index, "domain": domain, "error": "timed out"}
+    return {"index": index, "domain": domain, "spf": spf, "dmarc": dmarc}
+
+
+def _audit_threads(domains, workers: int, audit=audit_domain):
+    # At most 2 * workers domains are in flight, so memory does not grow
+    # with the size of the input. audit is called with (domain, index)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, domain in domains:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(audit, domain, index))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+async def audit_domains_async(
+    domains, workers: int = 64, timeout: float = None, offset: int = 0
+):
+    # Asynchronous generator of audit results in completion order, at most
+    # workers domains are validated at once
+    pending = set()
+    for index, domain in itertools.islice(enumerate(domains), offset, None):
+        if len(pending) >= workers:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+        pending.add(asyncio.ensure_future(audit_domain_async(domain, index, timeout)))
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+
+def _audit_async(domains, workers: int, timeout: float, offset: int):
+    # Run the event loop in a helper thread and hand results over through a
+    # bounded queue, so the caller keeps a plain generator
+    results = queue.Queue(maxsize=2 * workers)
+    done = object()
+
+    async def produce():
+        async for result in audit_domains_async(domains, workers, timeout, offset):
+            await asyncio.to_thread(results.put, result)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while (result := results.get()) is not done:
+        yield result
+    thread.join()
+
+
+# Domains planned together in batch mode. The graph of a batch has to fit in
+# the DNS cache, which keeps 10000 answers by default
+BATCH_SIZE = 1000
+
+
+def _audit_batches(
+    domains, workers: int, timeout: float = None, batch_size: int = BATCH_SIZE
+):
+    # Resolve the lookup graph of each batch of domains at once, every shared
+    # include or report host a single query, then validate the batch on the
+    # warm cache
+    audit = functools.partial(audit_domain, timeout=timeout)
+    while batch := list(itertools.islice(domains, batch_size)):
+        asyncio.run(plan_batch([domain for _, domain in batch], lifetime=timeout))
+        yield from _audit_threads(iter(batch), workers, audit)
+
+
+def audit_domains(
+    domains,
+    workers: int = 16,
+    mode: str = "thread",
+    timeout: float = None,
+    offset: int = 0,
+):
+    # Audit an iterable of domains, yielding one result per domain in
+    # completion order. Each result carries the index of its domain in the
+    # input so that a run can be resumed with offset. timeout bounds every DNS
+    # query, in async mode it also bounds the audit of a whole domain. batch
+    # mode plans the lookups of many domains together, see batch_planner
+    if mode == "thread":
+        return _audit_threads(
+            itertools.islice(enumerate(domains), offset, None),
+            workers,
+            functools.partial(audit_domain, timeout=timeout),
+        )
+    if mode == "async":
+        return _audit_async(domains, workers, timeout, offset)
+    if mode == "batch":
+        return _audit_batches(
+            itertools.islice(enumerate(domains), offset, None), workers, timeout
+        )
+    raise ValueError(f"Unknown mode: {mode}, it should be thread, async or batch")
+
+
+def read_domains(stream):
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Validate the SPF and DMARC records of a list of domains"
+    )
+    parser.add_argument(
+        "domains", nargs="?", default="-", help="file with one domain per line"
+    )
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument(
+        "--offset", type=int, default=0, help="skip the first N domains"
+    )
+    parser.add_argument(
+        "--mode", choices=["thread", "async", "batch"], default="thread"
+    )
+    parser.add_argument("--output", default="-", help="NDJSON output file")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="write issues as [code, *args] lists instead of messages",
+    )
+    parser.add_argument(
+        "--cache", help="SQLite file caching DNS answers and results across runs"
+    )
+    args = parser.parse_args(argv)
+
+    if args.cache:
+        open_default_store(args.cache)
+
+    source = sys.stdin if args.domains == "-" else open(args.domains)
+    output = sys.stdout if args.output == "-" else open(args.output, "a")
+    try:
+        results = audit_domains(
+            read_domains(source), args.workers, args.mode, args.timeout, args.offset
+        )
+        for result in results:
+            if args.compact:
+                output.write(dumps(result) + "\n")
+            else:
+                output.write(json.dumps(result, default=jsonable) + "\n")
+            output.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
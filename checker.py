@@ -0,0 +1,164 @@
+import argparse
+import sys
+
+from dmarc_syntaxchecker import validate_dmarc
+from records import KINDS, find_records, missing_record
+from results import dumps, jsonable
+from spf_record_validator import validate_spf
+
+# Command line entry point for checking the SPF and DMARC records of a few
+# domains, and a server mode for tools that would otherwise start a process
+# per domain:
+#
+#     python -m checker spf example.com
+#     python -m checker dmarc example.com --record "v=DMARC1; p=reject;" --offline
+#     python -m checker both example.com example.org
+#     python -m checker serve --socket /run/checker.sock
+#
+# Startup is kept short: dnspython is imported with the first query (see
+# dns_cache), patterns are compiled when first used (see patterns), so an
+# offline check never loads the DNS machinery. A server answers every request
+# from one process, the interpreter, the imports and the DNS cache are paid
+# for once.
+#
+# Requests are lines of "domain" for both records, or "spf domain" or "dmarc
+# domain". Each gets one JSON line back, {"domain": ..., "spf": ...,
+# "dmarc": ...} with the records asked for.
+
+
+def check(kind: str, domain: str, record: str = None, offline: bool = False):
+    # Result of the SPF or DMARC record of domain, the record under "record".
+    # The record is looked up unless it is given, offline makes no query
+    if record is None:
+        records = [] if offline else find_records(kind, domain)
+        if len(records) != 1:
+            return missing_record(kind, records)
+        record = records[0]
+    if kind == "spf":
+        result = validate_spf(record, domain, [], resolve=not offline)
+    else:
+        result = validate_dmarc(record, domain, resolve=not offline)
+    return {"record": record, **result}
+
+
+def check_domain(
+    domain: str, kinds: tuple = KINDS, record: str = None, offline: bool = False
+):
+    results = {kind: check(kind, domain, record, offline) for kind in kinds}
+    return {"domain": domain, **results}
+
+
+def parse_request(line: str):
+    # (domain, kinds) of a request line, None for a blank line
+    words = line.split()
+    if not words:
+        return None
+    if len(words) > 1 and words[0].lower() in KINDS:
+        return words[1], (words[0].lower(),)
+    return words[0], KINDS
+
+
+def _encoder(compact: bool):
+    if compact:
+        return dumps
+    import json
+
+    return lambda value: json.dumps(value, default=jsonable)
+
+
+def serve_lines(lines, output, compact: bool = False):
+    # Answer request lines until they run out
+    encode = _encoder(compact)
+    for line in lines:
+        request = parse_request(line)
+        if request is None:
+            continue
+        output.write(encode(check_domain(*request)) + "\n")
+        output.flush()
+
+
+def make_server(path: str, compact: bool = False):
+    # Unix socket server answering every connection in a thread of its own,
+    # a socket left behind by an earlier server is replaced
+    import io
+    import os
+    import socketserver
+    import stat
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            lines = io.TextIOWrapper(self.rfile, "utf-8", errors="replace")
+            output = io.TextIOWrapper(self.wfile, "utf-8", write_through=True)
+            serve_lines(lines, output, compact)
+
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_socket(path: str, compact: bool = False):
+    import os
+
+    with make_server(path, compact) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m checker",
+        description="Check the SPF and DMARC records of domains",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help in (
+        ("spf", "check SPF records"),
+        ("dmarc", "check DMARC records"),
+        ("both", "check SPF and DMARC records"),
+    ):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("domains", nargs="+")
+        if name != "both":
+            command.add_argument(
+                "--record", help="validate this record instead of looking it up"
+            )
+            command.add_argument(
+                "--offline", action="store_true", help="make no DNS queries"
+            )
+        command.add_argument("--compact", action="store_true")
+    serve = commands.add_parser(
+        "serve", help="answer request lines from stdin or a Unix socket"
+    )
+    serve.add_argument(
+        "--socket", help="Unix socket path, stdin and stdout if not given"
+    )
+    serve.add_argument("--compact", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if args.socket:
+            serve_socket(args.socket, args.compact)
+        else:
+            serve_lines(sys.stdin, sys.stdout, args.compact)
+        return 0
+
+    record = getattr(args, "record", None)
+    offline = getattr(args, "offline", False)
+    if offline and record is None:
+        parser.error("--offline needs --record")
+    kinds = KINDS if args.command == "both" else (args.command,)
+    encode = _encoder(args.compact)
+    passed = True
+    for domain in args.domains:
+        result = check_domain(domain, kinds, record, offline)
+        passed = passed and all(result[kind]["status"] for kind in kinds)
+        print(encode(result))
+    # A non-zero exit status tells scripts that a record has issues
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+import dns_cache
+import report_authorization
+import spf_check
+import spf_record_validator
+from dns_backends import ZoneResolver
+from dns_cache import DNSCache
+
+ZONE_FILE = os.path.join(os.path.dirname(__file__), "fixtures", "zone.db")
+
+
+@pytest.fixture(autouse=True)
+def zone():
+    # Every test resolves against the fixture zone with empty caches, tests
+    # can add records of their own to the returned resolver
+    resolver = ZoneResolver.from_file(ZONE_FILE)
+    previous_resolver = dns_cache.get_resolver()
+    previous_cache = dns_cache.get_default_cache()
+    dns_cache.set_resolver(resolver)
+    dns_cache.set_default_cache(DNSCache())
+    spf_record_validator.subtree_cache.clear()
+    report_authorization.authorization_cache.clear()
+    spf_check.policy_cache.clear()
+    yield resolver
+    dns_cache.set_resolver(previous_resolver)
+    dns_cache.set_default_cache(previous_cache)
+    spf_record_validator.subtree_cache.clear()
+    report_authorization.authorization_cache.clear()
+    spf_check.policy_cache.clear()
+
+
+@pytest.fixture
+def zone_with(zone):
+    # zone_with({(name, rdtype): values, ...}) adds the records to the fixture
+    # zone and returns its resolver
+    def add(records: dict):
+        for (name, rdtype), values in records.items():
+            zone.add(name, rdtype, values)
+        return zone
+
+    return add
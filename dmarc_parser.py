@@ -0,0 +1,264 @@
+from functools import lru_cache
+
+from patterns import LazyPattern
+from results import Issue
+
+# RFC 7489 section 6.3 tags and the values they accept. Tags mapped to a tuple
+# take one of its values, the others are validated by their own rules
+TAG_RULES = {
+    "p": ("none", "quarantine", "reject"),
+    "sp": ("none", "quarantine", "reject"),
+    "rua": "URI list",
+    "ruf": "URI list",
+    "fo": ("0", "1", "d", "s"),
+    "adkim": ("s", "r"),
+    "aspf": ("s", "r"),
+    "rf": ("afrf",),
+    "ri": "32-bit unsigned integer",
+    "pct": "integer between 0 and 100",
+}
+
+# Failure reporting options as bits of DMARCRecord.fo
+FO_FLAGS = {"0": 1, "1": 2, "d": 4, "s": 8}
+FO_ALL, FO_ANY, FO_DKIM, FO_SPF = 1, 2, 4, 8
+
+# Size limit suffixes of report URIs (section 6.2)
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+URI_REGEX = LazyPattern(r"^(?P<uri>[^!]*)(?:!(?P<size>[0-9]+)(?P<unit>[kmgt]?))?$")
+
+
+class ReportURI:
+    # One address of a rua or ruf tag
+    #   raw     - the URI as written, size limit included
+    #   scheme  - lower case URI scheme, "mailto" for email addresses
+    #   address - the URI without the scheme and the size limit
+    #   host    - domain part of a valid mailto address, None otherwise
+    #   size    - size limit in bytes, None when not given
+    #   error   - Issue, None for a valid mailto address. Reports are only
+    #             sent by email, other schemes are errors too
+    __slots__ = ("raw", "scheme", "address", "host", "size", "error")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.scheme = None
+        self.address = None
+        self.host = None
+        self.size = None
+        self.error = None
+
+    def __repr__(self):
+        return f"ReportURI({self.raw!r})"
+
+
+def _email_error(address: str, tag: str):
+    local, at, host = address.partition("@")
+    if not at or not local or not host or "@" in host:
+        return Issue("DMARC_INVALID_EMAIL", (tag,))
+    if host.startswith("."):
+        return Issue("DMARC_EMAIL_DOMAIN_DOT", (tag,))
+    if local.startswith(".") or local.endswith("."):
+        return Issue("DMARC_EMAIL_LOCAL_DOT", (tag,))
+    if ".." in local:
+        return Issue("DMARC_EMAIL_DOUBLE_DOT", (tag,))
+    return None
+
+
+@lru_cache(maxsize=4096)
+def parse_uri(raw: str, tag: str = "rua"):
+    uri = ReportURI(raw)
+    match = URI_REGEX.match(raw.strip())
+    scheme, colon, address = match["uri"].partition(":") if match else ("", "", "")
+    if not colon or not address:
+        uri.error = Issue("DMARC_INVALID_EMAIL", (tag,))
+        return uri
+    uri.scheme = scheme.lower()
+    uri.address = address
+    if match["size"] is not None:
+        uri.size = int(match["size"]) * SIZE_UNITS[match["unit"]]
+    if uri.scheme != "mailto":
+        uri.error = Issue("DMARC_INVALID_EMAIL", (tag,))
+    else:
+        uri.error = _email_error(address, tag)
+        if uri.error is None:
+            uri.host = address.partition("@")[2]
+    return uri
+
+
+class DMARCRecord:
+    # A DMARC record parsed once into typed values, tags that are not written
+    # out hold their RFC 7489 defaults
+    #   arguments        - every tag as written, without the whitespace
+    #   tags             - (name, value) of every tag in record order
+    #   terminated       - whether the last tag is followed by a semicolon
+    #   policy           - p, None when missing or invalid
+    #   subdomain_policy - sp, the policy when not given
+    #   rua, ruf         - tuples of ReportURI
+    #   fo               - failure reporting options, FO_* bits
+    #   adkim, aspf      - alignment modes, "r" or "s"
+    #   rf               - report format
+    #   ri               - aggregate report interval in seconds
+    #   pct              - percentage of messages the policy applies to
+    #   tag_issues       - Issues of every tag, aligned with tags: unknown
+    #                      names, invalid values and the static warnings
+    #   errors           - Issues of duplicate or missing required tags
+    __slots__ = (
+        "raw",
+        "arguments",
+        "tags",
+        "terminated",
+        "policy",
+        "subdomain_policy",
+        "rua",
+        "ruf",
+        "fo",
+        "adkim",
+        "aspf",
+        "rf",
+        "ri",
+        "pct",
+        "tag_issues",
+        "errors",
+    )
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.arguments = ()
+        self.tags = ()
+        self.terminated = True
+        self.policy = None
+        self.subdomain_policy = None
+        self.rua = ()
+        self.ruf = ()
+        self.fo = FO_ALL
+        self.adkim = "r"
+        self.aspf = "r"
+        self.rf = "afrf"
+        self.ri = 86400
+        self.pct = 100
+        self.tag_issues = ()
+        self.errors = ()
+
+    def __repr__(self):
+        return f"DMARCRecord({self.raw!r})"
+
+
+def _integer(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _policy(tag: str, value: str, issues: list):
+    if value not in TAG_RULES[tag]:
+        issues.append(Issue("DMARC_INVALID_VALUE", (tag, " or ".join(TAG_RULES[tag]))))
+        return None
+    if value == "none":
+        issues.append(Issue("DMARC_POLICY_NONE", (tag,)))
+    return value
+
+
+def _choice(tag: str, value: str, issues: list):
+    if value not in TAG_RULES[tag]:
+        issues.append(Issue("DMARC_INVALID_VALUE", (tag, " or ".join(TAG_RULES[tag]))))
+        return None
+    return value
+
+
+def _uris(tag: str, value: str, issues: list):
+    uris = tuple(parse_uri(uri, tag) for uri in value.split(","))
+    issues.extend(uri.error for uri in uris if uri.error is not None)
+    return uris
+
+
+def _fo(tag: str, value: str, issues: list):
+    fo = 0
+    for flag in value.split(":"):
+        if flag not in FO_FLAGS:
+            issues.append(Issue("DMARC_FO_INVALID", (flag,)))
+        elif fo & FO_FLAGS[flag]:
+            issues.append(Issue("DMARC_FO_DUPLICATE"))
+        else:
+            fo |= FO_FLAGS[flag]
+    return fo
+
+
+def _ri(tag: str, value: str, issues: list):
+    ri = _integer(value)
+    if ri is None:
+        issues.append(Issue("DMARC_RI_NOT_INTEGER"))
+    elif not 0 <= ri <= 4294967295:
+        issues.append(Issue("DMARC_RI_RANGE"))
+        ri = None
+    return ri
+
+
+def _pct(tag: str, value: str, issues: list):
+    pct = _integer(value)
+    if pct is None:
+        issues.append(Issue("DMARC_PCT_NOT_INTEGER"))
+    elif not 0 <= pct <= 100:
+        issues.append(Issue("DMARC_PCT_RANGE"))
+        pct = None
+    elif pct < 100:
+        issues.append(Issue("DMARC_PCT_LT_100"))
+    return pct
+
+
+# tag -> (DMARCRecord attribute, function typing its value and listing its
+# issues)
+TAG_PARSERS = {
+    "p": ("policy", _policy),
+    "sp": ("subdomain_policy", _policy),
+    "rua": ("rua", _uris),
+    "ruf": ("ruf", _uris),
+    "fo": ("fo", _fo),
+    "adkim": ("adkim", _choice),
+    "aspf": ("aspf", _choice),
+    "rf": ("rf", _choice),
+    "ri": ("ri", _ri),
+    "pct": ("pct", _pct),
+}
+
+
+@lru_cache(maxsize=4096)
+def parse_dmarc(record: str):
+    # Split a DMARC record into its tags and their typed values in one pass.
+    # Returns a DMARCRecord, or None when the string is not a DMARC record
+    if not record.startswith("v=DMARC1"):
+        return None
+    parsed = DMARCRecord(record)
+    arguments = [argument.strip() for argument in record.split(";")][1:]
+    if arguments and arguments[-1] == "":
+        arguments.pop()
+    else:
+        parsed.terminated = False
+    parsed.arguments = tuple(arguments)
+    parsed.tags = tuple(argument.partition("=")[::2] for argument in arguments)
+
+    # Every occurrence of a tag is checked, the first one gives the value
+    errors = []
+    tag_issues = []
+    seen = set()
+    for name, value in parsed.tags:
+        issues = []
+        tag_issues.append(issues)
+        if name not in TAG_PARSERS:
+            issues.append(Issue("DMARC_INVALID_TAG", (name,)))
+            continue
+        attribute, parse = TAG_PARSERS[name]
+        typed = parse(name, value, issues)
+        if name in seen:
+            errors.append(Issue("DMARC_DUPLICATE_TAG", (name,)))
+            continue
+        seen.add(name)
+        setattr(parsed, attribute, typed)
+    if "p" not in seen:
+        errors.append(Issue("DMARC_POLICY_MISSING"))
+    parsed.tag_issues = tuple(tuple(issues) for issues in tag_issues)
+    parsed.errors = tuple(
+        {(issue.code, issue.args): issue for issue in errors}.values()
+    )
+    if "sp" not in seen or parsed.subdomain_policy is None:
+        parsed.subdomain_policy = parsed.policy
+    return parsed
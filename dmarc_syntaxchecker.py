@@ -1,188 +1,111 @@
-import dns.resolver
+from dmarc_parser import parse_dmarc
+from dns_cache import Deadline
+from observers import Mechanism, ObserverGroup, TimingTree
+from report_authorization import ReportAuthorizations, report_name, wildcard_name
+from results import Result, throw_issue
 
 
 # Helping functions
-def throw_issue(severity: str, message: str, issues: list):
-    issues.append({"severity": severity, "message": message})
-
-
-def validate_domain(host_portion: str, domain: str):
-
-    check = False
-
-    if host_portion == domain:
-        return True
-
-    host_portion = domain + "._report._dmarc." + host_portion
-
-    try:
-        text_record = dns.resolver.resolve(host_portion, "txt")
-    except:
-        return False
-    else:
-        for record in text_record:
-            record = str(record)
-            if record.find("v=DMARC1") > 0:
-                check = True
-
-    # could ask server if email name exists but not optimal and not always important
-    return check
+def throw_timed_out(issues: list):
+    if not any(issue.code == "DMARC_TIMED_OUT" for issue in issues):
+        throw_issue("DMARC_TIMED_OUT", issues)
 
 
 # Validating DMARC record
-def validate_dmarc(record: str, domain: str):
+# With resolve=False no DNS query is made, the report authorization records
+# that would be checked are returned under "dependencies". observer receives
+# query and tag events (see observers), with timings=True a tree of them is
+# returned under "timings". timeout bounds the report authorization checks in
+# seconds and query_timeout every single query, the checks that did not fit
+# are skipped with a timed out issue
+def validate_dmarc(
+    record: str,
+    domain: str,
+    resolve: bool = True,
+    observer=None,
+    timings: bool = False,
+    timeout: float = None,
+    query_timeout: float = None,
+):
+    deadline = None
+    if timeout is not None or query_timeout is not None:
+        deadline = Deadline(timeout, query_timeout)
+    tree = TimingTree(domain) if timings else None
+    if tree is not None:
+        observer = ObserverGroup(observer, tree)
     issues = []
+    dependencies = []
     test_status = True
 
-    if not record.startswith("v=DMARC1"):
-        throw_issue("critical", "DMARC record does not start with v=DMARC1", issues)
+    parsed = parse_dmarc(record)
+    if parsed is None:
+        throw_issue("DMARC_NOT_DMARC", issues)
         test_status = False
-        return {"status": test_status, "issues": issues}
+        return Result(status=test_status, issues=issues, dependencies=dependencies)
 
-    user_tags = [tag.strip() for tag in record.split(";")]
-    user_tags.pop(0)
-    if user_tags[-1] == "":
-        user_tags.pop(-1)
-    else:
-        throw_issue(
-            "error", "DMARC record does not end with a semicolon - there must be one after every tag", issues
-        )
+    if not parsed.terminated:
+        throw_issue("DMARC_NO_SEMICOLON", issues)
         test_status = False
 
-    for tag in user_tags:
-        validate_tag(tag, issues, domain)
+    # The report authorization checks of every rua/ruf address are resolved
+    # together, when the first of them is needed
+    hosts = [uri.host for uri in parsed.rua + parsed.ruf if uri.host is not None]
+    authorizations = ReportAuthorizations(domain, hosts, observer, deadline)
+    seen = set()
+    for (tag, _), argument, tag_issues in zip(
+        parsed.tags, parsed.arguments, parsed.tag_issues
+    ):
+        mechanism = None
+        if observer is not None:
+            mechanism = Mechanism(observer, domain, argument, 0)
+        # The static rules were checked by the parser, see dmarc_parser
+        issues.extend(tag_issues)
+        if tag in ("rua", "ruf") and tag not in seen:
+            validate_reports(
+                tag,
+                getattr(parsed, tag),
+                issues,
+                domain,
+                resolve,
+                dependencies,
+                authorizations,
+            )
+        seen.add(tag)
+        if mechanism is not None:
+            mechanism.close(observer)
+    # Duplicate tags and a missing p, found by the parser
+    issues.extend(parsed.errors)
     if len(issues) > 0:
         test_status = False
-    return {"status": test_status, "issues": issues}
-
-
-# Validating tags
-def validate_tag(argument: str, issues: list, domain: str):
-    tag = argument.split("=")[0]
-    if len(argument.split("=")) > 1:
-        value = argument.split("=")[1]
-
-
-    tag_rules = {
-        "p": ["none", "quarantine", "reject"],
-        "sp": ["none", "quarantine", "reject"],
-        "rua": ["email"],
-        "ruf": ["email"],
-        "fo": ["0", "1", "d", "s"],  # list
-        "adkim": ["s", "r"],
-        "aspf": ["s", "r"],
-        "rf": ["afrf"],
-        "ri": "32-bit unsigned integer",
-        "pct": [0, 100],
-    }
-
-    if tag not in tag_rules.keys():
-        throw_issue("error", f"Invalid tag: {tag}", issues)
-        return issues
-    match tag:
-        case "ri":
-            try:
-                value = int(value)
-            except:
-                throw_issue(
-                    "error", "ri tag value must be a 32-bit unsigned integer", issues
-                )
-            else:
-                if value < 0 or value > 4294967295:
-                    throw_issue(
-                        "error", "ri tag value is not a 32-bit unsigned integer", issues
-                    )
-
-        case "pct":
-            try:
-                value = int(value)
-            except:
-                throw_issue(
-                    "error",
-                    "pct tag value must be an integer between 0 and 100 prefferably 100",
-                    issues,
-                )
-            else:
-                if value < 0 or value > 100:
-                    throw_issue(
-                        "error",
-                        "pct tag value must be between 0 and 100 prefferably 100",
-                        issues,
-                    )
-                elif value < 100:
-                    throw_issue(
-                        "warning", "It is safer if pct tag value is set to 100", issues
-                    )
-
-        case "fo":
-            values = value.split(":")
-            used_values = []
-            for value in values:
-                if value not in tag_rules["fo"]:
-                    throw_issue("error", f"Invalid value: {value} in fo tag it should be one of: {tag_rules["fo"]}", issues)
-                else:
-                    if value in used_values:
-                        throw_issue("error", f"Duplicate value in fo tag", issues)
-                    used_values.append(value)
-
-
-        # TO DO: Fix this code, make it explain why the email is invalid
-
-        case "rua" | "ruf":
-            mails = value.split(",")
-            for mail in mails:
-                if not mail.startswith("mailto:"):
-                    throw_issue("error", f"Invalid email in {tag} tag", issues)
-                else:
-                    mail = mail.replace("mailto:", "")
-                    if not "@" in mail:
-                        throw_issue("error", f"Invalid email in {tag} tag", issues)
-                    else:
-                        mail = mail.split("@")
-                        if len(mail) != 2:
-                            throw_issue(
-                                "error", f"Invalid email in {tag} tag", issues
-                            )
-                        else:
-                            if mail[1].startswith("."):
-                                throw_issue(
-                                    "error",
-                                    f"Invalid email in {tag} tag. Domain should not start with a .",
-                                    issues,
-                                )
-                            elif mail[0].endswith(".") or mail[0].startswith("."):
-                                throw_issue(
-                                    "error",
-                                    f"Invalid email in {tag} tag. Mail should not start nor  end with a .",
-                                    issues,
-                                )
-                            elif mail[0].find("..") > 0:
-                                throw_issue(
-                                    "error",
-                                    f"Invalid email in {tag} tag. Mail should not include ..",
-                                    issues,
-                                )
-                        if not validate_domain(mail[1], domain):
-                            throw_issue(
-                                "error",
-                                f"Email: {mail[1]} provided in {tag} tag does not accept reports from your domain or is invalid.",
-                                issues,
-                            )
-
-        case _:
-            if value not in tag_rules[tag]:
-                rule = tag_rules[tag][0]
-                rules = f"{rule}"
-                for i in range(1, len(tag_rules[tag])):
-                    rules += " or " + tag_rules[tag][i]
-                throw_issue("error", f"Tag {tag} value must be {rules}", issues)
-
-            if tag == "p" or tag == "sp":
-                if value == "none":
-                    throw_issue(
-                        "warning",
-                        f"Tag {tag} is set to none. It is recommended to set it to quarantine or reject",
-                        issues,
-                    )
-
-        
+    result = Result(status=test_status, issues=issues, dependencies=dependencies)
+    if tree is not None:
+        result["timings"] = tree.finish()
+    return result
+
+
+# Validating report addresses
+def validate_reports(
+    tag: str,
+    uris: tuple,
+    issues: list,
+    domain: str,
+    resolve: bool,
+    dependencies: list,
+    authorizations: ReportAuthorizations,
+):
+    # Addresses on other hosts must be authorized by them, the syntax errors
+    # of the URIs are among the tag issues already
+    for uri in uris:
+        if uri.host is None:
+            continue
+        if uri.host != domain:
+            for name in (wildcard_name(uri.host), report_name(domain, uri.host)):
+                if (name, "TXT") not in dependencies:
+                    dependencies.append((name, "TXT"))
+        if not resolve:
+            continue
+        authorized = authorizations.get(uri.host)
+        if authorized is None:
+            throw_timed_out(issues)
+        elif not authorized:
+            throw_issue("DMARC_REPORTS_NOT_ACCEPTED", issues, uri.host, tag)
@@ -0,0 +1,195 @@
+import threading
+import time
+
+import dns.resolver
+
+# A backend answers (name, rdtype) queries with the answers in text form,
+# the way str(rdata) prints them, and the TTL of the answer:
+#
+#     records, ttl = backend.resolve(name, rdtype, lifetime)
+#     records, ttl = await backend.resolve_async(name, rdtype, lifetime)
+#
+# Missing names raise dns.resolver.NXDOMAIN and missing types
+# dns.resolver.NoAnswer, exactly like dnspython. A query that takes longer
+# than lifetime seconds raises dns.resolver.LifetimeTimeout, None means the
+# resolver default. The asynchronous and zone file parts of dnspython, and
+# asyncio, are imported when they are first used.
+
+
+class LiveResolver:
+    # Queries the system resolver through dnspython
+
+    def resolve(self, name: str, rdtype: str, lifetime: float = None):
+        answer = dns.resolver.resolve(name, rdtype, lifetime=lifetime)
+        return [str(record) for record in answer], answer.rrset.ttl
+
+    async def resolve_async(self, name: str, rdtype: str, lifetime: float = None):
+        import dns.asyncresolver
+
+        answer = await dns.asyncresolver.resolve(name, rdtype, lifetime=lifetime)
+        return [str(record) for record in answer], answer.rrset.ttl
+
+
+def _quote_txt(value: str):
+    # Presentation form of a TXT record given as plain text, split into 255
+    # byte character-strings
+    if value.startswith('"'):
+        return value
+    value = value.replace("\\", "\\\\").replace('"', '\\"')
+    strings = [value[index : index + 255] for index in range(0, len(value), 255)]
+    return " ".join(f'"{string}"' for string in strings or [""])
+
+
+class ZoneResolver:
+    # In-memory stand-in for DNS, loaded from a BIND-style zone file, a YAML
+    # fixture or a dict, with an optional simulated latency per query.
+    # latency is a number of seconds or a function of (name, rdtype)
+
+    def __init__(self, records: dict = None, latency=0.0, default_ttl: int = 300):
+        self.latency = latency
+        self.default_ttl = default_ttl
+        self.log = []
+        self.queries = 0
+        self.async_queries = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._records = {}
+        self._lock = threading.Lock()
+        for name, types in (records or {}).items():
+            ttl = types.get("ttl", default_ttl)
+            for rdtype, values in types.items():
+                if rdtype != "ttl":
+                    self.add(name, rdtype, values, ttl)
+
+    @classmethod
+    def from_zone_text(cls, text: str, **kwargs):
+        # Names are taken as absolute, $ORIGIN and $TTL work as usual
+        import dns.rdatatype
+        import dns.zone
+
+        zone = dns.zone.from_text(
+            text, origin=".", relativize=False, check_origin=False
+        )
+        resolver = cls(**kwargs)
+        for name, rdataset in zone.iterate_rdatasets():
+            resolver.add(
+                name.to_text(omit_final_dot=True),
+                dns.rdatatype.to_text(rdataset.rdtype),
+                [str(rdata) for rdata in rdataset],
+                rdataset.ttl,
+            )
+        return resolver
+
+    @classmethod
+    def from_yaml_text(cls, text: str, **kwargs):
+        # {name: {rdtype: [values], ttl: seconds}}, needs PyYAML
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Run pip install pyyaml to load YAML fixtures")
+        return cls(yaml.safe_load(text) or {}, **kwargs)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs):
+        with open(path) as file:
+            text = file.read()
+        if str(path).endswith((".yaml", ".yml")):
+            return cls.from_yaml_text(text, **kwargs)
+        return cls.from_zone_text(text, **kwargs)
+
+    def add(self, name: str, rdtype: str, values: list, ttl: int = None):
+        rdtype = rdtype.upper()
+        if isinstance(values, str):
+            values = [values]
+        if rdtype == "TXT":
+            values = [_quote_txt(value) for value in values]
+        types = self._records.setdefault(name.lower().rstrip("."), {})
+        types[rdtype] = (
+            [str(value) for value in values],
+            self.default_ttl if ttl is None else ttl,
+        )
+
+    def remove(self, name: str, rdtype: str = None):
+        name = name.lower().rstrip(".")
+        if rdtype is None:
+            self._records.pop(name, None)
+            return
+        types = self._records.get(name, {})
+        types.pop(rdtype.upper(), None)
+        if not types:
+            self._records.pop(name, None)
+
+    def _answer(self, name: str, rdtype: str):
+        name = name.lower().rstrip(".")
+        types = self._records.get(name)
+
+        # Wildcards stand in for names that do not exist
+        if types is None:
+            labels = name.split(".")
+            for index in range(1, len(labels)):
+                types = self._records.get(".".join(["*"] + labels[index:]))
+                if types is not None:
+                    break
+            else:
+                raise dns.resolver.NXDOMAIN()
+
+        answer = types.get(rdtype.upper())
+        if answer is None:
+            raise dns.resolver.NoAnswer()
+        return list(answer[0]), answer[1]
+
+    def _delay(self, name: str, rdtype: str):
+        if callable(self.latency):
+            return self.latency(name, rdtype)
+        return self.latency
+
+    @staticmethod
+    def _timeout(lifetime: float):
+        return dns.resolver.LifetimeTimeout(timeout=lifetime, errors=[])
+
+    def _start(self, name: str, rdtype: str):
+        with self._lock:
+            self.log.append((name, rdtype))
+            self.queries += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def resolve(self, name: str, rdtype: str, lifetime: float = None):
+        self._start(name, rdtype)
+        try:
+            delay = self._delay(name, rdtype)
+            if lifetime is not None and delay > lifetime:
+                time.sleep(lifetime)
+                raise self._timeout(lifetime)
+            if delay:
+                time.sleep(delay)
+            return self._answer(name, rdtype)
+        finally:
+            self._finish()
+
+    async def resolve_async(self, name: str, rdtype: str, lifetime: float = None):
+        import asyncio
+
+        self._start(name, rdtype)
+        self.async_queries += 1
+        try:
+            delay = self._delay(name, rdtype)
+            if lifetime is not None and delay > lifetime:
+                await asyncio.sleep(lifetime)
+                raise self._timeout(lifetime)
+            if delay:
+                await asyncio.sleep(delay)
+            return self._answer(name, rdtype)
+        finally:
+            self._finish()
+
+    def reset_stats(self):
+        with self._lock:
+            self.log = []
+            self.queries = 0
+            self.async_queries = 0
+            self.peak_in_flight = self.in_flight
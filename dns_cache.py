@@ -0,0 +1,533 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from patterns import LazyPattern
+
+# Answers are cached in the same text form the validators used to build from
+# the rdata objects (str(rdata)), so cached and live lookups are interchangeable.
+#
+# dnspython and asyncio are imported the first time they are needed, offline
+# checks (resolve=False) start without them. NEGATIVE_ERRORS, the exceptions
+# of negative answers, is therefore read as dns_cache.NEGATIVE_ERRORS where it
+# is caught: the first read imports dnspython
+
+# Character-strings of a TXT record in presentation form and their escapes
+TXT_STRING_REGEX = LazyPattern(r'(?s)\s*(?:"((?:[^"\\]|\\.)*)"|((?:[^\s"\\]|\\.)+))')
+TXT_ESCAPE_REGEX = LazyPattern(rb"(?s)\\(?:([0-9]{3})|(.))")
+
+
+def _dns():
+    # Import dnspython, once
+    global dns, NEGATIVE_ERRORS
+    if "NEGATIVE_ERRORS" not in globals():
+        import dns.exception
+        import dns.rdatatype
+        import dns.resolver
+
+        NEGATIVE_ERRORS = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+    return dns
+
+
+def __getattr__(name: str):
+    if name in ("NEGATIVE_ERRORS", "dns"):
+        _dns()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class CacheEntry:
+    __slots__ = ("records", "error", "expires")
+
+    def __init__(self, records: list, error, expires: float):
+        self.records = records
+        self.error = error
+        self.expires = expires
+
+
+class DNSCache:
+    # TTL-aware LRU cache of DNS answers, negative answers included. store is
+    # an optional second level shared between processes, misses are looked up
+    # there and every answer is written through, see persistent_cache
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        negative_ttl: int = 300,
+        max_ttl: int = 86400,
+        clock=time.monotonic,
+        store=None,
+    ):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, rdtype: str):
+        key = cache_key(name, rdtype)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        if self.store is not None:
+            stored = self.store.get_answer(name, rdtype)
+            if stored is not None:
+                records, error, ttl = stored
+                entry = self._insert(key, records, error, ttl)
+                with self._lock:
+                    self.hits += 1
+                    self.store_hits += 1
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _insert(self, key: tuple, records: list, error, ttl: float):
+        entry = CacheEntry(records, error, self.clock() + ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def set(self, name: str, rdtype: str, records: list, ttl: int, error=None):
+        ttl = max(0, min(ttl, self.max_ttl))
+        if ttl == 0 or self.max_size <= 0:
+            return
+        self._insert(cache_key(name, rdtype), records, error, ttl)
+        if self.store is not None:
+            self.store.set_answer(name, rdtype, records, ttl, error)
+
+    def ttl(self, name: str, rdtype: str):
+        # Remaining lifetime of a cached answer in seconds, None if not cached
+        with self._lock:
+            entry = self._entries.get(cache_key(name, rdtype))
+            if entry is None:
+                return None
+            return max(0.0, entry.expires - self.clock())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.store_hits = 0
+
+    def snapshot(self):
+        # (name, rdtype, records, error, remaining ttl) of every live entry,
+        # to seed the cache of another process
+        now = self.clock()
+        with self._lock:
+            return [
+                (name, rdtype, entry.records, entry.error, entry.expires - now)
+                for (name, rdtype), entry in self._entries.items()
+                if entry.expires > now
+            ]
+
+    def load(self, entries: list):
+        # Insert the entries of a snapshot, without writing them through
+        for name, rdtype, records, error, ttl in entries:
+            self._insert(cache_key(name, rdtype), records, error, ttl)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "store_hits": self.store_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cache_key(name: str, rdtype: str):
+    return (name.lower().rstrip("."), rdtype.upper())
+
+
+def negative_ttl(error, default: int):
+    # RFC 2308: negative answers live for min(SOA TTL, SOA MINIMUM) when the
+    # authority section carries the zone's SOA record
+    dns = _dns()
+    try:
+        if isinstance(error, dns.resolver.NXDOMAIN):
+            responses = list(error.responses().values())
+        else:
+            responses = [error.response()]
+    except Exception:
+        return default
+
+    ttls = []
+    for response in responses:
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                ttls.append(min(rrset.ttl, rrset[0].minimum))
+    return min(ttls) if ttls else default
+
+
+def _unescape(match):
+    if match[1] is None:
+        return match[2]
+    value = int(match[1])
+    if value > 255:
+        raise ValueError(match[0])
+    return bytes((value,))
+
+
+def txt_string(record: str):
+    # Join the character-strings of a TXT answer in presentation form
+    # ('"v=spf1 " "-all"') into the record text the checks operate on, \"
+    # and \DDD escapes decoded as dnspython does
+    strings = []
+    position = 0
+    end = len(record.rstrip())
+    while position < end:
+        match = TXT_STRING_REGEX.match(record, position)
+        if match is None:
+            return record.strip('"')
+        strings.append(match[2] if match[1] is None else match[1])
+        position = match.end()
+    if not strings:
+        return record.strip('"')
+    text = "".join(strings)
+    if "\\" not in text:
+        return text
+    try:
+        data = TXT_ESCAPE_REGEX.sub(_unescape, text.encode("utf-8"))
+    except ValueError:
+        return record.strip('"')
+    return data.decode("utf-8", "replace")
+
+
+class Deadline:
+    # Time budget of one validation. Every query is bounded by query_timeout
+    # and by the time left, so a slow nameserver cannot stall the walk for
+    # more than what remains of the budget. None means no bound
+    __slots__ = ("expires", "query_timeout", "clock")
+
+    def __init__(
+        self,
+        timeout: float = None,
+        query_timeout: float = None,
+        clock=time.monotonic,
+    ):
+        self.clock = clock
+        self.expires = None if timeout is None else clock() + timeout
+        self.query_timeout = query_timeout
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - self.clock())
+
+    def expired(self):
+        return self.expires is not None and self.clock() >= self.expires
+
+    def lifetime(self):
+        # Lifetime of the next query
+        remaining = self.remaining()
+        if remaining is None:
+            return self.query_timeout
+        if self.query_timeout is None:
+            return remaining
+        return min(remaining, self.query_timeout)
+
+
+def query_lifetime(deadline: Deadline = None):
+    return None if deadline is None else deadline.lifetime()
+
+
+_default_cache = DNSCache()
+_resolver = None
+_max_concurrency = 64
+_limiters = weakref.WeakKeyDictionary()
+
+# Single-flight: a query that is already in flight for the same cache is
+# waited for instead of being sent again, across threads and across tasks of
+# an event loop
+_flights = {}
+_flights_lock = threading.Lock()
+_async_flights = weakref.WeakKeyDictionary()
+shared_queries = 0
+
+
+def get_default_cache():
+    return _default_cache
+
+
+def set_default_cache(cache: DNSCache):
+    # Swap the cache shared by the SPF and DMARC validators
+    global _default_cache
+    _default_cache = cache
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        from dns_backends import LiveResolver
+
+        _resolver = LiveResolver()
+    return _resolver
+
+
+def set_resolver(resolver):
+    # Swap the backend queried on cache misses, see dns_backends
+    global _resolver
+    _resolver = resolver
+
+
+def set_query_timeout(timeout: float):
+    # Lifetime of a single query, including retries, for sync and async lookups
+    import dns.asyncresolver
+
+    dns = _dns()
+    dns.resolver.get_default_resolver().lifetime = timeout
+    dns.asyncresolver.get_default_resolver().lifetime = timeout
+
+
+def set_concurrency_limit(limit: int):
+    # Upper bound on the asynchronous queries in flight per event loop
+    global _max_concurrency
+    _max_concurrency = limit
+    _limiters.clear()
+
+
+def _limiter():
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = asyncio.Semaphore(_max_concurrency)
+        _limiters[loop] = limiter
+    return limiter
+
+
+def query_outcome(error: Exception = None):
+    # Short name of how a query ended, reported to observers
+    if error is None:
+        return "answer"
+    dns = _dns()
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return "nxdomain"
+    if isinstance(error, dns.resolver.NoAnswer):
+        return "noanswer"
+    if isinstance(error, dns.exception.Timeout):
+        return "timeout"
+    if isinstance(error, dns.resolver.NoNameservers):
+        return "servfail"
+    return "error"
+
+
+def _report(observer, name: str, rdtype: str, start: float, cached: bool, error):
+    observer.on_query(
+        {
+            "name": name,
+            "rdtype": rdtype,
+            "duration": time.perf_counter() - start,
+            "outcome": query_outcome(error),
+            "cached": cached,
+            "error": None if error is None else repr(error),
+        }
+    )
+
+
+def _cached(cache: DNSCache, name: str, rdtype: str):
+    entry = cache.get(name, rdtype)
+    if entry is not None and entry.error is not None:
+        raise entry.error()
+    return entry
+
+
+def _store(cache: DNSCache, name: str, rdtype: str, answer):
+    records, ttl = answer
+    cache.set(name, rdtype, records, ttl)
+    return list(records)
+
+
+class _Flight:
+    __slots__ = ("done", "records", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.records = None
+        self.error = None
+
+
+def _timed_out(lifetime: float):
+    dns = _dns()
+    return dns.resolver.LifetimeTimeout(timeout=lifetime, errors=[])
+
+
+def _query(cache: DNSCache, name: str, rdtype: str, lifetime: float):
+    _dns()
+    try:
+        answer = get_resolver().resolve(name, rdtype, lifetime)
+    except NEGATIVE_ERRORS as error:
+        cache.set(
+            name, rdtype, [], negative_ttl(error, cache.negative_ttl), type(error)
+        )
+        raise
+    return _store(cache, name, rdtype, answer)
+
+
+def _resolve(cache: DNSCache, name: str, rdtype: str, lifetime: float):
+    global shared_queries
+    entry = _cached(cache, name, rdtype)
+    if entry is not None:
+        return list(entry.records)
+
+    key = (id(cache),) + cache_key(name, rdtype)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            shared_queries += 1
+
+    if not leader:
+        if not flight.done.wait(lifetime):
+            raise _timed_out(lifetime)
+        if flight.error is not None:
+            raise flight.error
+        return list(flight.records)
+
+    try:
+        flight.records = _query(cache, name, rdtype, lifetime)
+        return list(flight.records)
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def resolve(
+    name: str,
+    rdtype: str,
+    cache: DNSCache = None,
+    observer=None,
+    lifetime: float = None,
+):
+    # Resolve name/rdtype through the cache and return the answers as strings.
+    # NXDOMAIN and NoAnswer are cached too and raised again on every hit.
+    # observer gets a query event, see observers. A query that does not end
+    # within lifetime seconds raises dns.resolver.LifetimeTimeout
+    if cache is None:
+        cache = _default_cache
+    if observer is None:
+        return _resolve(cache, name, rdtype, lifetime)
+
+    start = time.perf_counter()
+    cached = bool(cache.ttl(name, rdtype))
+    try:
+        records = _resolve(cache, name, rdtype, lifetime)
+    except Exception as error:
+        _report(observer, name, rdtype, start, cached, error)
+        raise
+    _report(observer, name, rdtype, start, cached, None)
+    return records
+
+
+async def _query_async(cache: DNSCache, name: str, rdtype: str, lifetime: float):
+    _dns()
+    async with _limiter():
+        try:
+            answer = await get_resolver().resolve_async(name, rdtype, lifetime)
+        except NEGATIVE_ERRORS as error:
+            cache.set(
+                name, rdtype, [], negative_ttl(error, cache.negative_ttl), type(error)
+            )
+            raise
+    return _store(cache, name, rdtype, answer)
+
+
+async def _resolve_async(cache: DNSCache, name: str, rdtype: str, lifetime: float):
+    global shared_queries
+    entry = _cached(cache, name, rdtype)
+    if entry is not None:
+        return list(entry.records)
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    flights = _async_flights.setdefault(loop, {})
+    key = (id(cache),) + cache_key(name, rdtype)
+    flight = flights.get(key)
+    if flight is not None:
+        shared_queries += 1
+        try:
+            records = await asyncio.wait_for(asyncio.shield(flight), lifetime)
+        except asyncio.TimeoutError:
+            raise _timed_out(lifetime)
+        except asyncio.CancelledError:
+            # The task that sent the query was cancelled, not this one
+            if not flight.cancelled():
+                raise
+            return await _resolve_async(cache, name, rdtype, lifetime)
+        return list(records)
+
+    flight = flights[key] = loop.create_future()
+    try:
+        records = await _query_async(cache, name, rdtype, lifetime)
+    except BaseException as error:
+        if isinstance(error, Exception):
+            flight.set_exception(error)
+            # Nobody may be waiting, the leader raises the error itself
+            flight.exception()
+        else:
+            flight.cancel()
+        raise
+    else:
+        flight.set_result(records)
+        return list(records)
+    finally:
+        del flights[key]
+
+
+async def resolve_async(
+    name: str,
+    rdtype: str,
+    cache: DNSCache = None,
+    observer=None,
+    lifetime: float = None,
+):
+    # Asynchronous counterpart of resolve() sharing the same cache, at most
+    # set_concurrency_limit() queries are sent at once
+    if cache is None:
+        cache = _default_cache
+    if observer is None:
+        return await _resolve_async(cache, name, rdtype, lifetime)
+
+    start = time.perf_counter()
+    cached = bool(cache.ttl(name, rdtype))
+    try:
+        records = await _resolve_async(cache, name, rdtype, lifetime)
+    except Exception as error:
+        _report(observer, name, rdtype, start, cached, error)
+        raise
+    _report(observer, name, rdtype, start, cached, None)
+    return records
@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import bisect
+import collections
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import dns_cache
+from async_validator import validate_dmarc_async, validate_spf_async
+from dns_cache import Deadline, DNSCache
+from persistent_cache import RESULT_TTL, Dependencies
+from process_pool import warm_up
+from records import KINDS, find_records_async, missing_record
+from results import jsonable, throw_issue, timed_out
+
+# Local HTTP validation service on asyncio streams:
+#
+#     python http_service.py --port 8080
+#
+#     GET /spf?domain=example.com              {"domain": ..., "spf": ...}
+#     GET /dmarc?domain=example.com            {"domain": ..., "dmarc": ...}
+#     GET /check?domain=example.com            both records
+#     GET /spf?domain=example.com&record=...   validate the given record, on
+#                                              /spf and /dmarc only
+#     GET /metrics                             latencies, caches and queue
+#
+# The process keeps one resolver and one DNS cache for every request, and the
+# results of looked up records for as long as the answers they were built
+# from (see persistent_cache.Dependencies). Identical requests that arrive
+# while one is being computed wait for that computation instead of starting
+# their own. Computations go through a bounded queue served by a fixed number
+# of workers, a request that finds the queue full gets 503 right away. Records
+# are looked up with the asynchronous resolver and the synchronous validation
+# pass runs in a thread (see async_validator), so a slow query never holds up
+# the other requests.
+
+DEFAULT_TIMEOUT = 10.0
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROUTES = {"/spf": ("spf",), "/dmarc": ("dmarc",), "/check": KINDS}
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Overloaded(Exception):
+    # The request queue is full
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Histogram:
+    # Latencies counted into fixed buckets
+
+    def __init__(self, bounds: tuple = BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+
+    def report(self):
+        # {"count", "sum", "buckets"} where the buckets are cumulative counts
+        # by upper bound, as in Prometheus histograms
+        buckets = {}
+        count = 0
+        for bound, hits in zip(self.bounds + ("+Inf",), self.counts):
+            count += hits
+            buckets[str(bound)] = count
+        return {"count": count, "sum": round(self.sum, 6), "buckets": buckets}
+
+
+async def check_async(
+    kind: str, domain: str, record: str = None, timeout: float = None, observer=None
+):
+    # Asynchronous checker.check, the record is looked up unless it is given.
+    # timeout covers the lookup and the validation
+    deadline = Deadline(timeout)
+    if record is None:
+        records = await find_records_async(kind, domain, deadline.remaining(), observer)
+        if not records and deadline.expired():
+            # Not missing, the lookup ran out of time
+            issues = []
+            throw_issue(f"{kind.upper()}_TIMED_OUT", issues)
+            return {"record": None, "status": False, "issues": issues}
+        if len(records) != 1:
+            return missing_record(kind, records)
+        record = records[0]
+    validate = validate_spf_async if kind == "spf" else validate_dmarc_async
+    result = await validate(
+        record, domain, observer=observer, timeout=deadline.remaining()
+    )
+    return {"record": record, **result}
+
+
+class ValidationService:
+    # Validation results shared between the requests of a process. Results of
+    # looked up records are kept in a DNSCache used as a TTL map, by domain
+    # and kind. Results of records given in the request are not kept, they
+    # are cheap to recompute on the warm DNS cache
+
+    def __init__(
+        self,
+        workers: int = 16,
+        queue_size: int = 256,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_results: int = 10000,
+        result_ttl: float = RESULT_TTL,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.results = DNSCache(max_size=max_results, max_ttl=result_ttl)
+        self.queue = asyncio.Queue(queue_size)
+        self.in_flight = {}
+        self.coalesced = 0
+        self.rejected = 0
+        self.latency = collections.defaultdict(Histogram)
+        self.responses = collections.Counter()
+        self._tasks = []
+
+    async def start(self):
+        # Compile the parsers and create the resolver before the first
+        # request, then start the workers
+        warm_up()
+        dns_cache.get_resolver()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for flight in self.in_flight.values():
+            flight.cancel()
+        self.in_flight.clear()
+
+    async def _work(self):
+        while True:
+            key, flight = await self.queue.get()
+            try:
+                result = await self._compute(*key)
+            except asyncio.CancelledError:
+                # Stopped in the middle, the waiters must not wait forever
+                flight.cancel()
+                raise
+            except Exception as error:
+                flight.set_exception(error)
+                # Every waiter may have gone away, they raise it themselves
+                flight.exception()
+            else:
+                flight.set_result(result)
+            finally:
+                del self.in_flight[key]
+                self.queue.task_done()
+
+    async def _compute(self, kind: str, domain: str, record: str):
+        dependencies = Dependencies()
+        result = await check_async(kind, domain, record, self.timeout, dependencies)
+        if record is None and not timed_out(result):
+            self.results.set(domain, kind, result, dependencies.ttl(self.result_ttl))
+        return result
+
+    async def validate(self, kind: str, domain: str, record: str = None):
+        # Result of the SPF or DMARC record of domain. Raises Overloaded when
+        # the computation would have to be queued and the queue is full
+        domain = domain.lower().rstrip(".")
+        if record is None:
+            entry = self.results.get(domain, kind)
+            if entry is not None:
+                return entry.records
+        key = (kind, domain, record)
+        flight = self.in_flight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            flight = asyncio.get_running_loop().create_future()
+            try:
+                self.queue.put_nowait((key, flight))
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise Overloaded("Too many requests in the queue") from None
+            self.in_flight[key] = flight
+        # A client that goes away does not cancel the shared computation
+        return await asyncio.shield(flight)
+
+    def metrics(self):
+        return {
+            "latency": {path: self.latency[path].report() for path in self.latency},
+            "responses": {str(status): n for status, n in self.responses.items()},
+            "result_cache": self.results.stats(),
+            "dns_cache": dns_cache.get_default_cache().stats(),
+            "shared_queries": dns_cache.shared_queries,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "queue": {"depth": self.queue.qsize(), "size": self.queue.maxsize},
+            "in_flight": len(self.in_flight),
+        }
+
+    async def respond(self, method: str, target: str):
+        # (status, payload) of one request
+        url = urlsplit(target)
+        if url.path == "/metrics":
+            return (200, self.metrics()) if method == "GET" else (405, None)
+        if url.path not in ROUTES:
+            return 404, {"error": f"Unknown path: {url.path}"}
+        if method != "GET":
+            return 405, {"error": f"Method not allowed: {method}"}
+        query = parse_qs(url.query)
+        domain = query.get("domain", [""])[0].strip()
+        record = query.get("record", [None])[0]
+        if not domain:
+            return 400, {"error": "domain is required"}
+        kinds = ROUTES[url.path]
+        # A given record is of one kind, it cannot be checked as both
+        if record is not None and len(kinds) > 1:
+            return 400, {"error": f"record is not accepted on {url.path}"}
+
+        start = time.perf_counter()
+        try:
+            results = await asyncio.gather(
+                *(self.validate(kind, domain, record) for kind in kinds)
+            )
+        except Overloaded as error:
+            return 503, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+        finally:
+            self.latency[url.path].observe(time.perf_counter() - start)
+        return 200, {"domain": domain, **dict(zip(kinds, results))}
+
+    async def handle(self, reader, writer):
+        # Connection handler for asyncio.start_server, requests are answered
+        # one after the other while the client keeps the connection open
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as error:
+                    writer.write(response(400, {"error": str(error)}, False))
+                    self.responses[400] += 1
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" and (
+                    version == "HTTP/1.1" or connection == "keep-alive"
+                )
+                status, payload = await self.respond(method, target)
+                self.responses[status] += 1
+                writer.write(response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    # (method, target, version, headers) of the next request, None when the
+    # client closed the connection. Request bodies are read and ignored
+    try:
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise BadRequest("Malformed request line")
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, colon, value = line.decode("latin-1").partition(":")
+            if not colon:
+                raise BadRequest("Malformed header")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length", "0")
+        if not length.isdigit():
+            raise BadRequest("Invalid Content-Length")
+        await reader.readexactly(int(length))
+    except (ValueError, asyncio.IncompleteReadError):
+        # ValueError is a line longer than the stream limit
+        raise BadRequest("Malformed request") from None
+    return parts[0].upper(), parts[1], parts[2], headers
+
+
+def response(status: int, payload, keep_alive: bool = True):
+    body = b"" if payload is None else json.dumps(payload, default=jsonable).encode()
+    headers = [
+        f"HTTP/1.1 {status} {REASONS[status]}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    if status == 503:
+        headers.append("Retry-After: 1")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def start_server(
+    service: ValidationService, host: str = "127.0.0.1", port: int = 8080
+):
+    # Start the workers of service and listen, port 0 picks a free port
+    await service.start()
+    return await asyncio.start_server(service.handle, host, port)
+
+
+async def serve(host: str, port: int, **options):
+    service = ValidationService(**options)
+    server = await start_server(service, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Serve SPF and DMARC validation over HTTP"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=256,
+        help="validations waiting for a worker before requests get 503",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="seconds per validation, the result is partial after that",
+    )
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(
+            serve(
+                args.host,
+                args.port,
+                workers=args.workers,
+                queue_size=args.queue_size,
+                timeout=args.timeout,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
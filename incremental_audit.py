@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+from bulk_audit import _audit_threads, audit_dmarc, audit_spf, read_domains
+from dmarc_syntaxchecker import validate_dmarc
+import dns_cache
+from dns_cache import resolve
+from records import find_records, select_records
+from results import jsonable
+from spf_record_validator import LOOKUP_LIMIT, validate_spf
+
+# Snapshot-diff re-audit. A snapshot keeps, per domain and record kind:
+#   records       - the top-level record texts
+#   dependencies  - "name rdtype" -> hash of the answer, for every include and
+#                   redirect target of the record, transitively, and the
+#                   report authorization records of a DMARC record
+#   result        - the result of the last validation
+#
+# A re-run fetches the top-level records and walks the dependency graph
+# through the DNS cache, hashing answers as it goes. Only when the records or
+# a hash differ is the record validated again, otherwise the previous result
+# is reused, so a run costs in proportion to what changed.
+#
+#     python incremental_audit.py domains.txt --snapshot snapshot.ndjson
+
+# Bound on the walk, a tree deeper than this is over the lookup limit anyway
+MAX_DEPTH = LOOKUP_LIMIT + 1
+
+# Hash of answers that could not be fetched, never equal to a stored hash
+UNKNOWN = "unknown"
+
+
+def answer_hash(name: str, rdtype: str):
+    # Returns (hash, records) of the answer to a query, negative answers hash
+    # by their type and failed queries to UNKNOWN
+    try:
+        records = resolve(name, rdtype)
+    except dns_cache.NEGATIVE_ERRORS as error:
+        return type(error).__name__, []
+    except Exception:
+        return UNKNOWN, []
+    text = "\n".join(sorted(records))
+    return hashlib.sha256(text.encode()).hexdigest()[:32], records
+
+
+def spf_dependencies(record: str, domain: str, addresses: bool = False):
+    # Hash every include and redirect target of an SPF record, transitively.
+    # With addresses the names of a, mx and exists terms are hashed too
+    hashes = {}
+    level = [(record, domain)]
+    for _ in range(MAX_DEPTH):
+        following = []
+        for spf_record, curr_domain in level:
+            result = validate_spf(spf_record, curr_domain, [], resolve=False)
+            for name, rdtype in result["dependencies"]:
+                key = f"{name} {rdtype}"
+                if key in hashes or "%" in name:
+                    continue
+                if rdtype != "TXT" and not addresses:
+                    continue
+                hashes[key], records = answer_hash(name, rdtype)
+                if rdtype == "TXT":
+                    following.extend(
+                        (text, name) for text in select_records(records, "spf")
+                    )
+        if not following:
+            break
+        level = following
+    return hashes
+
+
+def dmarc_dependencies(record: str, domain: str):
+    # Hash the report authorization records of the rua/ruf hosts
+    result = validate_dmarc(record, domain, resolve=False)
+    return {
+        f"{name} {rdtype}": answer_hash(name, rdtype)[0]
+        for name, rdtype in result["dependencies"]
+    }
+
+
+def _unchanged(previous: dict, records: list, dependencies: dict):
+    return (
+        previous is not None
+        and previous["records"] == records
+        and previous["dependencies"] == dependencies
+        and UNKNOWN not in dependencies.values()
+    )
+
+
+def _reaudit(kind: str, domain: str, previous: dict, addresses: bool):
+    # Returns (result, snapshot entry, changed)
+    records = find_records(kind, domain)
+
+    dependencies = {}
+    if len(records) == 1 and kind == "spf":
+        dependencies = spf_dependencies(records[0], domain, addresses)
+    elif len(records) == 1:
+        dependencies = dmarc_dependencies(records[0], domain)
+
+    if _unchanged(previous, records, dependencies):
+        return previous["result"], previous, False
+
+    if kind == "spf":
+        result = audit_spf(domain, records)
+    else:
+        result = audit_dmarc(domain, records)
+    # Through JSON, so that reused and fresh results look the same
+    result = json.loads(json.dumps(result, default=jsonable))
+    entry = {"records": records, "dependencies": dependencies, "result": result}
+    return result, entry, True
+
+
+def reaudit_domain(
+    domain: str, snapshot: dict, index: int = None, addresses: bool = False
+):
+    # Audit one domain against its snapshot entry and update the entry. The
+    # result tells which records were validated again under "changed"
+    previous = snapshot.get(domain, {})
+    spf, spf_entry, spf_changed = _reaudit(
+        "spf", domain, previous.get("spf"), addresses
+    )
+    dmarc, dmarc_entry, dmarc_changed = _reaudit(
+        "dmarc", domain, previous.get("dmarc"), addresses
+    )
+    snapshot[domain] = {"spf": spf_entry, "dmarc": dmarc_entry}
+    return {
+        "index": index,
+        "domain": domain,
+        "spf": spf,
+        "dmarc": dmarc,
+        "changed": {"spf": spf_changed, "dmarc": dmarc_changed},
+    }
+
+
+def reaudit_domains(
+    domains,
+    snapshot: dict,
+    workers: int = 16,
+    offset: int = 0,
+    addresses: bool = False,
+):
+    # Re-audit an iterable of domains in completion order, snapshot is
+    # updated in place and can be saved afterwards
+    def audit(domain: str, index: int):
+        return reaudit_domain(domain, snapshot, index, addresses)
+
+    return _audit_threads(
+        itertools.islice(enumerate(domains), offset, None), workers, audit
+    )
+
+
+def load_snapshot(path: str):
+    # NDJSON, one {"domain": ..., "spf": ..., "dmarc": ...} object per line
+    snapshot = {}
+    if not os.path.exists(path):
+        return snapshot
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                snapshot[entry.pop("domain")] = entry
+    return snapshot
+
+
+def save_snapshot(snapshot: dict, path: str):
+    # Written next to the old snapshot and moved over it, so that an
+    # interrupted run leaves the previous snapshot intact
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        for domain, entry in snapshot.items():
+            file.write(json.dumps({"domain": domain, **entry}) + "\n")
+    os.replace(temporary, path)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Re-validate the SPF and DMARC records that changed since the last run"
+    )
+    parser.add_argument(
+        "domains", nargs="?", default="-", help="file with one domain per line"
+    )
+    parser.add_argument("--snapshot", required=True, help="NDJSON snapshot file")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--addresses",
+        action="store_true",
+        help="also revalidate when the A or MX records of a, mx and exists terms change",
+    )
+    parser.add_argument("--output", default="-", help="NDJSON output file")
+    args = parser.parse_args(argv)
+
+    snapshot = load_snapshot(args.snapshot)
+    audited = set()
+    source = sys.stdin if args.domains == "-" else open(args.domains)
+    output = sys.stdout if args.output == "-" else open(args.output, "a")
+    try:
+        results = reaudit_domains(
+            read_domains(source), snapshot, args.workers, addresses=args.addresses
+        )
+        for result in results:
+            audited.add(result["domain"])
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    # Domains that left the list leave the snapshot too
+    save_snapshot({domain: snapshot[domain] for domain in audited}, args.snapshot)
+
+
+if __name__ == "__main__":
+    main()
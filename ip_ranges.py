@@ -0,0 +1,156 @@
+import ipaddress
+from bisect import bisect_right
+from functools import lru_cache
+
+# IANA IPv4 and IPv6 special-purpose address registries (RFC 6890 and
+# updates), plus the multicast and reserved blocks. Each entry is
+# (network, category, globally reachable). More specific entries win over
+# the blocks that contain them.
+SPECIAL_PURPOSE_4 = (
+    ("0.0.0.0/0", "public", True),
+    ("0.0.0.0/8", "this network", False),
+    ("10.0.0.0/8", "private", False),
+    ("100.64.0.0/10", "shared address space", False),
+    ("127.0.0.0/8", "loopback", False),
+    ("169.254.0.0/16", "link local", False),
+    ("172.16.0.0/12", "private", False),
+    ("192.0.0.0/24", "ietf protocol assignments", False),
+    ("192.0.0.9/32", "port control protocol anycast", True),
+    ("192.0.0.10/32", "traversal using relays around nat anycast", True),
+    ("192.0.2.0/24", "documentation", False),
+    ("192.31.196.0/24", "as112", True),
+    ("192.52.193.0/24", "automatic multicast tunneling", True),
+    ("192.88.99.0/24", "deprecated 6to4 relay anycast", False),
+    ("192.168.0.0/16", "private", False),
+    ("192.175.48.0/24", "as112", True),
+    ("198.18.0.0/15", "benchmarking", False),
+    ("198.51.100.0/24", "documentation", False),
+    ("203.0.113.0/24", "documentation", False),
+    ("224.0.0.0/4", "multicast", False),
+    ("240.0.0.0/4", "reserved", False),
+    ("255.255.255.255/32", "limited broadcast", False),
+)
+
+SPECIAL_PURPOSE_6 = (
+    ("::/0", "reserved", False),
+    ("::/128", "unspecified", False),
+    ("::1/128", "loopback", False),
+    ("::ffff:0:0/96", "ipv4-mapped", False),
+    ("64:ff9b::/96", "ipv4-ipv6 translation", True),
+    ("64:ff9b:1::/48", "ipv4-ipv6 translation", False),
+    ("100::/64", "discard-only", False),
+    ("2000::/3", "public", True),
+    ("2001::/23", "ietf protocol assignments", False),
+    ("2001::/32", "teredo", False),
+    ("2001:1::1/128", "port control protocol anycast", True),
+    ("2001:1::2/128", "traversal using relays around nat anycast", True),
+    ("2001:2::/48", "benchmarking", False),
+    ("2001:3::/32", "automatic multicast tunneling", True),
+    ("2001:4:112::/48", "as112", True),
+    ("2001:20::/28", "orchidv2", False),
+    ("2001:30::/28", "drone remote id", True),
+    ("2001:db8::/32", "documentation", False),
+    ("2002::/16", "6to4", False),
+    ("2620:4f:8000::/48", "as112", True),
+    ("3fff::/20", "documentation", False),
+    ("5f00::/16", "segment routing sids", False),
+    ("fc00::/7", "unique local", False),
+    ("fe80::/10", "link local", False),
+    ("ff00::/8", "multicast", False),
+)
+
+
+class RangeTable:
+    # Disjoint, sorted integer intervals built from possibly nested ranges,
+    # searched with bisect
+
+    def __init__(self, ranges: tuple):
+        networks = sorted(
+            (ipaddress.ip_network(network), category, public)
+            for network, category, public in ranges
+        )
+        # Split every range at the boundaries of the ranges nested in it, the
+        # most specific range covering an interval decides its category
+        bounds = set()
+        for network, _, _ in networks:
+            bounds.add(int(network.network_address))
+            bounds.add(int(network.broadcast_address) + 1)
+        bounds = sorted(bounds)
+
+        self.starts = []
+        self.ends = []
+        self.categories = []
+        self.public = []
+        for start, end in zip(bounds, bounds[1:]):
+            covering = None
+            for network, category, public in networks:
+                first = int(network.network_address)
+                last = int(network.broadcast_address)
+                if first <= start and end - 1 <= last:
+                    if covering is None or network.prefixlen > covering[0]:
+                        covering = (network.prefixlen, category, public)
+            if covering is None:
+                continue
+            if self.categories and (
+                self.ends[-1] + 1 == start
+                and self.categories[-1] == covering[1]
+                and self.public[-1] == covering[2]
+            ):
+                self.ends[-1] = end - 1
+                continue
+            self.starts.append(start)
+            self.ends.append(end - 1)
+            self.categories.append(covering[1])
+            self.public.append(covering[2])
+
+    def classify(self, first: int, last: int):
+        # Category of the range first-last, a range that is not entirely
+        # public gets the category of its first non public part
+        index = bisect_right(self.starts, first) - 1
+        category = self.categories[index]
+        while index < len(self.starts) and self.starts[index] <= last:
+            if not self.public[index]:
+                return self.categories[index], False
+            index += 1
+        return category, True
+
+
+@lru_cache(maxsize=None)
+def range_table(version: int):
+    # Built the first time an address of that version is classified
+    return RangeTable(SPECIAL_PURPOSE_4 if version == 4 else SPECIAL_PURPOSE_6)
+
+
+@lru_cache(maxsize=65536)
+def parse_network(text: str, version: int = None):
+    # Parse "address" or "address/prefix" into an ip_network, host bits are
+    # allowed as in SPF ip4/ip6 terms. Returns None when it is not valid
+    try:
+        network = ipaddress.ip_network(text, strict=False)
+    except ValueError:
+        return None
+    if version is not None and network.version != version:
+        return None
+    return network
+
+
+@lru_cache(maxsize=65536)
+def classify_network(network):
+    # Returns (category, globally reachable) for an ip_network
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    return range_table(network.version).classify(first, last)
+
+
+def classify(text: str, version: int = None):
+    # Returns (category, globally reachable), or None when text is not a
+    # valid address or network
+    network = parse_network(text, version)
+    if network is None:
+        return None
+    return classify_network(network)
+
+
+def is_public(text: str, version: int = None):
+    classification = classify(text, version)
+    return classification is not None and classification[1]
@@ -0,0 +1,123 @@
+import time
+
+# Validation observers. Pass one to validate_spf / validate_dmarc to receive
+# structured events while a record is validated:
+#
+#   query            - every DNS query, answered by the cache or not
+#                      name, rdtype, duration, outcome, cached, error
+#   mechanism_start  - before an SPF term or DMARC tag is evaluated
+#                      domain, term
+#   mechanism        - after it was evaluated, nested terms of included
+#                      records come in between
+#                      domain, term, duration, lookups
+#
+# Durations are in seconds. outcome is "answer", "nxdomain", "noanswer",
+# "timeout", "servfail" or "error", see dns_cache.query_outcome
+
+
+class Observer:
+    # Base class of observers, every hook does nothing by default
+
+    def on_query(self, event: dict):
+        pass
+
+    def on_mechanism_start(self, event: dict):
+        pass
+
+    def on_mechanism(self, event: dict):
+        pass
+
+
+class ObserverGroup(Observer):
+    # Forwards every event to several observers
+
+    def __init__(self, *observers):
+        self.observers = [observer for observer in observers if observer is not None]
+
+    def on_query(self, event: dict):
+        for observer in self.observers:
+            observer.on_query(event)
+
+    def on_mechanism_start(self, event: dict):
+        for observer in self.observers:
+            observer.on_mechanism_start(event)
+
+    def on_mechanism(self, event: dict):
+        for observer in self.observers:
+            observer.on_mechanism(event)
+
+
+class EventLog(Observer):
+    # Keeps every event as a (kind, event) pair, for export or inspection
+
+    def __init__(self):
+        self.events = []
+
+    def on_query(self, event: dict):
+        self.events.append(("query", event))
+
+    def on_mechanism_start(self, event: dict):
+        self.events.append(("mechanism_start", event))
+
+    def on_mechanism(self, event: dict):
+        self.events.append(("mechanism", event))
+
+    def queries(self):
+        return [event for kind, event in self.events if kind == "query"]
+
+    def slowest(self, count: int = 10):
+        # The slowest queries and mechanisms, the tail-latency offenders
+        timed = [(kind, event) for kind, event in self.events if "duration" in event]
+        return sorted(timed, key=lambda item: item[1]["duration"], reverse=True)[:count]
+
+
+class TimingTree(Observer):
+    # Builds a tree of the evaluated terms and the queries they sent:
+    #   {"name": ..., "duration": ..., "children": [...]}
+    # Query nodes also carry outcome and cached, term nodes lookups
+
+    def __init__(self, name: str = "validation"):
+        self.root = {"name": name, "duration": 0.0, "children": []}
+        self._stack = [self.root]
+        self._start = time.perf_counter()
+
+    def on_query(self, event: dict):
+        self._stack[-1]["children"].append(
+            {
+                "name": f"{event['name']} {event['rdtype']}",
+                "duration": event["duration"],
+                "outcome": event["outcome"],
+                "cached": event["cached"],
+            }
+        )
+
+    def on_mechanism_start(self, event: dict):
+        node = {"name": f"{event['domain']} {event['term']}", "children": []}
+        self._stack[-1]["children"].append(node)
+        self._stack.append(node)
+
+    def on_mechanism(self, event: dict):
+        if len(self._stack) > 1:
+            node = self._stack.pop()
+            node["duration"] = event["duration"]
+            node["lookups"] = event.get("lookups", 0)
+
+    def finish(self):
+        self.root["duration"] = time.perf_counter() - self._start
+        return self.root
+
+
+class Mechanism:
+    # Open mechanism event of a validator, closed once the term is evaluated
+    __slots__ = ("event", "start", "lookups")
+
+    def __init__(self, observer: Observer, domain: str, term: str, lookups: int):
+        self.event = {"domain": domain, "term": term}
+        self.lookups = lookups
+        observer.on_mechanism_start(dict(self.event))
+        self.start = time.perf_counter()
+
+    def close(self, observer: Observer, lookups: int = None):
+        self.event["duration"] = time.perf_counter() - self.start
+        self.event["lookups"] = 0 if lookups is None else lookups - self.lookups
+        observer.on_mechanism(self.event)
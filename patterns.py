@@ -0,0 +1,41 @@
+# Regular expressions compiled the first time they are used, so that importing
+# a module that defines them costs nothing:
+#
+#     TERM_REGEX = LazyPattern(r"^(?P<name>[a-z]+)")
+#     TERM_REGEX.match(text)
+#
+# After the first use the methods of the compiled pattern are looked up on
+# the instance directly, without a detour through __getattr__.
+
+METHODS = (
+    "match",
+    "fullmatch",
+    "search",
+    "findall",
+    "finditer",
+    "split",
+    "sub",
+    "subn",
+)
+
+
+class LazyPattern:
+    def __init__(self, pattern, flags: int = 0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def compile(self):
+        import re
+
+        compiled = re.compile(self.pattern, self.flags)
+        for method in METHODS:
+            setattr(self, method, getattr(compiled, method))
+        return compiled
+
+    def __getattr__(self, name: str):
+        if name not in METHODS:
+            raise AttributeError(name)
+        return getattr(self.compile(), name)
+
+    def __repr__(self):
+        return f"LazyPattern({self.pattern!r})"
@@ -0,0 +1,276 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import dns_cache
+import results
+from dmarc_syntaxchecker import validate_dmarc
+from observers import Observer
+from report_authorization import authorization_cache, report_name, tag_hosts
+from spf_record_validator import subtree_cache, validate_spf
+
+# Persistent second level behind DNSCache, shared by every process that opens
+# the same file:
+#
+#     store = SQLiteStore("/var/cache/checker.db")
+#     dns_cache.set_default_cache(DNSCache(store=store))
+#
+# The store keeps raw DNS answers and validation results, each with an
+# absolute expiry time. SQLite runs in WAL mode so readers never block the
+# writer, and concurrent writers wait on busy_timeout instead of failing.
+
+# Validation results of records that send no DNS query are kept this long
+RESULT_TTL = 3600
+COMPACT_EVERY = 1000
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS answers (
+        name TEXT NOT NULL,
+        rdtype TEXT NOT NULL,
+        records TEXT NOT NULL,
+        error TEXT,
+        expires REAL NOT NULL,
+        PRIMARY KEY (name, rdtype)
+    )""",
+    "CREATE INDEX IF NOT EXISTS answers_expires ON answers (expires)",
+    """CREATE TABLE IF NOT EXISTS results (
+        kind TEXT NOT NULL,
+        domain TEXT NOT NULL,
+        record TEXT NOT NULL,
+        result TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (kind, domain, record)
+    )""",
+    "CREATE INDEX IF NOT EXISTS results_expires ON results (expires)",
+)
+
+# Negative answers are stored by the name of their exception
+ERRORS = {error.__name__: error for error in dns_cache.NEGATIVE_ERRORS}
+
+
+class SQLiteStore:
+    # Entries expire by wall clock time, so that every process agrees on
+    # them. Expired rows are purged every compact_every writes
+
+    def __init__(
+        self,
+        path: str,
+        compact_every: int = COMPACT_EVERY,
+        busy_timeout: float = 30.0,
+        clock=time.time,
+    ):
+        self.path = path
+        self.compact_every = compact_every
+        self.busy_timeout = busy_timeout
+        self.clock = clock
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        # One connection per thread and process, sqlite3 connections must
+        # not cross threads and are not safe to use after a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _written(self):
+        with self._lock:
+            self._writes += 1
+            due = self.compact_every and self._writes % self.compact_every == 0
+        if due:
+            self.purge()
+
+    def get_answer(self, name: str, rdtype: str):
+        # Returns (records, error, remaining ttl), None when not stored
+        name, rdtype = dns_cache.cache_key(name, rdtype)
+        row = (
+            self._connection()
+            .execute(
+                "SELECT records, error, expires FROM answers"
+                " WHERE name = ? AND rdtype = ? AND expires > ?",
+                (name, rdtype, self.clock()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        records, error, expires = row
+        return json.loads(records), ERRORS.get(error), expires - self.clock()
+
+    def set_answer(self, name: str, rdtype: str, records: list, ttl: float, error=None):
+        name, rdtype = dns_cache.cache_key(name, rdtype)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (
+                    name,
+                    rdtype,
+                    json.dumps(list(records)),
+                    None if error is None else error.__name__,
+                    self.clock() + ttl,
+                ),
+            )
+        self._written()
+
+    def get_result(self, kind: str, domain: str, record: str):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT result FROM results"
+                " WHERE kind = ? AND domain = ? AND record = ? AND expires > ?",
+                (kind, domain.lower(), record, self.clock()),
+            )
+            .fetchone()
+        )
+        return None if row is None else results.loads(row[0])
+
+    def set_result(self, kind: str, domain: str, record: str, result, ttl: float):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (
+                    kind,
+                    domain.lower(),
+                    record,
+                    results.dumps(result),
+                    self.clock() + ttl,
+                ),
+            )
+        self._written()
+
+    def purge(self):
+        # Delete expired entries, returns how many were removed
+        now = self.clock()
+        with self._connection() as connection:
+            removed = connection.execute(
+                "DELETE FROM answers WHERE expires <= ?", (now,)
+            ).rowcount
+            removed += connection.execute(
+                "DELETE FROM results WHERE expires <= ?", (now,)
+            ).rowcount
+        return removed
+
+    def compact(self):
+        # Purge, then give the space back to the file system. Safe while
+        # other processes use the store, they wait on busy_timeout
+        removed = self.purge()
+        connection = self._connection()
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.execute("VACUUM")
+        return removed
+
+    def stats(self):
+        connection = self._connection()
+        return {
+            "answers": connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0],
+            "results": connection.execute("SELECT COUNT(*) FROM results").fetchone()[0],
+        }
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class Dependencies(Observer):
+    # Names a validation depended on, for the lifetime of its result
+    def __init__(self):
+        self.queries = []
+        self.subtrees = []
+        self.reports = []
+
+    def on_query(self, event: dict):
+        self.queries.append((event["name"], event["rdtype"]))
+
+    def on_mechanism_start(self, event: dict):
+        term = event["term"].lstrip("+-~?")
+        for prefix in ("include:", "redirect="):
+            if term.startswith(prefix):
+                self.subtrees.append(term[len(prefix) :])
+        for host in tag_hosts(event["term"]):
+            self.reports.append(report_name(event["domain"], host))
+
+    def ttl(self, maximum: float):
+        # A result lives as long as the shortest lived answer it was built
+        # from, memoized subtrees as long as their TXT record and report
+        # authorizations as long as theirs. Answers that were not cached,
+        # failed queries, make it not worth keeping
+        cache = dns_cache.get_default_cache()
+        ttls = [cache.ttl(name, rdtype) or 0 for name, rdtype in self.queries]
+        ttls += [subtree_cache.ttl(name, "SPF") for name in self.subtrees]
+        ttls += [authorization_cache.ttl(name, "AUTH") for name in self.reports]
+        return min([ttl for ttl in ttls if ttl is not None] + [maximum])
+
+
+def _cached_validation(
+    kind: str, validate, record: str, domain: str, store, ttl, query_timeout
+):
+    if store is None:
+        store = dns_cache.get_default_cache().store
+    if store is None:
+        return validate(record, domain, query_timeout=query_timeout)
+
+    result = store.get_result(kind, domain, record)
+    if result is not None:
+        result["dependencies"] = [tuple(item) for item in result["dependencies"]]
+        return result
+
+    dependencies = Dependencies()
+    result = validate(
+        record, domain, observer=dependencies, query_timeout=query_timeout
+    )
+    ttl = dependencies.ttl(ttl)
+    if ttl > 0 and not results.timed_out(result):
+        store.set_result(kind, domain, record, result, ttl)
+    return result
+
+
+def validate_spf_cached(
+    spf_record: str,
+    domain: str,
+    store: SQLiteStore = None,
+    ttl: float = RESULT_TTL,
+    query_timeout: float = None,
+):
+    # validate_spf through the result store, by default the store behind the
+    # default DNS cache. Without a store it is plain validate_spf
+    return _cached_validation(
+        "spf",
+        lambda record, domain, **kwargs: validate_spf(record, domain, [], **kwargs),
+        spf_record,
+        domain,
+        store,
+        ttl,
+        query_timeout,
+    )
+
+
+def validate_dmarc_cached(
+    record: str,
+    domain: str,
+    store: SQLiteStore = None,
+    ttl: float = RESULT_TTL,
+    query_timeout: float = None,
+):
+    return _cached_validation(
+        "dmarc", validate_dmarc, record, domain, store, ttl, query_timeout
+    )
+
+
+def open_default_store(path: str, **kwargs):
+    # Put a persistent store behind a fresh default DNS cache
+    store = SQLiteStore(path, **kwargs)
+    dns_cache.set_default_cache(dns_cache.DNSCache(store=store))
+    return store
@@ -0,0 +1,140 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import dns_cache
+from dmarc_parser import parse_dmarc
+from dmarc_syntaxchecker import validate_dmarc
+from dns_cache import DNSCache
+from spf_parser import parse_spf
+from spf_record_validator import validate_spf
+
+# Process pool for CPU-bound bulk validation. Items are sent to the workers
+# in chunks, so that pickling and scheduling cost little per item, and at
+# most 2 * workers chunks are in flight, so that memory does not grow with
+# the input:
+#
+#     stats = WorkerStats()
+#     for index, result in imap(check, items, workers=32, stats=stats):
+#         ...
+#     stats.report()
+#
+# Every worker is warmed up before its first chunk: the validators are
+# imported and a sample of records is validated, which compiles the regexes
+# and fills the rule tables. Workers share the DNS cache of the parent read
+# only. Forked workers inherit it, other start methods get a snapshot.
+
+CHUNK_SIZE = 500
+
+WARM_UP_SPF = (
+    "v=spf1 a mx:mail.example.com/24//64 ip4:192.0.2.0/24 ip6:2001:db8::/32 "
+    "include:_spf.example.com exists:%{i}.example.com redirect=example.net"
+)
+WARM_UP_DMARC = (
+    "v=DMARC1; p=reject; sp=none; rua=mailto:a@example.net!10m; "
+    "ruf=mailto:f@example.net; fo=1:d; adkim=s; aspf=r; rf=afrf; ri=3600; pct=100;"
+)
+
+
+def warm_up(snapshot: list = None):
+    # Initializer of the workers
+    if snapshot is not None:
+        cache = DNSCache()
+        cache.load(snapshot)
+        dns_cache.set_default_cache(cache)
+    parse_spf(WARM_UP_SPF)
+    parse_dmarc(WARM_UP_DMARC)
+    validate_spf(WARM_UP_SPF, "example.com", [], resolve=False)
+    validate_dmarc(WARM_UP_DMARC, "example.com", resolve=False)
+
+
+def _run_chunk(function, chunk: list):
+    start = time.perf_counter()
+    results = [function(item) for item in chunk]
+    return os.getpid(), time.perf_counter() - start, results
+
+
+class WorkerStats:
+    # Items and busy seconds per worker process, filled in by imap
+
+    def __init__(self):
+        self.workers = {}
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, pid: int, items: int, seconds: float):
+        with self._lock:
+            counts = self.workers.setdefault(pid, [0, 0.0])
+            counts[0] += items
+            counts[1] += seconds
+
+    def report(self):
+        # {"workers": {pid: {items, seconds, items_per_second}}, "items",
+        # "seconds", "items_per_second"} where the totals are wall clock
+        with self._lock:
+            workers = {
+                pid: {
+                    "items": items,
+                    "seconds": round(seconds, 6),
+                    "items_per_second": round(items / seconds, 2) if seconds else None,
+                }
+                for pid, (items, seconds) in self.workers.items()
+            }
+        elapsed = time.perf_counter() - self.start
+        items = sum(worker["items"] for worker in workers.values())
+        return {
+            "workers": workers,
+            "items": items,
+            "seconds": round(elapsed, 6),
+            "items_per_second": round(items / elapsed, 2) if elapsed else None,
+        }
+
+
+def imap(
+    function,
+    items,
+    workers: int = None,
+    chunk_size: int = CHUNK_SIZE,
+    ordered: bool = True,
+    stats: WorkerStats = None,
+):
+    # Apply function, a module level function, to every item in a pool of
+    # that many worker processes, by default one per core. Yields (index,
+    # result) pairs in input order, or as chunks complete with ordered=False
+    workers = workers or os.cpu_count() or 1
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    pending = collections.OrderedDict()
+    offset = 0
+
+    def collect(future):
+        pid, seconds, results = future.result()
+        if stats is not None:
+            stats.add(pid, len(results), seconds)
+        start = pending.pop(future)
+        return enumerate(results, start)
+
+    def drain():
+        # Results of the oldest chunk, or of the chunks done first
+        if ordered:
+            return collect(next(iter(pending)))
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        return itertools.chain.from_iterable([collect(future) for future in done])
+
+    snapshot = None
+    if multiprocessing.get_start_method() != "fork":
+        snapshot = dns_cache.get_default_cache().snapshot()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=warm_up, initargs=(snapshot,)
+    ) as executor:
+        for chunk in chunks:
+            if len(pending) >= 2 * workers:
+                yield from drain()
+            pending[executor.submit(_run_chunk, function, chunk)] = offset
+            offset += len(chunk)
+        while pending:
+            yield from drain()
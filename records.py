@@ -0,0 +1,52 @@
+from dns_cache import resolve, resolve_async, txt_string
+from results import throw_issue
+
+# Looking up the SPF or DMARC record of a domain. A domain has to publish
+# exactly one of each, no record or several of them give the result of
+# missing_record. dnspython is only imported with the first query, so the
+# command line stays quick to start (see checker)
+
+KINDS = ("spf", "dmarc")
+PREFIXES = {"spf": "v=spf1", "dmarc": "v=DMARC1"}
+
+
+def record_name(kind: str, domain: str):
+    return domain if kind == "spf" else "_dmarc." + domain
+
+
+def select_records(answers: list, kind: str):
+    # The records of a kind among TXT answers
+    texts = [txt_string(answer) for answer in answers]
+    return [text for text in texts if text.startswith(PREFIXES[kind])]
+
+
+def find_records(kind: str, domain: str, timeout: float = None, observer=None):
+    # Records of a kind published by domain, a failed query finds none.
+    # timeout bounds the query in seconds
+    try:
+        answers = resolve(
+            record_name(kind, domain), "TXT", observer=observer, lifetime=timeout
+        )
+    except Exception:
+        return []
+    return select_records(answers, kind)
+
+
+async def find_records_async(
+    kind: str, domain: str, timeout: float = None, observer=None
+):
+    try:
+        answers = await resolve_async(
+            record_name(kind, domain), "TXT", observer=observer, lifetime=timeout
+        )
+    except Exception:
+        return []
+    return select_records(answers, kind)
+
+
+def missing_record(kind: str, records: list):
+    # Result for a domain without exactly one record of a kind
+    issues = []
+    code = "RECORD_MULTIPLE" if records else "RECORD_MISSING"
+    throw_issue(code, issues, kind.upper())
+    return {"record": None, "status": False, "issues": issues}
@@ -0,0 +1,145 @@
+import dns_cache
+from dmarc_parser import parse_uri
+from dns_cache import (
+    DNSCache,
+    get_default_cache,
+    query_lifetime,
+    resolve,
+    txt_string,
+)
+
+# External report destinations (RFC 7489, section 7.1). A domain may send its
+# rua/ruf reports to another host only when <domain>._report._dmarc.<host>
+# holds a v=DMARC1 record. Aggregators usually publish a wildcard,
+# *._report._dmarc.<host>, that authorizes every domain at once: it is checked
+# once per host and reused for every sender domain, only hosts without one are
+# asked per domain. The checks of a record are resolved concurrently and their
+# results kept per (domain, host) pair until the answer they came from
+# expires.
+
+# Results by authorization record name, wildcards included
+authorization_cache = DNSCache()
+
+# Threads checking the hosts of one record
+MAX_WORKERS = 8
+
+
+def report_name(domain: str, host: str):
+    return f"{domain}._report._dmarc.{host}"
+
+
+def wildcard_name(host: str):
+    return "*._report._dmarc." + host
+
+
+def tag_hosts(tag: str):
+    # Hosts of the valid mailto: URIs of a rua or ruf tag, as validate_dmarc
+    # reads them
+    name, _, value = tag.partition("=")
+    name = name.strip()
+    if name not in ("rua", "ruf"):
+        return []
+    uris = [parse_uri(uri, name) for uri in value.split(",")]
+    return [uri.host for uri in uris if uri.host is not None]
+
+
+def _known(domain: str, host: str):
+    # Cached result of a pair, None when it has to be checked
+    if host == domain:
+        return True
+    entry = authorization_cache.get(report_name(domain, host), "AUTH")
+    if entry is not None:
+        return entry.records
+    entry = authorization_cache.get(wildcard_name(host), "AUTH")
+    if entry is not None and entry.records:
+        return True
+    return None
+
+
+def _check(name: str, observer=None, deadline=None):
+    # Returns (authorized, ttl). authorized is None when the deadline ran out,
+    # ttl None when the result must not be kept
+    entry = authorization_cache.get(name, "AUTH")
+    if entry is not None:
+        return entry.records, authorization_cache.ttl(name, "AUTH")
+    if deadline is not None and deadline.expired():
+        return None, None
+    try:
+        records = resolve(
+            name, "TXT", observer=observer, lifetime=query_lifetime(deadline)
+        )
+    except dns_cache.NEGATIVE_ERRORS:
+        authorized = False
+    except Exception:
+        # The outcome of the query is reported to the observer
+        if deadline is not None and deadline.expired():
+            return None, None
+        return False, None
+    else:
+        authorized = any("v=DMARC1" in txt_string(record) for record in records)
+    ttl = get_default_cache().ttl(name, "TXT")
+    if ttl:
+        authorization_cache.set(name, "AUTH", authorized, ttl)
+    return authorized, ttl
+
+
+def authorize(domain: str, host: str, observer=None, deadline=None):
+    # True when host accepts reports about domain, None when the deadline ran
+    # out before it could be checked. A wildcard wins over a more specific
+    # record, it is what aggregators publish
+    known = _known(domain, host)
+    if known is not None:
+        return known
+    authorized, ttl = _check(wildcard_name(host), observer, deadline)
+    if authorized:
+        if ttl:
+            authorization_cache.set(report_name(domain, host), "AUTH", True, ttl)
+        return True
+    if authorized is None:
+        return None
+    return _check(report_name(domain, host), observer, deadline)[0]
+
+
+def authorize_hosts(domain: str, hosts, observer=None, deadline=None):
+    # host -> True, False or None for every host, the pairs that are not
+    # cached are checked concurrently
+    results = {}
+    pending = []
+    for host in dict.fromkeys(hosts):
+        results[host] = _known(domain, host)
+        if results[host] is None:
+            pending.append(host)
+    if len(pending) == 1:
+        results[pending[0]] = authorize(domain, pending[0], observer, deadline)
+    elif pending:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(len(pending), MAX_WORKERS)) as pool:
+            checked = pool.map(
+                lambda host: authorize(domain, host, observer, deadline), pending
+            )
+            results.update(zip(pending, checked))
+    return results
+
+
+class ReportAuthorizations:
+    # The authorization checks of one DMARC record, all of them are resolved
+    # together the first time one is needed
+
+    def __init__(self, domain: str, hosts: list, observer=None, deadline=None):
+        self.domain = domain
+        self.hosts = hosts
+        self.observer = observer
+        self.deadline = deadline
+        self._results = None
+
+    def get(self, host: str):
+        if self._results is None:
+            self._results = authorize_hosts(
+                self.domain, self.hosts, self.observer, self.deadline
+            )
+        if host not in self._results:
+            self._results[host] = authorize(
+                self.domain, host, self.observer, self.deadline
+            )
+        return self._results[host]
@@ -0,0 +1,312 @@
+import enum
+import sys
+from collections.abc import Mapping, MutableMapping
+
+# Compact validation results. A finding is an Issue holding a stable code and
+# the values its message is built from, the message itself is only rendered
+# when it is read. Issues and results still read like the dicts they replace,
+# issue["message"] and result["issues"] work as before:
+#
+#     issue.code      -> "SPF_ALL_NOT_LAST"
+#     issue.severity  -> Severity.CRITICAL, equal to "critical"
+#     issue.message   -> "The all mechanism should be the last mechanism ..."
+#
+# dumps/loads write results as NDJSON lines with issues as [code, *args]
+# lists, jsonable renders them for people.
+
+
+class Severity(str, enum.Enum):
+    WARNING = "warning"
+    ERROR = "error"
+    CRITICAL = "critical"
+
+    def __str__(self):
+        return self.value
+
+
+WARNING, ERROR, CRITICAL = Severity.WARNING, Severity.ERROR, Severity.CRITICAL
+
+# code -> (severity, message template)
+CODES = {
+    # SPF
+    "SPF_NOT_SPF": (CRITICAL, "Provided string is not a SPF record"),
+    "SPF_UPPERCASE": (
+        CRITICAL,
+        "Spf record must not contain uppercase characters in it",
+    ),
+    "SPF_NO_RECORD": (CRITICAL, "No {} record found"),
+    "SPF_QUERY_FAILED": (
+        CRITICAL,
+        "No {} record found, the DNS query failed ({})",
+    ),
+    "SPF_TIMED_OUT": (CRITICAL, "SPF validation timed out, the result is partial"),
+    "SPF_LOOKUP_LIMIT": (
+        CRITICAL,
+        "SPF record requires more than {} DNS lookups (permerror)",
+    ),
+    "SPF_VOID_LOOKUP_LIMIT": (
+        CRITICAL,
+        "SPF record causes more than {} void DNS lookups (permerror)",
+    ),
+    "SPF_INCLUDE_LOOP": (
+        CRITICAL,
+        "SPF record of {} includes itself through {} (permerror)",
+    ),
+    "SPF_INCLUDE_ERRORS": (ERROR, "{} target {} has errors: {}"),
+    "SPF_MX_LIMIT": (
+        CRITICAL,
+        "Domain: {} has more than {} MX records (permerror)",
+    ),
+    "SPF_UNKNOWN_TERM": (CRITICAL, "Invalid mechanism: {}"),
+    "SPF_INVALID_MECHANISM": (ERROR, "Invalid mechanism: {}"),
+    "SPF_MODIFIER_QUALIFIER": (ERROR, "Modifier {} must not have a qualifier"),
+    "SPF_ADDRESS_REQUIRED": (ERROR, "{} mechanism requires an address: {}"),
+    "SPF_INVALID_PREFIX": (ERROR, "Invalid prefix length in the {} mechanism: {}"),
+    "SPF_INVALID_MACRO": (ERROR, "Invalid macro in the {} domain-spec: {}"),
+    "SPF_ALL_NOT_LAST": (
+        CRITICAL,
+        "The all mechanism should be the last mechanism in the SPF record",
+    ),
+    "SPF_ALL_FIRST": (
+        CRITICAL,
+        "all mechanism must not be the first or the only mechanism in the SPF record",
+    ),
+    "SPF_ALL_WITH_REDIRECT": (
+        CRITICAL,
+        "all mechanism is used with redirect mechanism which should not be done",
+    ),
+    "SPF_ALL_REPEATED": (CRITICAL, "all mechanism is used more than once"),
+    "SPF_ALL_SYNTAX": (CRITICAL, "all mechanism syntax must be [-+?~]all"),
+    "SPF_ALL_PERMISSIVE": (WARNING, "It is preffered for the all tag to be - or ~"),
+    "SPF_REDIRECT_REPEATED": (CRITICAL, "redirect mechanism is used more than once"),
+    "SPF_DOMAIN_REQUIRED": (CRITICAL, "{} requires a domain: {}"),
+    "SPF_INVALID_ADDRESS": (CRITICAL, "Invalid ipv{} address: {}"),
+    "SPF_PRIVATE_ADDRESS": (
+        WARNING,
+        "The ip address: {} is not a public ipv{} address ({})",
+    ),
+    "SPF_PRIVATE_A_ADDRESS": (
+        WARNING,
+        "The ip address: {} from the A record of the domain: {} is not a public ipv4 address",
+    ),
+    "SPF_PRIVATE_MX_ADDRESS": (
+        WARNING,
+        "The ip address: {} from the MX record of the domain: {} is not a public ipv4 address",
+    ),
+    "SPF_EXISTS_NO_MATCH": (
+        WARNING,
+        "Domain provided in exists mehcanism: {} is not a match or is not valid",
+    ),
+    "SPF_PTR": (WARNING, "ptr mechanism should not be published"),
+    "SPF_UNKNOWN_MODIFIER": (
+        WARNING,
+        "Unknown modifier: {}, it is ignored by receivers",
+    ),
+    # SPF flattening
+    "SPF_FLATTEN_NO_RECORD": (CRITICAL, "No SPF record found for {}"),
+    "SPF_FLATTEN_LOOP": (CRITICAL, "SPF record of {} includes itself"),
+    "SPF_FLATTEN_LOOKUPS": (
+        CRITICAL,
+        "Flattened record still requires {} DNS lookups",
+    ),
+    "SPF_FLATTEN_LENGTH": (WARNING, "Record for {} is longer than {} bytes"),
+    # DMARC
+    "DMARC_NOT_DMARC": (CRITICAL, "DMARC record does not start with v=DMARC1"),
+    "DMARC_NO_SEMICOLON": (
+        ERROR,
+        "DMARC record does not end with a semicolon - there must be one after every tag",
+    ),
+    "DMARC_TIMED_OUT": (
+        CRITICAL,
+        "DMARC validation timed out, the result is partial",
+    ),
+    "DMARC_DUPLICATE_TAG": (ERROR, "Duplicate tag: {}"),
+    "DMARC_POLICY_MISSING": (ERROR, "DMARC record has no p tag, it is required"),
+    "DMARC_INVALID_TAG": (ERROR, "Invalid tag: {}"),
+    "DMARC_INVALID_VALUE": (ERROR, "Tag {} value must be {}"),
+    "DMARC_POLICY_NONE": (
+        WARNING,
+        "Tag {} is set to none. It is recommended to set it to quarantine or reject",
+    ),
+    "DMARC_RI_NOT_INTEGER": (ERROR, "ri tag value must be a 32-bit unsigned integer"),
+    "DMARC_RI_RANGE": (ERROR, "ri tag value is not a 32-bit unsigned integer"),
+    "DMARC_PCT_NOT_INTEGER": (
+        ERROR,
+        "pct tag value must be an integer between 0 and 100 prefferably 100",
+    ),
+    "DMARC_PCT_RANGE": (
+        ERROR,
+        "pct tag value must be between 0 and 100 prefferably 100",
+    ),
+    "DMARC_PCT_LT_100": (WARNING, "It is safer if pct tag value is set to 100"),
+    "DMARC_FO_INVALID": (
+        ERROR,
+        "Invalid value: {} in fo tag it should be one of: ['0', '1', 'd', 's']",
+    ),
+    "DMARC_FO_DUPLICATE": (ERROR, "Duplicate value in fo tag"),
+    "DMARC_INVALID_EMAIL": (ERROR, "Invalid email in {} tag"),
+    "DMARC_EMAIL_DOMAIN_DOT": (
+        ERROR,
+        "Invalid email in {} tag. Domain should not start with a .",
+    ),
+    "DMARC_EMAIL_LOCAL_DOT": (
+        ERROR,
+        "Invalid email in {} tag. Mail should not start nor  end with a .",
+    ),
+    "DMARC_EMAIL_DOUBLE_DOT": (
+        ERROR,
+        "Invalid email in {} tag. Mail should not include ..",
+    ),
+    "DMARC_REPORTS_NOT_ACCEPTED": (
+        ERROR,
+        "Email: {} provided in {} tag does not accept reports from your domain or is invalid.",
+    ),
+    # Records looked up for a domain
+    "RECORD_MISSING": (CRITICAL, "No {} record found"),
+    "RECORD_MULTIPLE": (
+        CRITICAL,
+        "Multiple {} records found, there must be exactly one",
+    ),
+}
+
+
+class Issue(Mapping):
+    # One finding, read as {"severity": ..., "message": ...}. Issues are not
+    # changed once made, the parsers share them between results
+    __slots__ = ("code", "args")
+
+    def __init__(self, code: str, args: tuple = ()):
+        if code not in CODES:
+            raise ValueError(f"Unknown issue code: {code}")
+        self.code = code
+        self.args = args
+
+    @property
+    def severity(self):
+        return CODES[self.code][0]
+
+    @property
+    def message(self):
+        return CODES[self.code][1].format(*self.args)
+
+    def __getitem__(self, key: str):
+        if key == "severity":
+            return self.severity
+        if key == "message":
+            return self.message
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("severity", "message"))
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return f"Issue({self.code}: {self.message!r})"
+
+
+def throw_issue(code: str, issues: list, *args):
+    issues.append(Issue(code, args))
+
+
+# Codes of results cut short by a deadline
+TIMED_OUT = frozenset(("SPF_TIMED_OUT", "DMARC_TIMED_OUT"))
+
+
+def timed_out(result: dict):
+    # Whether a result is partial, issues read back from plain JSON have no code
+    return any(getattr(issue, "code", None) in TIMED_OUT for issue in result["issues"])
+
+
+class Result(MutableMapping):
+    # Result of validate_spf or validate_dmarc, read and written like a dict
+    # with the fields that were set as keys
+    __slots__ = (
+        "status",
+        "issues",
+        "lookups",
+        "void_lookups",
+        "networks",
+        "dependencies",
+        "timings",
+    )
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            self[name] = value
+
+    def __getitem__(self, key: str):
+        if key not in Result.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        if key not in Result.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __iter__(self):
+        return (name for name in Result.__slots__ if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Result({dict(self)!r})"
+
+
+def jsonable(value):
+    # json.dumps default= hook rendering issues and results for people
+    if isinstance(value, Issue):
+        return {
+            "code": value.code,
+            "severity": value.severity.value,
+            "message": value.message,
+        }
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _compact(value):
+    if isinstance(value, Issue):
+        return [value.code, *value.args]
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    # One compact JSON line, issues as [code, *args] lists
+    import json
+
+    return json.dumps(value, default=_compact, separators=(",", ":"))
+
+
+def _expand(value: dict):
+    issues = value.get("issues")
+    if isinstance(issues, list) and all(isinstance(item, list) for item in issues):
+        value["issues"] = [
+            Issue(sys.intern(item[0]), tuple(item[1:])) for item in issues
+        ]
+    if "dependencies" in value:
+        value["dependencies"] = [tuple(item) for item in value["dependencies"]]
+    if "status" in value and "issues" in value and set(value) <= set(Result.__slots__):
+        return Result(**value)
+    return value
+
+
+def loads(line: str):
+    # Inverse of dumps, results and issues come back as Result and Issue
+    import json
+
+    return json.loads(line, object_hook=_expand)
@@ -0,0 +1,716 @@
+import heapq
+import ipaddress
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+import dns_cache
+from dns_cache import DNSCache, get_default_cache, resolve, txt_string
+from ip_ranges import parse_network
+from spf_parser import MACRO_REGEX, macro_letters, parse_spf
+from spf_record_validator import LOOKUP_LIMIT, MX_LOOKUP_LIMIT, VOID_LOOKUP_LIMIT
+
+# SPF policy evaluation (RFC 7208 section 4), the question a receiving MTA
+# asks about a connecting IP:
+#
+#     check_host("40.92.4.1", "ikea.com", sender="noreply@ikea.com") -> "pass"
+#
+# The record of a domain is compiled once per IP version into a Policy. The
+# ip4/ip6 and all terms, and the a, mx, exists, include and redirect terms
+# whose targets do not depend on the message, are resolved up front and
+# merged into a NetworkTable: sorted, disjoint intervals searched with bisect,
+# each holding the result of the first term covering it. Only ptr and terms
+# with macros such as %{i} or %{s} are evaluated per check. Policies are kept
+# in policy_cache until the first DNS answer they were built from expires, so
+# after the first lookup a check is a cache hit and a binary search.
+#
+# The lookup and void lookup limits are counted as if the terms were
+# evaluated one by one: every table value carries the number of lookups spent
+# up to the term it came from.
+
+RESULTS = ("pass", "fail", "softfail", "neutral", "none", "permerror", "temperror")
+QUALIFIERS = {None: "pass", "+": "pass", "-": "fail", "~": "softfail", "?": "neutral"}
+
+MAX_ADDRESS = {4: (1 << 32) - 1, 6: (1 << 128) - 1}
+ADDRESS_TYPES = {4: "A", 6: "AAAA"}
+
+ESCAPES = {"%": "%", "_": " ", "-": "%20"}
+
+# Compiled policies by domain and "SPF4" or "SPF6"
+policy_cache = DNSCache()
+
+# Threads compiling the policies of a check_hosts call
+MAX_WORKERS = 16
+
+
+class NetworkTable:
+    # Networks of consecutive terms as sorted, disjoint integer intervals. An
+    # address gets the value of the first term covering it
+
+    def __init__(self, entries: list, version: int):
+        # entries are (first, last, value) in term order
+        self.last = MAX_ADDRESS[version]
+        self.starts = [0]
+        self.values = [None]
+        order = sorted(range(len(entries)), key=lambda index: entries[index][0])
+        bounds = sorted(
+            {first for first, _, _ in entries} | {last + 1 for _, last, _ in entries}
+        )
+        active = []
+        position = 0
+        for bound in bounds:
+            while position < len(order) and entries[order[position]][0] == bound:
+                index = order[position]
+                heapq.heappush(active, (index, entries[index][1]))
+                position += 1
+            # Terms that ended are dropped once they come out on top
+            while active and active[0][1] < bound:
+                heapq.heappop(active)
+            value = entries[active[0][0]][2] if active else None
+            if value == self.values[-1]:
+                continue
+            if bound == self.starts[-1]:
+                self.values[-1] = value
+            else:
+                self.starts.append(bound)
+                self.values.append(value)
+
+    def get(self, number: int):
+        return self.values[bisect_right(self.starts, number) - 1]
+
+    def intervals(self):
+        # (first, last, value) of the intervals that hold a value
+        ends = self.starts[1:] + [self.last + 1]
+        for start, end, value in zip(self.starts, ends, self.values):
+            if value is not None:
+                yield start, end - 1, value
+
+
+class Step:
+    # One step of a compiled policy, evaluated in order
+    #   kind    - "table", "result", "a", "mx", "exists", "ptr", "include" or
+    #             "redirect"
+    #   lookups - DNS lookups and void lookups of the record counted once the
+    #   voids     step is reached
+    #   table   - NetworkTable of a table step, its values are (result,
+    #             lookups, voids) of the matching term
+    #   result  - result of a result step, the qualifier of the other terms
+    #   target  - domain-spec of a term with macros, or the compiled Policy of
+    #             an include or redirect target
+    #   cidr    - prefix length of an a or mx term
+    __slots__ = ("kind", "lookups", "voids", "table", "result", "target", "cidr")
+
+    def __init__(self, kind: str, lookups: int, voids: int, **fields):
+        self.kind = kind
+        self.lookups = lookups
+        self.voids = voids
+        self.table = None
+        self.result = None
+        self.target = None
+        self.cidr = None
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"Step({self.kind!r})"
+
+
+class Policy:
+    # SPF record of one domain compiled for one IP version
+    #   result  - "none", "permerror" or "temperror" when the record cannot
+    #             be evaluated at all, None otherwise
+    #   steps   - tuple of Step
+    #   lookups - lookups and void lookups of the whole record, what a check
+    #   voids     that matches none of its terms spends
+    __slots__ = ("domain", "version", "result", "steps", "lookups", "voids")
+
+    def __init__(self, domain: str, version: int):
+        self.domain = domain
+        self.version = version
+        self.result = None
+        self.steps = ()
+        self.lookups = 0
+        self.voids = 0
+
+    @property
+    def static(self):
+        # Whether the policy is one table, that can be merged into the table
+        # of a record including it
+        return self.result is None and all(step.kind == "table" for step in self.steps)
+
+    def __repr__(self):
+        return f"Policy({self.domain!r}, {self.version})"
+
+
+class _Abort(Exception):
+    # permerror or temperror found in the middle of an evaluation
+    def __init__(self, result: str):
+        super().__init__(result)
+        self.result = result
+
+
+def _is_static(spec: str):
+    # Whether a domain-spec is known without the message
+    return spec is None or macro_letters(spec) <= {"d"}
+
+
+def _macro_value(letter: str, domain: str, check):
+    if letter == "d":
+        return domain
+    if letter == "i":
+        if check.version == 4:
+            return str(check.address)
+        return ".".join(check.address.exploded.replace(":", ""))
+    if letter == "v":
+        return "in-addr" if check.version == 4 else "ip6"
+    if letter == "p":
+        # Validated domain names of the address are not looked up
+        return "unknown"
+    return {
+        "s": check.sender,
+        "l": check.local,
+        "o": check.sender_domain,
+        "h": check.helo,
+    }[letter]
+
+
+@lru_cache(maxsize=64)
+def _splitter(delimiters: str):
+    return re.compile("[" + re.escape(delimiters) + "]")
+
+
+def expand(spec: str, domain: str, check=None):
+    # Target name of a domain-spec, macros expanded (section 7.3). Without a
+    # check only %{d} can be expanded
+    def replace(match):
+        if match["escape"]:
+            return ESCAPES[match["escape"]]
+        letter = match["letter"]
+        value = _macro_value(letter.lower(), domain, check)
+        parts = _splitter(match["delimiters"] or ".").split(value)
+        if match["reverse"]:
+            parts.reverse()
+        if match["digits"]:
+            parts = parts[-int(match["digits"]) :]
+        value = ".".join(parts)
+        if letter.isupper():
+            import urllib.parse
+
+            value = urllib.parse.quote(value, safe="")
+        return value
+
+    macro_letters(spec)
+    name = MACRO_REGEX.sub(replace, spec).rstrip(".")
+    # Names that grow too long lose their leftmost labels
+    while len(name) > 253 and "." in name:
+        name = name.split(".", 1)[1]
+    return name
+
+
+def valid_name(name: str):
+    labels = name.split(".")
+    return (
+        len(labels) > 1
+        and len(name) <= 253
+        and all(0 < len(label) <= 63 for label in labels)
+    )
+
+
+def _is_spf(record: str):
+    return record[:6].lower() == "v=spf1" and record[6:7] in ("", " ")
+
+
+def _syntax_error(terms: tuple):
+    # Records with a syntax error are a permerror whatever the address
+    redirects = 0
+    for term in terms:
+        if term.error is not None:
+            return True
+        if term.kind == "modifier":
+            if term.name in ("redirect", "exp"):
+                redirects += term.name == "redirect"
+                if not term.value:
+                    return True
+            if term.name == "redirect" and redirects > 1:
+                return True
+            continue
+        if term.name in ("include", "exists") and not term.value:
+            return True
+        if term.name in ("ip4", "ip6"):
+            if parse_network(term.argument, int(term.name[-1])) is None:
+                return True
+    return False
+
+
+class _Compiler:
+    # State of compiling one record, budget is the lookups and void lookups
+    # the record may spend before it is a permerror
+
+    def __init__(self, policy: Policy, budget: tuple, path: tuple, ttls: list):
+        self.policy = policy
+        self.version = policy.version
+        self.budget = budget
+        self.path = path
+        self.ttls = ttls
+        self.entries = []
+        self.steps = []
+        self.lookups = 0
+        self.voids = 0
+        self.stopped = False
+
+    def compile(self, record: str):
+        terms = parse_spf(record)
+        if _syntax_error(terms):
+            self.policy.result = "permerror"
+            return
+        redirect = None
+        for term in terms:
+            if term.kind == "modifier":
+                if term.name == "redirect":
+                    redirect = term
+                continue
+            self.term(term)
+            if self.stopped:
+                break
+            if term.name == "all":
+                # Terms after all are never reached and redirect is ignored
+                redirect = None
+                break
+        if redirect is not None and not self.stopped:
+            self.redirect(redirect)
+        self.flush()
+        self.policy.steps = tuple(self.steps)
+        self.policy.lookups = self.lookups
+        self.policy.voids = self.voids
+
+    def flush(self):
+        if self.entries:
+            table = NetworkTable(self.entries, self.version)
+            self.steps.append(Step("table", self.lookups, self.voids, table=table))
+            self.entries = []
+
+    def fail(self, result: str):
+        # Evaluations that get this far end with result
+        self.flush()
+        self.steps.append(Step("result", self.lookups, self.voids, result=result))
+        self.stopped = True
+
+    def charge(self, lookups: int, voids: int = 0):
+        self.lookups += lookups
+        self.voids += voids
+        if self.lookups > self.budget[0] or self.voids > self.budget[1]:
+            self.fail("permerror")
+        return not self.stopped
+
+    def add(self, network, result: str):
+        self.entries.append(
+            (
+                int(network.network_address),
+                int(network.broadcast_address),
+                (result, self.lookups, self.voids),
+            )
+        )
+
+    def query(self, name: str, rdtype: str, void: bool = True):
+        try:
+            return resolve(name, rdtype)
+        except dns_cache.NEGATIVE_ERRORS:
+            if void:
+                self.charge(0, 1)
+            return []
+        except Exception:
+            self.fail("temperror")
+            return []
+        finally:
+            self.ttls.append(get_default_cache().ttl(name, rdtype))
+
+    def networks(self, addresses: list, cidr: int):
+        networks = []
+        for address in addresses:
+            network = parse_network(f"{address}/{cidr}", self.version)
+            if network is not None:
+                networks.append(network)
+        return networks
+
+    def term(self, term):
+        result = QUALIFIERS[term.qualifier]
+        if term.name in ("ip4", "ip6"):
+            network = parse_network(term.argument)
+            if network.version == self.version:
+                self.add(network, result)
+            return
+        if term.name == "all":
+            self.add(
+                parse_network("0.0.0.0/0" if self.version == 4 else "::/0"), result
+            )
+            return
+
+        cidr = term.cidr4 if self.version == 4 else term.cidr6
+        if cidr is None:
+            cidr = 32 if self.version == 4 else 128
+        if term.name == "ptr" or not _is_static(term.value):
+            self.flush()
+            if self.charge(1):
+                self.steps.append(
+                    Step(
+                        term.name,
+                        self.lookups,
+                        self.voids,
+                        result=result,
+                        target=term.value,
+                        cidr=cidr,
+                    )
+                )
+            return
+        if not self.charge(1):
+            return
+        name = self.policy.domain
+        if term.value is not None:
+            name = expand(term.value, self.policy.domain)
+        if not valid_name(name):
+            self.fail("permerror")
+            return
+
+        if term.name == "a":
+            addresses = self.query(name, ADDRESS_TYPES[self.version])
+            for network in self.networks(addresses, cidr):
+                self.add(network, result)
+        elif term.name == "mx":
+            hosts = [
+                record.split()[-1].rstrip(".") for record in self.query(name, "MX")
+            ]
+            if len(hosts) > MX_LOOKUP_LIMIT:
+                self.fail("permerror")
+            for host in hosts:
+                if self.stopped or not host:
+                    continue
+                addresses = self.query(host, ADDRESS_TYPES[self.version], void=False)
+                for network in self.networks(addresses, cidr):
+                    self.add(network, result)
+        elif term.name == "exists":
+            if self.query(name, "A"):
+                self.add(
+                    parse_network("0.0.0.0/0" if self.version == 4 else "::/0"), result
+                )
+        else:
+            self.include(name, result)
+
+    def child(self, name: str):
+        # Compiled policy of an include or redirect target, within what is
+        # left of the budget
+        if name in self.path:
+            # A loop, the policy depends on where it was entered from
+            self.ttls.append(None)
+            self.fail("permerror")
+            return None
+        budget = (self.budget[0] - self.lookups, self.budget[1] - self.voids)
+        child, ttl = _compile(name, self.version, budget, self.path)
+        self.ttls.append(ttl)
+        if child.result is not None:
+            # A target without a record is a permerror (section 5.2)
+            self.fail("temperror" if child.result == "temperror" else "permerror")
+            return None
+        return child
+
+    def include(self, name: str, result: str):
+        child = self.child(name)
+        if child is None:
+            return
+        if child.static:
+            # Where the target passes, the include matches
+            for step in child.steps:
+                for first, last, value in step.table.intervals():
+                    if value[0] == "pass":
+                        self.entries.append(
+                            (
+                                first,
+                                last,
+                                (
+                                    result,
+                                    self.lookups + value[1],
+                                    self.voids + value[2],
+                                ),
+                            )
+                        )
+        else:
+            self.flush()
+            self.steps.append(
+                Step("include", self.lookups, self.voids, result=result, target=child)
+            )
+        self.charge(child.lookups, child.voids)
+
+    def redirect(self, term):
+        if not _is_static(term.value):
+            self.flush()
+            if self.charge(1):
+                self.steps.append(
+                    Step("redirect", self.lookups, self.voids, target=term.value)
+                )
+            return
+        if not self.charge(1):
+            return
+        name = expand(term.value, self.policy.domain)
+        if not valid_name(name):
+            self.fail("permerror")
+            return
+        child = self.child(name)
+        if child is None:
+            return
+        if child.static:
+            # The target decides every address the record did not match
+            for step in child.steps:
+                for first, last, value in step.table.intervals():
+                    self.entries.append(
+                        (
+                            first,
+                            last,
+                            (value[0], self.lookups + value[1], self.voids + value[2]),
+                        )
+                    )
+        else:
+            self.flush()
+            self.steps.append(Step("redirect", self.lookups, self.voids, target=child))
+        self.charge(child.lookups, child.voids)
+
+
+def _compile(
+    domain: str,
+    version: int,
+    budget: tuple = (LOOKUP_LIMIT, VOID_LOOKUP_LIMIT),
+    path: tuple = (),
+):
+    # Returns (policy, ttl), ttl None when the policy must not be kept.
+    # Policies compiled with a smaller budget than a record of their own has
+    # are cut short where the record including them runs out and not kept
+    rdtype = f"SPF{version}"
+    entry = policy_cache.get(domain, rdtype)
+    if entry is not None:
+        return entry.records, policy_cache.ttl(domain, rdtype)
+
+    policy = Policy(domain, version)
+    ttls = []
+    try:
+        records = [txt_string(record) for record in resolve(domain, "TXT")]
+    except dns_cache.NEGATIVE_ERRORS:
+        records = []
+    except Exception:
+        records = None
+        policy.result = "temperror"
+    ttls.append(get_default_cache().ttl(domain, "TXT"))
+    if records is not None:
+        records = [record for record in records if _is_spf(record)]
+        if not records:
+            policy.result = "none"
+        elif len(records) > 1:
+            policy.result = "permerror"
+        else:
+            _Compiler(policy, budget, path + (domain,), ttls).compile(records[0])
+
+    ttl = None if not all(ttls) else min(ttls)
+    if ttl and budget == (LOOKUP_LIMIT, VOID_LOOKUP_LIMIT):
+        policy_cache.set(domain, rdtype, policy, ttl)
+    return policy, ttl
+
+
+def compile_policy(domain: str, version: int = 4):
+    # Compiled policy of a domain for IPv4 or IPv6 addresses, from the cache
+    # when it is there
+    return _compile(domain.rstrip(".").lower(), version)[0]
+
+
+class _Check:
+    # The message a check_host call evaluates, and the lookups spent on
+    # targets only known while evaluating
+    __slots__ = (
+        "address",
+        "number",
+        "version",
+        "sender",
+        "local",
+        "sender_domain",
+        "helo",
+        "lookups",
+        "voids",
+    )
+
+    def __init__(self, ip, domain: str, sender: str = None, helo: str = None):
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        self.address = address
+        self.number = int(address)
+        self.version = address.version
+        self.helo = helo or domain
+        # Without a MAIL FROM the HELO name is checked (section 2.4)
+        local, _, sender_domain = (sender or self.helo).rpartition("@")
+        self.local = local or "postmaster"
+        self.sender_domain = sender_domain
+        self.sender = f"{self.local}@{sender_domain}"
+        self.lookups = 0
+        self.voids = 0
+
+    def exceeded(self, lookups: int, voids: int):
+        return (
+            lookups + self.lookups > LOOKUP_LIMIT
+            or voids + self.voids > VOID_LOOKUP_LIMIT
+        )
+
+    def query(self, name: str, rdtype: str, voids: int = None):
+        # Answers of a query made while evaluating, voids are the void
+        # lookups spent so far when an empty answer counts as one
+        try:
+            return resolve(name, rdtype)
+        except dns_cache.NEGATIVE_ERRORS:
+            if voids is not None:
+                self.voids += 1
+                if self.exceeded(0, voids):
+                    raise _Abort("permerror")
+            return []
+        except Exception:
+            raise _Abort("temperror")
+
+
+def _target(step: Step, policy: Policy, check: _Check):
+    if step.target is None:
+        return policy.domain
+    name = expand(step.target, policy.domain, check)
+    if not valid_name(name):
+        raise _Abort("permerror")
+    return name
+
+
+def _in_networks(check: _Check, addresses: list, cidr: int):
+    for address in addresses:
+        network = parse_network(f"{address}/{cidr}", check.version)
+        if network is not None and check.address in network:
+            return True
+    return False
+
+
+def _match(step: Step, policy: Policy, check: _Check, voids: int):
+    # Whether a term evaluated per check matches
+    rdtype = ADDRESS_TYPES[check.version]
+    if step.kind == "a":
+        addresses = check.query(_target(step, policy, check), rdtype, voids)
+        return _in_networks(check, addresses, step.cidr)
+    if step.kind == "mx":
+        records = check.query(_target(step, policy, check), "MX", voids)
+        if len(records) > MX_LOOKUP_LIMIT:
+            raise _Abort("permerror")
+        for record in records:
+            host = record.split()[-1].rstrip(".")
+            if host and _in_networks(check, check.query(host, rdtype), step.cidr):
+                return True
+        return False
+    if step.kind == "exists":
+        return bool(check.query(_target(step, policy, check), "A", voids))
+    # ptr, the names of the address that resolve back to it (section 5.5)
+    domain = _target(step, policy, check).lower()
+    try:
+        names = resolve(check.address.reverse_pointer, "PTR")
+    except Exception:
+        return False
+    for name in names[:MX_LOOKUP_LIMIT]:
+        name = name.rstrip(".").lower()
+        if name != domain and not name.endswith("." + domain):
+            continue
+        try:
+            addresses = resolve(name, rdtype)
+        except Exception:
+            continue
+        if any(ipaddress.ip_address(address) == check.address for address in addresses):
+            return True
+    return False
+
+
+def _child(step: Step, policy: Policy, check: _Check):
+    # Policy of an include or redirect target and whether its lookups are
+    # counted at run time
+    if isinstance(step.target, Policy):
+        return step.target, False
+    return compile_policy(_target(step, policy, check), check.version), True
+
+
+def _evaluate(policy: Policy, check: _Check, lookups: int = 0, voids: int = 0):
+    # Result of a policy for check, lookups and voids were spent before the
+    # record was entered
+    if policy.result is not None:
+        return policy.result
+    for step in policy.steps:
+        if step.kind == "table":
+            value = step.table.get(check.number)
+            if value is not None:
+                if check.exceeded(lookups + value[1], voids + value[2]):
+                    return "permerror"
+                return value[0]
+            if check.exceeded(lookups + step.lookups, voids + step.voids):
+                return "permerror"
+            continue
+        if step.kind == "result":
+            return step.result
+        if check.exceeded(lookups + step.lookups, voids + step.voids):
+            return "permerror"
+        if step.kind in ("include", "redirect"):
+            child, dynamic = _child(step, policy, check)
+            result = _evaluate(child, check, lookups + step.lookups, voids + step.voids)
+            if step.kind == "redirect":
+                return "permerror" if result == "none" else result
+            if result == "pass":
+                return step.result
+            if result in ("permerror", "none"):
+                raise _Abort("permerror")
+            if result == "temperror":
+                raise _Abort("temperror")
+            if dynamic:
+                check.lookups += child.lookups
+                check.voids += child.voids
+        elif _match(step, policy, check, voids + step.voids):
+            return step.result
+    return "neutral"
+
+
+def _run(check: _Check, domain: str):
+    domain = domain.rstrip(".").lower()
+    if not valid_name(domain):
+        return "none"
+    try:
+        return _evaluate(compile_policy(domain, check.version), check)
+    except _Abort as outcome:
+        return outcome.result
+
+
+def check_host(ip, domain: str, sender: str = None, helo: str = None):
+    # Result of the SPF record of domain for a message from ip, one of
+    # RESULTS. sender is the MAIL FROM address and helo the HELO name, both
+    # are only needed by records with macros. ValueError when ip is not an
+    # address
+    return _run(_Check(ip, domain, sender, helo), domain)
+
+
+def check_hosts(queries, workers: int = MAX_WORKERS):
+    # check_host for many (ip, domain) or (ip, domain, sender, helo) tuples,
+    # e.g. replayed from mail logs. The policies of the distinct domains are
+    # compiled concurrently first, then every query is a table lookup.
+    # Returns the results in the order of the queries, a query whose ip is
+    # not an address gets permerror instead of failing the whole batch
+    queries = [tuple(query) for query in queries]
+    checks = []
+    for query in queries:
+        try:
+            checks.append(_Check(*query))
+        except ValueError:
+            checks.append(None)
+    keys = {
+        (query[1].rstrip(".").lower(), check.version)
+        for query, check in zip(queries, checks)
+        if check is not None and valid_name(query[1].rstrip(".").lower())
+    }
+    if len(keys) > 1 and workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(len(keys), workers)) as pool:
+            list(pool.map(lambda key: compile_policy(*key), keys))
+    return [
+        "permerror" if check is None else _run(check, query[1])
+        for query, check in zip(queries, checks)
+    ]
@@ -0,0 +1,307 @@
+import ipaddress
+
+from dns_cache import resolve, txt_string
+from ip_ranges import parse_network
+from results import throw_issue
+from spf_parser import parse_spf
+from spf_record_validator import (
+    LookupContext,
+    find_a_record,
+    find_mx_record,
+    validate_spf,
+)
+
+# RFC 7208 section 3.3: a TXT character-string holds at most 255 bytes, and
+# records are best kept under 450 bytes so the answer fits in a UDP packet
+TXT_STRING_LENGTH = 255
+RECORD_LENGTH = 450
+
+# Flattening walks trees that are over the lookup limit on purpose, the
+# context is only used to detect loops
+UNLIMITED = 10**9
+
+
+class FlatTree:
+    # Outcome of walking one record
+    #   items    - in record order, ip_networks the record passes and the
+    #              terms that cannot be replaced by addresses, as strings
+    #   all_term - the all mechanism of the record, None when there is none
+    #   exact    - False when some part of the record cannot be flattened
+    # SPF evaluates terms in order and the first match wins, so networks are
+    # never moved across a kept term
+    __slots__ = ("items", "all_term", "exact")
+
+    def __init__(self):
+        self.items = []
+        self.all_term = None
+        self.exact = True
+
+    @property
+    def networks(self):
+        return [item for item in self.items if not isinstance(item, str)]
+
+    @property
+    def kept(self):
+        return [item for item in self.items if isinstance(item, str)]
+
+
+def _spf_record(domain: str, issues: list):
+    try:
+        records = [txt_string(record) for record in resolve(domain, "TXT")]
+    except Exception:
+        records = []
+    records = [record for record in records if record.startswith("v=spf1")]
+    if not records:
+        throw_issue("SPF_FLATTEN_NO_RECORD", issues, domain)
+        return None
+    return records[0]
+
+
+def _addresses(domain: str, issues: list, context):
+    # A and AAAA addresses of a host, AAAA is optional
+    addresses = find_a_record(domain, issues, context)
+    try:
+        addresses = addresses + resolve(domain, "AAAA")
+    except Exception:
+        pass
+    return addresses
+
+
+def _host_networks(addresses: list, cidr4: int, cidr6: int):
+    networks = []
+    for address in addresses:
+        network = parse_network(address)
+        if network is None:
+            continue
+        prefix = cidr4 if network.version == 4 else cidr6
+        if prefix is not None:
+            network = network.supernet(new_prefix=prefix)
+        networks.append(network)
+    return networks
+
+
+def _network(term):
+    return parse_network(term.argument, 4 if term.name == "ip4" else 6)
+
+
+def walk(spf_record: str, domain: str, issues: list, context, top: bool = True):
+    # Resolve the mechanism tree of a record into the networks it passes
+    tree = FlatTree()
+    terms = parse_spf(spf_record)
+    if terms is None:
+        throw_issue("SPF_NOT_SPF", issues)
+        tree.exact = False
+        return tree
+
+    context.path.append(domain)
+    redirect = None
+    for term in terms:
+        if term.error is None and term.is_lookup:
+            context.lookup()
+        if term.error is not None:
+            issues.append(term.error)
+            tree.exact = False
+        elif term.name in ("ip4", "ip6") and _network(term) is None:
+            throw_issue(
+                "SPF_INVALID_ADDRESS", issues, int(term.name[-1]), term.argument
+            )
+            tree.exact = False
+        elif term.name == "all":
+            tree.all_term = term.raw
+        elif term.name == "redirect":
+            redirect = term.value
+        elif term.kind == "modifier":
+            if top:
+                tree.items.append(term.raw)
+
+        # Terms that only match at evaluation time, or whose negative
+        # qualifier would be lost by merging, stay as they are
+        elif (
+            not term.is_pass
+            or term.name in ("exists", "ptr")
+            or "%" in (term.value or "")
+        ):
+            if top:
+                tree.items.append(term.raw)
+            else:
+                tree.exact = False
+
+        elif term.name in ("ip4", "ip6"):
+            tree.items.append(_network(term))
+        elif term.name == "a":
+            addresses = _addresses(term.value or domain, issues, context)
+            tree.items.extend(_host_networks(addresses, term.cidr4, term.cidr6))
+        elif term.name == "mx":
+            for mx_record in find_mx_record(term.value or domain, issues, context):
+                addresses = _addresses(mx_record.split(" ")[1], issues, context)
+                tree.items.extend(_host_networks(addresses, term.cidr4, term.cidr6))
+        elif term.name == "include":
+            # An include matches what its record passes, which is everything
+            # when that record ends with a passing all
+            subtree = _walk_domain(term.value, issues, context)
+            if (
+                subtree is not None
+                and subtree.exact
+                and subtree.all_term not in ("all", "+all")
+            ):
+                tree.items.extend(subtree.items)
+            elif top:
+                tree.items.append(term.raw)
+            else:
+                tree.exact = False
+
+    # redirect is only followed when the record has no all mechanism, the
+    # target's all mechanism then decides the result
+    if redirect is not None and tree.all_term is None:
+        subtree = _walk_domain(redirect, issues, context, top)
+        if subtree is not None:
+            tree.items.extend(subtree.items)
+            tree.all_term = subtree.all_term
+            tree.exact = tree.exact and subtree.exact
+        else:
+            tree.exact = False
+    context.path.pop()
+    return tree
+
+
+def _walk_domain(domain: str, issues: list, context, top: bool = False):
+    if domain in context.path:
+        throw_issue("SPF_FLATTEN_LOOP", issues, domain)
+        return None
+    record = _spf_record(domain, issues)
+    if record is None:
+        return None
+    return walk(record, domain, issues, context, top)
+
+
+def collapse(networks: list):
+    # Merge adjacent and overlapping networks, ipv4 first
+    ip4 = [network for network in networks if network.version == 4]
+    ip6 = [network for network in networks if network.version == 6]
+    return list(ipaddress.collapse_addresses(ip4)) + list(
+        ipaddress.collapse_addresses(ip6)
+    )
+
+
+def txt_strings(record: str):
+    # Split a record into the 255 byte character-strings of one TXT record
+    return [
+        record[index : index + TXT_STRING_LENGTH]
+        for index in range(0, len(record), TXT_STRING_LENGTH)
+    ] or [""]
+
+
+def _txt_record(name: str, record: str):
+    strings = txt_strings(record)
+    return {
+        "name": name,
+        "record": record,
+        "txt": " ".join(f'"{string}"' for string in strings),
+    }
+
+
+def _runs(items: list):
+    # Split items into kept terms and the runs of networks between them,
+    # each run collapsed on its own
+    runs = []
+    for item in items:
+        if isinstance(item, str):
+            runs.append(item)
+        elif runs and isinstance(runs[-1], list):
+            runs[-1].append(item)
+        else:
+            runs.append([item])
+    return [run if isinstance(run, str) else collapse(run) for run in runs]
+
+
+def _ip_terms(networks: list):
+    return [f"ip{network.version}:{network}" for network in networks]
+
+
+def pack(
+    domain: str,
+    items: list,
+    all_term: str,
+    max_length: int = RECORD_LENGTH,
+    child_name: str = "_spf{index}.{domain}",
+):
+    # Lay the items of a FlatTree out as the top-level record plus as many
+    # chained records as needed to keep every record under max_length bytes
+    runs = _runs(items)
+    tail = [all_term or "~all"]
+
+    def record(parts):
+        return " ".join(["v=spf1"] + parts)
+
+    flat = []
+    for run in runs:
+        flat.extend([run] if isinstance(run, str) else _ip_terms(run))
+    if len(record(flat + tail)) <= max_length:
+        return [_txt_record(domain, record(flat + tail))]
+
+    # Every run of networks moves to chained records included where the run
+    # was. Each one ends with -all so that an address it does not list makes
+    # the include not match
+    def name(index):
+        return child_name.format(index=index, domain=domain)
+
+    top = []
+    children = []
+    for run in runs:
+        if isinstance(run, str):
+            top.append(run)
+            continue
+        first = len(children) + 1
+        current = []
+        for term in _ip_terms(run):
+            if current and len(record(current + [term, "-all"])) > max_length:
+                children.append(current)
+                current = []
+            current.append(term)
+        children.append(current)
+        top.extend(
+            f"include:{name(index)}" for index in range(first, len(children) + 1)
+        )
+
+    records = [_txt_record(domain, record(top + tail))]
+    for index, child in enumerate(children, 1):
+        records.append(_txt_record(name(index), record(child + ["-all"])))
+    return records
+
+
+def flatten_spf(
+    domain: str,
+    spf_record: str = None,
+    max_length: int = RECORD_LENGTH,
+    child_name: str = "_spf{index}.{domain}",
+):
+    # Resolve the whole include tree of a domain's SPF record into a minimal
+    # set of ip4/ip6 networks and lay them out as TXT records that need no
+    # DNS lookups apart from the chained includes
+    issues = []
+    context = LookupContext(lookup_limit=UNLIMITED, void_lookup_limit=UNLIMITED)
+    if spf_record is None:
+        spf_record = _spf_record(domain, issues)
+    if spf_record is None:
+        return {"status": False, "issues": issues, "records": [], "networks": []}
+
+    tree = walk(spf_record, domain, issues, context)
+    networks = collapse(tree.networks)
+    records = pack(domain, tree.items, tree.all_term, max_length, child_name)
+
+    top = validate_spf(records[0]["record"], domain, resolve=False)
+    if top["lookups"] > LookupContext().lookup_limit:
+        throw_issue("SPF_FLATTEN_LOOKUPS", issues, top["lookups"])
+    for record in records:
+        if len(record["record"]) > max_length:
+            throw_issue("SPF_FLATTEN_LENGTH", issues, record["name"], max_length)
+
+    return {
+        "status": not any(issue["severity"] != "warning" for issue in issues),
+        "issues": issues,
+        "records": records,
+        "networks": [str(network) for network in networks],
+        "kept": tree.kept,
+        "lookups": context.lookups,
+        "flattened_lookups": top["lookups"],
+    }
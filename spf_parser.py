@@ -0,0 +1,178 @@
+from functools import lru_cache
+
+from patterns import LazyPattern
+from results import Issue
+
+# RFC 7208 section 4.6.1 term names
+MECHANISMS = frozenset(("all", "include", "a", "mx", "ptr", "ip4", "ip6", "exists"))
+MODIFIERS = frozenset(("redirect", "exp"))
+
+# Mechanisms and modifiers that cost a DNS lookup (section 4.6.4)
+LOOKUP_TERMS = frozenset(("include", "a", "mx", "ptr", "exists", "redirect"))
+
+TERM_REGEX = LazyPattern(
+    r"^(?P<qualifier>[+\-~?])?(?P<name>[A-Za-z][A-Za-z0-9_.\-]*)(?P<rest>.*)$"
+)
+DUAL_CIDR_REGEX = LazyPattern(
+    r"^(?P<domain>[^/]*)(?:/(?P<cidr4>[^/]*))?(?://(?P<cidr6>.*))?$"
+)
+IP_CIDR_REGEX = LazyPattern(r"^(?P<address>[^/]*)(?:/(?P<cidr>.*))?$")
+DIGITS_REGEX = LazyPattern(r"^[0-9]{1,3}$")
+
+# Terms whose value is a domain-spec
+DOMAIN_SPEC_TERMS = frozenset(
+    ("include", "a", "mx", "ptr", "exists", "redirect", "exp")
+)
+
+# Macros of a domain-spec (section 7), the exp only letters c, r and t are
+# not allowed in one
+MACRO_REGEX = LazyPattern(
+    r"%\{(?P<letter>[slodiphvSLODIPHV])(?P<digits>[0-9]*)(?P<reverse>[rR]?)"
+    r"(?P<delimiters>[.+,/_=-]*)\}|%(?P<escape>[%_-])|%"
+)
+
+
+class SPFTerm:
+    # One directive or modifier of an SPF record
+    #   qualifier - "+", "-", "~" or "?", None when it is not written out
+    #   name      - lower case mechanism or modifier name
+    #   kind      - "mechanism", "modifier" or "unknown"
+    #   argument  - everything after ":" or "=", None when there is none
+    #   value     - domain-spec or address without the prefix lengths
+    #   cidr4     - ipv4 prefix length (ip4, a, mx), None when not given
+    #   cidr6     - ipv6 prefix length (ip6, a, mx), None when not given
+    #   error     - Issue found while tokenizing, None when valid
+    __slots__ = (
+        "raw",
+        "qualifier",
+        "name",
+        "kind",
+        "argument",
+        "value",
+        "cidr4",
+        "cidr6",
+        "error",
+    )
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.qualifier = None
+        self.name = None
+        self.kind = "unknown"
+        self.argument = None
+        self.value = None
+        self.cidr4 = None
+        self.cidr6 = None
+        self.error = None
+
+    @property
+    def is_lookup(self):
+        return self.name in LOOKUP_TERMS
+
+    @property
+    def is_pass(self):
+        return self.qualifier in (None, "+")
+
+    def __repr__(self):
+        return f"SPFTerm({self.raw!r})"
+
+
+def _prefix_length(text: str, maximum: int):
+    if text is None:
+        return None
+    if not DIGITS_REGEX.match(text) or int(text) > maximum:
+        raise ValueError(text)
+    return int(text)
+
+
+def macro_letters(spec: str):
+    # Lower case letters of the macros of a domain-spec, ValueError when a
+    # macro is malformed
+    letters = set()
+    for match in MACRO_REGEX.finditer(spec):
+        if match["letter"]:
+            if match["digits"] and int(match["digits"]) == 0:
+                raise ValueError(spec)
+            letters.add(match["letter"].lower())
+        elif not match["escape"]:
+            raise ValueError(spec)
+    return letters
+
+
+def _check_macros(term: SPFTerm):
+    if term.error is None and term.value and term.name in DOMAIN_SPEC_TERMS:
+        try:
+            macro_letters(term.value)
+        except ValueError:
+            term.error = Issue("SPF_INVALID_MACRO", (term.name, term.raw))
+    return term
+
+
+def parse_term(raw: str):
+    term = SPFTerm(raw)
+    match = TERM_REGEX.match(raw)
+    if match is None:
+        term.error = Issue("SPF_UNKNOWN_TERM", (raw,))
+        return term
+
+    term.qualifier = match["qualifier"]
+    term.name = match["name"].lower()
+    rest = match["rest"]
+
+    if rest.startswith("="):
+        term.kind = "modifier"
+        term.argument = term.value = rest[1:]
+        if term.qualifier is not None:
+            term.error = Issue("SPF_MODIFIER_QUALIFIER", (term.name,))
+        return _check_macros(term)
+
+    if term.name not in MECHANISMS:
+        term.error = Issue("SPF_UNKNOWN_TERM", (raw,))
+        return term
+
+    term.kind = "mechanism"
+    if rest.startswith(":"):
+        term.argument = rest[1:]
+    elif rest and not rest.startswith("/"):
+        term.error = Issue("SPF_INVALID_MECHANISM", (raw,))
+        return term
+
+    if term.name in ("ip4", "ip6") and not term.argument:
+        term.error = Issue("SPF_ADDRESS_REQUIRED", (term.name, raw))
+        return term
+
+    try:
+        if term.name in ("ip4", "ip6"):
+            parts = IP_CIDR_REGEX.match(term.argument)
+            term.value = parts["address"]
+            if term.name == "ip4":
+                term.cidr4 = _prefix_length(parts["cidr"], 32)
+            else:
+                term.cidr6 = _prefix_length(parts["cidr"], 128)
+        elif term.name in ("a", "mx"):
+            spec = rest if term.argument is None else term.argument
+            parts = DUAL_CIDR_REGEX.match(spec)
+            if parts is None:
+                raise ValueError(raw)
+            term.value = parts["domain"] or None
+            term.cidr4 = _prefix_length(parts["cidr4"], 32)
+            term.cidr6 = _prefix_length(parts["cidr6"], 128)
+            if term.argument is not None and term.value is None:
+                raise ValueError(raw)
+        else:
+            term.value = term.argument
+            if rest.startswith("/"):
+                raise ValueError(raw)
+    except ValueError:
+        term.error = Issue("SPF_INVALID_PREFIX", (term.name, raw))
+    return _check_macros(term)
+
+
+@lru_cache(maxsize=4096)
+def parse_spf(record: str):
+    # Tokenize an SPF record in a single pass over whitespace separated terms.
+    # Returns a tuple of SPFTerm, or None when the string is not an SPF record
+    items = record.split()
+    if not items or items[0].lower() != "v=spf1":
+        return None
+    return tuple(parse_term(item) for item in items[1:])
@@ -1,106 +1,272 @@
-import dns.resolver
-import re
+import dns_cache
+from dns_cache import (
+    Deadline,
+    DNSCache,
+    get_default_cache,
+    query_lifetime,
+    query_outcome,
+    resolve,
+    txt_string,
+)
+from ip_ranges import classify, is_public, parse_network
+from observers import Mechanism, ObserverGroup, TimingTree
+from patterns import LazyPattern
+from results import WARNING, Result, throw_issue
+from spf_parser import MODIFIERS, parse_spf
+
+# RFC 7208 section 4.6.4 processing limits
+LOOKUP_LIMIT = 10
+VOID_LOOKUP_LIMIT = 2
+MX_LOOKUP_LIMIT = 10
+
+UPPERCASE_NAME_REGEX = LazyPattern(r"^[+\-~?]?[a-z0-9]*[A-Z]")
+
+# Validation results of include/redirect targets, kept until their TXT record
+# expires so that records sharing providers do not walk the same tree again
+subtree_cache = DNSCache()
 
 
 # Helping functions
-def throw_issue(severity: str, message: str, issues: list):
-    issues.append({"severity": severity, "message": message})
+class LookupContext:
+    # DNS lookup accounting shared by every record walked while validating
+    # one SPF record. Once a limit is exceeded or a loop is found the walk
+    # stops and the failure is reported on the top-level record. observer
+    # receives the query and mechanism events of the whole walk, deadline
+    # bounds its queries and stops it once the time is up
+
+    def __init__(
+        self,
+        lookup_limit: int = LOOKUP_LIMIT,
+        void_lookup_limit: int = VOID_LOOKUP_LIMIT,
+        observer=None,
+        deadline: Deadline = None,
+    ):
+        self.lookup_limit = lookup_limit
+        self.void_lookup_limit = void_lookup_limit
+        self.lookups = 0
+        self.void_lookups = 0
+        self.path = []
+        self.failures = 0
+        self.stopped = False
+        self.issues = []
+        self.observer = observer
+        self.deadline = deadline
+        self.timed_out = False
+
+    def fail(self, code: str, *args):
+        self.failures += 1
+        self.stopped = True
+        throw_issue(code, self.issues, *args)
+
+    def add(self, lookups: int, void_lookups: int = 0):
+        # Account for lookups and return False when the walk has to stop
+        self.lookups += lookups
+        self.void_lookups += void_lookups
+        if self.lookups > self.lookup_limit and not self.stopped:
+            self.fail("SPF_LOOKUP_LIMIT", self.lookup_limit)
+        if self.void_lookups > self.void_lookup_limit and not self.stopped:
+            self.fail("SPF_VOID_LOOKUP_LIMIT", self.void_lookup_limit)
+        return not self.stopped
+
+    def lookup(self):
+        return self.add(1)
+
+    def void_lookup(self):
+        return self.add(0, 1)
+
+    def expired(self):
+        # Once the deadline has passed the walk stops, what was validated so
+        # far is returned with a timed out issue
+        if not self.timed_out and self.deadline is not None:
+            if self.deadline.expired():
+                self.timed_out = True
+                self.failures += 1
+                self.stopped = True
+                throw_issue("SPF_TIMED_OUT", self.issues)
+        return self.timed_out
+
+    def resolve(self, name: str, rdtype: str):
+        return resolve(
+            name,
+            rdtype,
+            observer=self.observer,
+            lifetime=query_lifetime(self.deadline),
+        )
 
 
 def is_public_ip4(ip: str):
+    # Check if it is a globally reachable ipv4 address or network
+    return is_public(ip, 4)
 
-    # Check if it is an ipv4 address
 
-    ip_regex = re.compile(
-        r"^((25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])(/(3[0-2]|[1-2][0-9]|[1-9]))?$"
-    )
+def is_ip6_valid(ip: str):
+    # Check if it is an ipv6 address or network
+    return parse_network(ip, 6) is not None
 
-    if not ip_regex.match(ip):
-        return False
 
-    # Check if the IP address is public
-    ip = ip.split(".")
-    if ip[0] == "10":
-        return False
-    if ip[0] == "192" and ip[1] == "168":
-        return False
-    try:
-        if ip[0] == "172" and 16 <= int(ip[1]) <= 31:
-            return False
-    except:
-        return False
-    return True
+def address_networks(addresses: list, prefix: int):
+    # Networks covered by the addresses of an a/mx mechanism with its prefix
+    networks = []
+    for address in addresses:
+        network = parse_network(address)
+        if network is None:
+            continue
+        if prefix is not None and network.version == 4:
+            network = network.supernet(new_prefix=prefix)
+        networks.append(str(network))
+    return networks
 
 
-def is_ip6_valid(ip: str):
-    # Check if it is an ipv6 address
-    # helper variables
-    double_colon = False
-    omitting_zeros = False
-    ip_regex = re.compile(r"[0-9a-f:]+(/(1[0-2][0-8]|[1-9][0-9]|[1-9]))?$")
-
-    # Initial check of the syntax (characters and prefix length)
-    if ip_regex.match(ip) and ip.find(":") > 0:
-        ip = ip.split("/")[0]
-        segments = ip.split(":")
-        for index, segment in enumerate(segments):
-            # Check for the zeros compression
-            if segment == "":
-                if double_colon:
-                    if index != len(segments) - 1:
-                        return False
-                double_colon = True
-
-            # Check the syntax for each segment
-            elif re.match(r"^[0-9a-f]{1-4}$", segment):
-                if len(segment) < 4:
-                    omitting_zeros = True
-                if omitting_zeros and segment.startswith("0"):
-                    return False
-
-        return True
-    return False
-
-
-def find_spf_record(domain: str, issues: list):
-    # Find the SPF record for the provided domain
-    try:
-        records = dns.resolver.resolve(domain, "TXT")
-        for record in records:
-            record = str(record)
-            if record.startswith("v=spf1"):
-                validate_spf(record, domain, issues)
-    except:
-        throw_issue("critical", "No SPF record found", issues)
+def has_macro(domain: str):
+    # Domain-specs with macros such as %{i} depend on the message being
+    # checked (see spf_check). The walk counts their lookup but does not query
+    # them, so they never count as void lookups
+    return "%" in domain
+
+
+def add_dependency(dependencies: list, name: str, rdtype: str):
+    if (name, rdtype) not in dependencies:
+        dependencies.append((name, rdtype))
+
+
+def throw_missing(kind: str, issues: list, failure: str = None):
+    # Queries that failed for another reason than a negative answer say so
+    if failure is None:
+        throw_issue("SPF_NO_RECORD", issues, kind)
+    else:
+        throw_issue("SPF_QUERY_FAILED", issues, kind, failure)
+
 
+def throw_subtree_errors(term, subtree: dict, issues: list):
+    # Errors of an included or redirected record, memoized with the subtree,
+    # make the record that uses it fail too. Warnings stay with the subtree
+    errors = [
+        issue["message"] for issue in subtree["issues"] if issue["severity"] != WARNING
+    ]
+    if errors:
+        throw_issue(
+            "SPF_INCLUDE_ERRORS", issues, term.name, term.value, "; ".join(errors)
+        )
 
-def find_a_record(domain: str, issues: list):
-    # Find the A record for the provided domain
+
+def find_spf_record(domain: str, issues: list, context=None):
+    # Find and validate the SPF record for the provided domain
+    if context is None:
+        context = LookupContext()
+
+    # A domain already being validated further up means the records loop
+    if domain in context.path:
+        context.fail("SPF_INCLUDE_LOOP", domain, " -> ".join(context.path + [domain]))
+        return None
+
+    if context.expired():
+        return None
+
+    entry = subtree_cache.get(domain, "SPF")
+    if entry is not None:
+        context.add(entry.records["lookups"], entry.records["void_lookups"])
+        return entry.records
+
+    failure = None
+    try:
+        answers = context.resolve(domain, "TXT")
+        records = [txt_string(record) for record in answers]
+    except dns_cache.NEGATIVE_ERRORS:
+        context.void_lookup()
+        records = []
+    except Exception as error:
+        if context.expired():
+            return None
+        failure = query_outcome(error)
+        records = []
+    records = [record for record in records if record.startswith("v=spf1")]
+    if not records:
+        throw_missing("SPF", issues, failure)
+        return None
+    # Several records are a permerror (RFC 7208 section 4.5), none is picked
+    if len(records) > 1:
+        throw_issue("RECORD_MULTIPLE", issues, "SPF")
+        return None
+
+    failures = context.failures
+    result = validate_spf(records[0], domain, context=context)
+
+    # Subtrees cut short by the lookup budget or a loop depend on the record
+    # that included them and are not reused
+    ttl = get_default_cache().ttl(domain, "TXT")
+    if ttl and context.failures == failures:
+        subtree_cache.set(domain, "SPF", result, ttl)
+    return result
+
+
+def _context_resolve(domain: str, rdtype: str, context):
+    if context is None:
+        return resolve(domain, rdtype)
+    return context.resolve(domain, rdtype)
+
+
+def find_a_record(domain: str, issues: list, context=None, void_lookups: bool = True):
+    # Find the A record for the provided domain. Empty answers count as void
+    # lookups of context unless void_lookups is False
     a_redords = []
+    if context is not None and context.expired():
+        return a_redords
     try:
-        records = dns.resolver.resolve(domain, "A")
+        records = _context_resolve(domain, "A", context)
         for record in records:
             record = str(record)
             a_redords.append(record)
-    except:
-        throw_issue("critical", "No A record found", issues)
+    except dns_cache.NEGATIVE_ERRORS:
+        if context is not None and void_lookups:
+            context.void_lookup()
+        throw_missing("A", issues)
+    except Exception as error:
+        if context is None or not context.expired():
+            throw_missing("A", issues, query_outcome(error))
     return a_redords
 
 
-def find_mx_record(domain: str, issues: list):
+def find_mx_record(domain: str, issues: list, context=None):
     mx_records = []
+    if context is not None and context.expired():
+        return mx_records
     try:
-        records = dns.resolver.resolve(domain, "MX")
+        records = _context_resolve(domain, "MX", context)
         for record in records:
             record = str(record)
             mx_records.append(record)
-    except:
-        throw_issue("critical", "No MX record found", issues)
+    except dns_cache.NEGATIVE_ERRORS:
+        if context is not None:
+            context.void_lookup()
+        throw_missing("MX", issues)
+    except Exception as error:
+        if context is None or not context.expired():
+            throw_missing("MX", issues, query_outcome(error))
+    if len(mx_records) > MX_LOOKUP_LIMIT:
+        throw_issue("SPF_MX_LIMIT", issues, domain, MX_LOOKUP_LIMIT)
+        mx_records = mx_records[:MX_LOOKUP_LIMIT]
     return mx_records
 
 
-def validate_spf(spf_record: str, curr_domain: str, issues: list = []):
-    # Check if the SPF record is valid
+def validate_spf(
+    spf_record: str,
+    curr_domain: str,
+    issues: list = [],
+    context=None,
+    resolve: bool = True,
+    observer=None,
+    timings: bool = False,
+    timeout: float = None,
+    query_timeout: float = None,
+):
+    # Check if the SPF record is valid. With resolve=False only the static
+    # checks run and no DNS query is made, the names the record depends on
+    # are returned under "dependencies" as (name, rdtype) pairs.
+    # observer receives query and mechanism events (see observers), with
+    # timings=True a tree of them is returned under "timings".
+    # timeout bounds the whole walk in seconds and query_timeout every single
+    # query, when the time is up the result so far is returned with a timed
+    # out issue
 
     # helper variables
     all_check = False
@@ -108,225 +274,175 @@ def validate_spf(spf_record: str, curr_domain: str, issues: list = []):
     issues = []
     test_status = True
     is_tag_before_all = False
+    networks = []
+    dependencies = []
+
+    # Lookup accounting is shared with the records this one includes
+    owner = context is None
+    tree = TimingTree(curr_domain) if owner and timings else None
+    if owner:
+        if tree is not None:
+            observer = ObserverGroup(observer, tree)
+        deadline = None
+        if timeout is not None or query_timeout is not None:
+            deadline = Deadline(timeout, query_timeout)
+        context = LookupContext(observer=observer, deadline=deadline)
+    observer = context.observer
+    mechanism = None
+    lookups = context.lookups
+    void_lookups = context.void_lookups
+    context.path.append(curr_domain)
 
     # Check if it is an spf record
-    if spf_record.startswith("v=spf1"):
-        if re.match(r"[A-Z]", spf_record):
-            throw_issue(
-                "critical",
-                "Spf record must not contain uppercase characters in it",
-                issues,
-            )
-        # Split the record into items
-        spf_record = spf_record.split(" ")
-        spf_record.pop(0)
-        # Iterate over the items
-        for item in spf_record:
+    terms = parse_spf(spf_record)
+    if terms is not None:
+        version = spf_record.split(None, 1)[0]
+        if version != "v=spf1" or any(
+            UPPERCASE_NAME_REGEX.match(term.raw) for term in terms
+        ):
+            throw_issue("SPF_UPPERCASE", issues)
+        # Iterate over the terms
+        for term in terms:
+            if context.stopped:
+                break
+            if observer is not None:
+                if mechanism is not None:
+                    mechanism.close(observer, context.lookups)
+                mechanism = Mechanism(observer, curr_domain, term.raw, context.lookups)
+
             # Check if there is no tags after all mechanism
             if all_check:
-                throw_issue(
-                    "critical",
-                    "The all mechanism should be the last mechanism in the SPF record",
-                    issues,
-                )
-
-            # Check if the item is the all mechanism
-            if item.endswith("all"):
+                throw_issue("SPF_ALL_NOT_LAST", issues)
+
+            # Syntax errors are found by the parser
+            if term.kind == "unknown":
+                issues.append(term.error)
+                continue
+            if term.name != "all":
+                is_tag_before_all = True
+            if term.error is not None:
+                issues.append(term.error)
+                continue
+            if term.is_lookup and not context.lookup():
+                break
+
+            # Check if the term is the all mechanism
+            if term.name == "all":
                 if not is_tag_before_all:
-                    throw_issue(
-                        "critical",
-                        "all mechanism must not be the first or the only mechanism in the SPF record",
-                        issues,
-                    )
+                    throw_issue("SPF_ALL_FIRST", issues)
                 if redirect_check:
-                    throw_issue(
-                        "critical",
-                        "all mechanism is used with redirect mechanism which should not be done",
-                        issues,
-                    )
+                    throw_issue("SPF_ALL_WITH_REDIRECT", issues)
                 if all_check:
-                    throw_issue(
-                        "critical", "all mechanism is used more than once", issues
-                    )
-                if len(item) != 4:
-                    throw_issue(
-                        "critical", "all mechanism syntax must be [-+?~]all", issues
-                    )
-                if item.startswith("+") or item.startswith("?"):
-                    throw_issue(
-                        "warning",
-                        "It is preffered for the all tag to be - or ~",
-                        issues,
-                    )
+                    throw_issue("SPF_ALL_REPEATED", issues)
+                if term.qualifier is None or term.argument is not None:
+                    throw_issue("SPF_ALL_SYNTAX", issues)
+                if term.qualifier in ("+", "?"):
+                    throw_issue("SPF_ALL_PERMISSIVE", issues)
                 all_check = True
 
-            # Check if the item is the include mechanism
-            elif item.startswith("include:"):
-                is_tag_before_all = True
-                include_domain = item.split(":")[1]
-                find_spf_record(include_domain, issues)
-
-            # Check if the item is the redirect mechanism
-            elif item.startswith("redirect="):
-                is_tag_before_all = True
-                if redirect_check:
+            # Check if the term is the include mechanism or the redirect modifier
+            elif term.name in ("include", "redirect"):
+                if term.name == "redirect" and redirect_check:
+                    throw_issue("SPF_REDIRECT_REPEATED", issues)
+                if not term.value:
+                    throw_issue("SPF_DOMAIN_REQUIRED", issues, term.name, term.raw)
+                    continue
+                add_dependency(dependencies, term.value, "TXT")
+                if resolve and not has_macro(term.value):
+                    subtree = find_spf_record(term.value, issues, context)
+                    if subtree is not None:
+                        throw_subtree_errors(term, subtree, issues)
+                    if subtree is not None and term.is_pass:
+                        networks.extend(subtree["networks"])
+                if term.name == "redirect":
+                    redirect_check = True
+
+            # Check if the term is the ip4 mechanism
+            elif term.name in ("ip4", "ip6"):
+                version = 4 if term.name == "ip4" else 6
+                network = parse_network(term.argument, version)
+                if network is None:
+                    throw_issue("SPF_INVALID_ADDRESS", issues, version, term.argument)
+                    continue
+                category, public = classify(term.argument, version)
+                if not public:
                     throw_issue(
-                        "critical", "redirect mechanism is used more than once", issues
+                        "SPF_PRIVATE_ADDRESS", issues, term.argument, version, category
                     )
-                redirect_domain = item.split("=")[1]
-                find_spf_record(redirect_domain, issues)
-                redirect_check = True
-
-            # Check if the item is the ip4 mechanism
-            elif item.startswith("ip4:"):
-                is_tag_before_all = True
-                ip = item.split(":")[1]
-                if not is_public_ip4(ip):
-                    throw_issue(
-                        "warning",
-                        f"The ip address: {ip} is not a public ipv4 address",
-                        issues,
+                if term.is_pass:
+                    networks.append(str(network))
+
+            # Check if the term is the a mechanism
+            elif term.name == "a":
+                domain = term.value or curr_domain
+                add_dependency(dependencies, domain, "A")
+                if not resolve or has_macro(domain):
+                    continue
+                a_records = find_a_record(domain, issues, context)
+                if term.is_pass:
+                    networks.extend(address_networks(a_records, term.cidr4))
+                for record in a_records:
+                    if not is_public_ip4(record):
+                        throw_issue("SPF_PRIVATE_A_ADDRESS", issues, record, domain)
+
+            #  Check if the term is the mx mechanism
+            elif term.name == "mx":
+                domain = term.value or curr_domain
+                add_dependency(dependencies, domain, "MX")
+                if not resolve or has_macro(domain):
+                    continue
+                mx_records = find_mx_record(domain, issues, context)
+                for mx_record in mx_records:
+                    a_records = find_a_record(
+                        mx_record.split(" ")[1], issues, context, void_lookups=False
                     )
-
-            # Check if the item is the ip6 mechanism
-            elif item.startswith("ip6:"):
-                is_tag_before_all = True
-                ip = item.replace("ip6:", "")
-                if not is_ip6_valid(ip):
-                    throw_issue("critical", f"Invalid ipv6 address: {ip}", issues)
-
-            # Check if the item is the a mechanism
-            elif item.startswith("a"):
-                is_tag_before_all = True
-                if item == "a":
-                    a_records = find_a_record(curr_domain, issues)
-                    for record in a_records:
-                        if not is_public_ip4(record):
+                    if term.is_pass:
+                        networks.extend(address_networks(a_records, term.cidr4))
+                    for a_record in a_records:
+                        if not is_public_ip4(a_record):
                             throw_issue(
-                                "warning",
-                                f"The ip address: {record} from the A record of the domain: {curr_domain} is not a public ipv4 address",
-                                issues,
-                            )
-                elif item.startswith("a:"):
-                    domain = item.split(":")[1]
-                    if len(domain.split("/")) > 2:
-                        throw_issue(
-                            "error",
-                            f"Invalid value:{domain} for the A mechanism, it should be a[:domain][/prefix]",
-                            issues,
-                        )
-                    elif len(domain.split("/")) > 1 and not re.match(
-                        r"^(/(3[0-2]|[1-2][0-9]|[1-9]))$", domain.split("/")[1]
-                    ):
-                        throw_issue(
-                            "error", "Invalid prefix length in the A mechanism", issues
-                        )
-                    else:
-                        domain = domain.split("/")[0]
-
-                        a_records = find_a_record(domain, issues)
-                        for record in a_records:
-                            if not is_public_ip4(record):
-                                throw_issue(
-                                    "warning",
-                                    f"The ip address: {record} from the A record of the provided domain: {domain} is not a public ipv4 address",
-                                    issues,
-                                )
-                # Not sure how to know if there would be an ipv4 or ipv6 address though it is easily rewritable to support both
-                elif item.startswith("a/"):
-
-                    prefix = item.split("/")[1]
-                    if not re.match(r"^(/(3[0-2]|[1-2][0-9]|[1-9]))$", prefix):
-                        throw_issue(
-                            "error", "Invalid prefix length in the A mechanism", issues
-                        )
-                    a_records = find_a_record(curr_domain, issues)
-                    for record in a_records:
-                        if not is_public_ip4(record):
-                            throw_issue(
-                                "warning",
-                                f"The ip address: {record} from the A record of the current domain: {curr_domain} is not a public ipv4 address",
-                                issues,
+                                "SPF_PRIVATE_MX_ADDRESS", issues, a_record, domain
                             )
 
-            #  Check if the item is the mx mechanism
-            elif item.startswith("mx"):
-                is_tag_before_all = True
-                if item == "mx":
-                    mx_records = find_mx_record(curr_domain, issues)
-                    for mx_record in mx_records:
-                        a_records = find_a_record(mx_record.split(" ")[1], issues)
-                        for a_record in a_records:
-                            if not is_public_ip4(a_record):
-                                throw_issue(
-                                    "warning",
-                                    f"The ip address: {a_record} from the MX record of the current domain: {curr_domain} is not a public ipv4 address",
-                                    issues,
-                                )
-                elif item.startswith("mx:"):
-                    domain = item.split(":")[1]
-                    if len(domain.split("/")) > 2:
-                        throw_issue(
-                            "error",
-                            f"Invalid value:{domain} for the A mechanism, it should be a[:domain][/prefix]",
-                            issues,
-                        )
-                    elif len(domain.split("/")) > 1 and not re.match(
-                        r"^(/(3[0-2]|[1-2][0-9]|[1-9]))$", domain.split("/")[1]
-                    ):
-                        throw_issue(
-                            "error", "Invalid prefix length in the A mechanism", issues
-                        )
-                    else:
-                        domain = domain.split("/")[0]
-                        mx_records = find_mx_record(domain, issues)
-                        for mx_record in mx_records:
-                            a_records = find_a_record(mx_record.split(" ")[1], issues)
-                            for a_record in a_records:
-                                if not is_public_ip4(a_record):
-                                    throw_issue(
-                                        "warning",
-                                        f"The ip address: {record} from the MX record of the provided domain: {domain} is not a public ipv4 address",
-                                        issues,
-                                    )
-                elif item.startswith("mx/"):
-                    prefix = item.split("/")[1]
-                    if not re.match(r"^(/(3[0-2]|[1-2][0-9]|[1-9]))$", prefix):
-                        throw_issue(
-                            "error", "Invalid prefix length in the A mechanism", issues
-                        )
-                    mx_records = find_mx_record(curr_domain, issues)
-                    for mx_record in mx_records:
-                        a_records = find_a_record(mx_record.split(" ")[1], issues)
-                        for a_record in a_records:
-                            if not is_public_ip4(a_record):
-                                throw_issue(
-                                    "warning",
-                                    f"The ip address: {record} from the MX record of the current domain: {curr_domain} is not a public ipv4 address",
-                                    issues,
-                                )
-
-            # Check if the item is the exists mechanism
-            elif item.startswith("exists:"):
-                is_tag_before_all = True
-                domain = item.split(":")[1]
-                if not len(find_a_record(domain, issues)) > 0:
-                    throw_issue(
-                        "warning",
-                        f"Domain provided in exists mehcanism: {domain} is not a match or is not valid",
-                        issues,
-                    )
-
-            # Check if the item is the ptr mechanism
-            elif item.startswith("ptr"):
-                throw_issue("warning", "ptr mechanism should not be published", issues)
-
-            else:
-                throw_issue("critical", f"Invalid mechanism: {item}", issues)
+            # Check if the term is the exists mechanism
+            elif term.name == "exists":
+                if term.value:
+                    add_dependency(dependencies, term.value, "A")
+                if not term.value or (
+                    resolve
+                    and not has_macro(term.value)
+                    and not len(find_a_record(term.value, issues, context)) > 0
+                    and not context.timed_out
+                ):
+                    throw_issue("SPF_EXISTS_NO_MATCH", issues, term.value)
+
+            # Check if the term is the ptr mechanism
+            elif term.name == "ptr":
+                throw_issue("SPF_PTR", issues)
+
+            # Modifiers other than redirect do not change the evaluation
+            elif term.kind == "modifier" and term.name not in MODIFIERS:
+                throw_issue("SPF_UNKNOWN_MODIFIER", issues, term.name)
 
     else:
-        throw_issue("critical", "Provided string is not a SPF record", issues)
+        throw_issue("SPF_NOT_SPF", issues)
+
+    if mechanism is not None:
+        mechanism.close(observer, context.lookups)
+    context.path.pop()
+    if owner:
+        issues.extend(context.issues)
 
     if len(issues) > 0:
         test_status = False
-    return {"status": test_status, "issues": issues}
+    result = Result(
+        status=test_status,
+        issues=issues,
+        lookups=context.lookups - lookups,
+        void_lookups=context.void_lookups - void_lookups,
+        networks=networks,
+        dependencies=dependencies,
+    )
+    if tree is not None:
+        result["timings"] = tree.finish()
+    return result
@@ -0,0 +1,297 @@
+import argparse
+import csv
+import itertools
+import json
+import mmap
+import os
+import sys
+
+from dmarc_syntaxchecker import validate_dmarc
+from dns_cache import txt_string
+from patterns import LazyPattern
+from process_pool import CHUNK_SIZE, WorkerStats, imap
+from results import dumps, jsonable
+from spf_record_validator import validate_spf
+
+# Streaming syntax checks of TXT dumps, zone files, CSV or NDJSON passive-DNS
+# exports, read line by line through a memory map:
+#
+#     python stream_ingest.py dump.zone --workers 8 --output results.ndjson
+#
+# The v=spf1 records and the v=DMARC1 records under _dmarc. names are picked
+# out and validated offline (resolve=False) in a process pool, chunk by chunk,
+# see process_pool. Only a bounded number of chunks is in flight, so memory
+# does not grow with the size of the dump. Results come out in input order
+# unless --unordered is given.
+
+FORMATS = ("zone", "csv", "ndjson")
+
+# Columns and fields of passive-DNS exports, the first one present is used
+NAME_FIELDS = ("name", "rrname", "query", "owner", "domain")
+TYPE_FIELDS = ("type", "rrtype", "qtype")
+VALUE_FIELDS = ("value", "rdata", "data", "answer", "txt")
+
+TOKEN_REGEX = LazyPattern(r'"(?:[^"\\]|\\.)*"?|[^\s"]+')
+# Everything in front of a comment, semicolons in quoted strings do not count
+CONTENT_REGEX = LazyPattern(r'(?:"(?:[^"\\]|\\.)*"?|[^";])*')
+CLASSES = frozenset(("IN", "CH", "HS", "CS"))
+TTL_REGEX = LazyPattern(r"^(?:[0-9]+[smhdwSMHDW]?)+$")
+
+
+def read_lines(path: str):
+    # Lines of a file through a memory map, so that the OS pages the dump in
+    # and out instead of Python buffering it. "-" reads standard input
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b""):
+                yield line.decode("utf-8", "replace")
+
+
+def _text(value: str):
+    # TXT data in presentation form is joined, plain text is kept as it is
+    value = value.strip()
+    return txt_string(value) if value.startswith('"') else value
+
+
+def _absolute(name: str, origin: str):
+    if name == "@":
+        return origin
+    if name.endswith("."):
+        return name[:-1]
+    return f"{name}.{origin}" if origin else name
+
+
+def _tokens(line: str):
+    # Tokens of a logical zone line, the parentheses that join lines dropped
+    tokens = []
+    for token in TOKEN_REGEX.findall(line):
+        if not token.startswith('"'):
+            token = token.replace("(", "").replace(")", "")
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def _zone_record(line: str, owner: str, origin: str):
+    # Returns (owner, rdtype, rdata) of one logical zone line
+    tokens = _tokens(line)
+    if not line[:1].isspace():
+        owner = _absolute(tokens.pop(0), origin)
+    index = 0
+    while index < len(tokens) and (
+        tokens[index].upper() in CLASSES or TTL_REGEX.match(tokens[index])
+    ):
+        index += 1
+    if index >= len(tokens):
+        return owner, None, None
+    return owner, tokens[index].upper(), " ".join(tokens[index + 1 :])
+
+
+def read_zone(lines, origin: str = ""):
+    # (name, rdtype, text) of the TXT records of a zone file in master file
+    # format. $ORIGIN, relative and inherited owner names and records split
+    # over lines with parentheses are understood, lines of other types are
+    # skipped without being tokenized
+    origin = origin.rstrip(".")
+    owner = origin
+    pending = None
+    for line in lines:
+        if ";" in line:
+            line = CONTENT_REGEX.match(line).group()
+        if pending is not None:
+            pending += " " + line.strip()
+            if pending.count(")") < pending.count("("):
+                continue
+            line, pending = pending, None
+        elif not line.strip():
+            continue
+        elif line.startswith("$"):
+            directive = line.split()
+            if directive[0].upper() == "$ORIGIN" and len(directive) > 1:
+                origin = _absolute(directive[1], origin)
+            continue
+        elif "(" in line and line.count(")") < line.count("("):
+            pending = line.rstrip()
+            continue
+        if "TXT" not in line.upper():
+            if not line[:1].isspace():
+                owner = _absolute(line.split(None, 1)[0], origin)
+            continue
+        owner, rdtype, rdata = _zone_record(line, owner, origin)
+        if rdtype == "TXT":
+            yield owner, "TXT", _text(rdata)
+
+
+def _field(names: list, aliases: tuple):
+    for alias in aliases:
+        if alias in names:
+            return names.index(alias)
+    return None
+
+
+def read_csv(lines):
+    # (name, rdtype, text) of every row. The columns are found by a header
+    # row, without one they are name, type, value, or name, value for TXT
+    # only exports
+    rows = csv.reader(lines)
+    first = next(rows, None)
+    if first is None:
+        return
+    names = [column.strip().lower() for column in first]
+    name, rdtype, value = (
+        _field(names, NAME_FIELDS),
+        _field(names, TYPE_FIELDS),
+        _field(names, VALUE_FIELDS),
+    )
+    if name is None or value is None:
+        rows = itertools.chain([first], rows)
+        name, rdtype, value = (0, 1, 2) if len(first) > 2 else (0, None, 1)
+    for row in rows:
+        if len(row) <= max(name, value, rdtype or 0):
+            continue
+        kind = "TXT" if rdtype is None else row[rdtype].strip().upper()
+        yield row[name].strip().rstrip("."), kind, _text(row[value])
+
+
+def read_ndjson(lines):
+    # (name, rdtype, text) of every object, rdata given as a list yields one
+    # record per item
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        name = next((entry[key] for key in NAME_FIELDS if key in entry), None)
+        values = next((entry[key] for key in VALUE_FIELDS if key in entry), None)
+        rdtype = next((entry[key] for key in TYPE_FIELDS if key in entry), "TXT")
+        if not isinstance(name, str) or values is None:
+            continue
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            yield name.rstrip("."), str(rdtype).upper(), _text(str(value))
+
+
+READERS = {"zone": read_zone, "csv": read_csv, "ndjson": read_ndjson}
+
+
+def select_cases(records):
+    # (kind, domain, record) of the SPF and DMARC records among the TXT records
+    for name, rdtype, text in records:
+        if rdtype != "TXT":
+            continue
+        if text[:7].lower() == "v=spf1 " or text.lower() == "v=spf1":
+            yield "spf", name, text
+        elif text.startswith("v=DMARC1") and name.lower().startswith("_dmarc."):
+            yield "dmarc", name[len("_dmarc.") :], text
+
+
+def validate_case(case: tuple):
+    kind, domain, record = case
+    if kind == "spf":
+        result = validate_spf(record, domain, [], resolve=False)
+    else:
+        result = validate_dmarc(record, domain, resolve=False)
+    return {"kind": kind, "domain": domain, "record": record, **result}
+
+
+def validate_stream(
+    cases,
+    workers: int = None,
+    chunk_size: int = CHUNK_SIZE,
+    ordered: bool = True,
+    stats: WorkerStats = None,
+):
+    # Validate an iterable of cases in a process pool, every result carries
+    # the index of its case
+    results = imap(validate_case, cases, workers, chunk_size, ordered, stats)
+    for index, result in results:
+        yield {"index": index, **result}
+
+
+def detect_format(path: str):
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "zone"
+
+
+def ingest(
+    path: str,
+    format: str = None,
+    workers: int = None,
+    chunk_size: int = CHUNK_SIZE,
+    origin: str = "",
+    ordered: bool = True,
+    stats: WorkerStats = None,
+):
+    # Validate the SPF and DMARC records of a dump, yielding one result per
+    # record, in the order of the dump unless ordered is False
+    format = format or detect_format(path)
+    lines = read_lines(path)
+    if format == "zone":
+        records = read_zone(lines, origin)
+    else:
+        records = READERS[format](lines)
+    return validate_stream(select_cases(records), workers, chunk_size, ordered, stats)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Check the syntax of the SPF and DMARC records in a TXT dump"
+    )
+    parser.add_argument("dump", help='zone file, CSV or NDJSON, "-" for stdin')
+    parser.add_argument(
+        "--format", choices=FORMATS, help="by default taken from the extension"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--origin", default="", help="origin of a zone file")
+    parser.add_argument(
+        "--unordered", action="store_true", help="write results as they complete"
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="print per-worker throughput to stderr"
+    )
+    parser.add_argument("--output", default="-", help="NDJSON output file")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="write issues as [code, *args] lists instead of messages",
+    )
+    args = parser.parse_args(argv)
+
+    stats = WorkerStats()
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        results = ingest(
+            args.dump,
+            args.format,
+            args.workers,
+            args.chunk_size,
+            args.origin,
+            not args.unordered,
+            stats,
+        )
+        for result in results:
+            if args.compact:
+                output.write(dumps(result) + "\n")
+            else:
+                output.write(json.dumps(result, default=jsonable) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if args.stats:
+        print(json.dumps(stats.report()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import dns_cache
+from async_validator import validate_dmarc_async, validate_spf_async
+
+ANSWERS = {
+    ("example.com", "A"): ["93.184.216.34"],
+    ("example.com", "MX"): ["10 mx1.example.com.", "20 mx2.example.com."],
+    ("mx1.example.com.", "A"): ["64.233.160.1"],
+    ("mx2.example.com.", "A"): ["64.233.160.2"],
+    ("_spf.provider.net", "TXT"): ['"v=spf1 ip4:8.8.8.0/24 -all"'],
+    ("_spf.other.net", "TXT"): ['"v=spf1 ip4:9.9.9.0/24 -all"'],
+    ("example.com._report._dmarc.reports.net", "TXT"): ['"v=DMARC1;"'],
+}
+
+
+@pytest.fixture
+def network(zone_with):
+    # The synchronous pass must be served from the prefetched cache only
+    resolver = zone_with(ANSWERS)
+    resolver.latency = 0.01
+    return resolver
+
+
+def test_spf_lookups_are_issued_concurrently(network):
+    record = "v=spf1 include:_spf.provider.net include:_spf.other.net a mx -all"
+    result = asyncio.run(validate_spf_async(record, "example.com"))
+    assert result["status"]
+    assert network.queries == network.async_queries
+    assert network.peak_in_flight >= 4
+
+
+def test_dmarc_report_authorization_is_prefetched(network):
+    record = "v=DMARC1; p=reject; rua=mailto:agg@reports.net;"
+    result = asyncio.run(validate_dmarc_async(record, "example.com"))
+    assert result["status"]
+    assert network.queries == network.async_queries
+
+
+def test_concurrency_limit(network):
+    dns_cache.set_concurrency_limit(1)
+    try:
+        record = "v=spf1 include:_spf.provider.net include:_spf.other.net a -all"
+        asyncio.run(validate_spf_async(record, "example.com"))
+    finally:
+        dns_cache.set_concurrency_limit(64)
+    assert network.peak_in_flight == 1
+
+
+def test_timeout_covers_prefetch_and_validation(network):
+    network.latency = 0.2
+    record = "v=spf1 include:_spf.provider.net -all"
+    result = asyncio.run(validate_spf_async(record, "example.com", timeout=0.05))
+    assert "SPF validation timed out, the result is partial" in str(result["issues"])
+
+
+def test_queries_the_prefetch_missed_do_not_block_the_loop(network):
+    # A TTL of 0 is never cached, the synchronous pass queries it again
+    network.add("slow.example", "A", ["8.8.4.4"], ttl=0)
+    network.latency = lambda name, rdtype: 0.3 if name == "slow.example" else 0
+
+    async def main():
+        stalls = []
+
+        async def ticker():
+            while True:
+                start = asyncio.get_running_loop().time()
+                await asyncio.sleep(0.01)
+                stalls.append(asyncio.get_running_loop().time() - start)
+
+        task = asyncio.create_task(ticker())
+        result = await validate_spf_async("v=spf1 a:slow.example -all", "example.com")
+        # Let the ticker record the last interval
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return result, max(stalls)
+
+    result, stall = asyncio.run(main())
+    assert result["status"]
+    assert network.log.count(("slow.example", "A")) == 2
+    assert stall < 0.1, stall
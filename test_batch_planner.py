@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+import dns_cache
+from batch_planner import plan_batch, resolve_graph
+from bulk_audit import audit_domains
+from dns_backends import ZoneResolver
+
+DOMAINS = [f"domain{number}.example" for number in range(6)]
+
+
+def _network(latency: float = 0.0):
+    # Every domain includes the same provider, half of them report to the
+    # same host
+    resolver = ZoneResolver(latency=latency)
+    resolver.add(
+        "_spf.provider.net", "TXT", ['"v=spf1 include:_net.provider.net -all"']
+    )
+    resolver.add("_net.provider.net", "TXT", ['"v=spf1 ip4:8.8.8.0/24 -all"'])
+    for number, domain in enumerate(DOMAINS):
+        resolver.add(domain, "TXT", ['"v=spf1 include:_spf.provider.net mx -all"'])
+        resolver.add(domain, "MX", [f"10 mx.{domain}."])
+        resolver.add(f"mx.{domain}.", "A", ["64.233.160.1"])
+        if number % 2 == 0:
+            resolver.add(
+                "_dmarc." + domain,
+                "TXT",
+                ['"v=DMARC1; p=reject; rua=mailto:a@reports.net"'],
+            )
+            resolver.add(f"{domain}._report._dmarc.reports.net", "TXT", ['"v=DMARC1"'])
+    dns_cache.set_resolver(resolver)
+    return resolver
+
+
+def test_shared_names_are_resolved_once():
+    resolver = _network()
+    plan = asyncio.run(plan_batch(DOMAINS))
+    assert resolver.log.count(("_spf.provider.net", "TXT")) == 1
+    assert resolver.log.count(("_net.provider.net", "TXT")) == 1
+    assert len(resolver.log) == len(set(resolver.log)) == len(plan)
+    assert plan.dependents()[("_spf.provider.net", "TXT")] == len(DOMAINS)
+
+
+def test_plan_levels():
+    _network()
+    plan = asyncio.run(plan_batch(["domain0.example"]))
+    assert plan.levels == [
+        [("domain0.example", "TXT"), ("_dmarc.domain0.example", "TXT")],
+        [
+            ("_spf.provider.net", "TXT"),
+            ("domain0.example", "MX"),
+            ("*._report._dmarc.reports.net", "TXT"),
+            ("domain0.example._report._dmarc.reports.net", "TXT"),
+        ],
+        [("_net.provider.net", "TXT"), ("mx.domain0.example.", "A")],
+    ]
+
+
+def test_plan_is_extended_in_place():
+    resolver = _network()
+    plan = asyncio.run(plan_batch(DOMAINS[:1]))
+    queries = len(resolver.log)
+    asyncio.run(resolve_graph([("domain1.example", "TXT")], plan))
+    # Only the names the second domain adds are resolved
+    assert len(resolver.log) - queries == 3
+    assert ("domain1.example", "MX") in plan.graph
+
+
+def test_validation_after_planning_sends_no_query():
+    resolver = _network()
+    asyncio.run(plan_batch(DOMAINS))
+    resolver.reset_stats()
+    results = list(audit_domains(DOMAINS, workers=2))
+    assert all(result["spf"]["status"] for result in results)
+    assert resolver.queries == 0
+
+
+def test_concurrent_threads_share_one_query():
+    resolver = _network(latency=0.05)
+    shared = dns_cache.shared_queries
+    threads = [
+        threading.Thread(target=dns_cache.resolve, args=("_spf.provider.net", "TXT"))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert resolver.log == [("_spf.provider.net", "TXT")]
+    assert dns_cache.shared_queries - shared == 4
+
+
+def test_concurrent_tasks_share_one_query():
+    resolver = _network(latency=0.05)
+
+    async def lookups():
+        return await asyncio.gather(
+            *(dns_cache.resolve_async("_spf.provider.net", "TXT") for _ in range(5))
+        )
+
+    answers = asyncio.run(lookups())
+    assert resolver.log == [("_spf.provider.net", "TXT")]
+    assert all(answer == answers[0] for answer in answers)
+
+
+def test_batch_mode_matches_thread_mode():
+    _network()
+    threaded = {r["domain"]: r for r in audit_domains(DOMAINS, mode="thread")}
+    _network()
+    dns_cache.set_default_cache(dns_cache.DNSCache())
+    batched = {r["domain"]: r for r in audit_domains(DOMAINS, mode="batch")}
+    assert batched == threaded
@@ -0,0 +1,39 @@
+import json
+
+import dns_cache
+from benchmark import PATHS, build_corpus, compare, main, run_benchmark
+
+
+def test_corpus_shapes():
+    records, cases = build_corpus(8)
+    assert len(cases) == 8
+    assert {kind for kind, _, _ in cases} == {"spf", "dmarc"}
+    assert "_c6.domain0.example" in records
+
+
+def test_reports_every_path(zone):
+    result = run_benchmark(size=8, latency=0.0, workers=2)
+    assert set(result["paths"]) == set(PATHS)
+    for metrics in result["paths"].values():
+        assert metrics["records"] == 8
+        assert metrics["p50_ms"] <= metrics["p99_ms"]
+        assert metrics["peak_memory_kb"] > 0
+    assert result["paths"]["sync"]["queries_per_record"] > 0
+    assert result["paths"]["cached"]["queries_per_record"] == 0
+    assert dns_cache.get_resolver() is zone
+
+
+def test_compare_flags_regressions():
+    baseline = {"paths": {"sync": {"records_per_second": 100, "p99_ms": 10}}}
+    current = {"paths": {"sync": {"records_per_second": 80, "p99_ms": 10.5}}}
+    regressions = compare(baseline, current, tolerance=0.1)
+    assert [regression["metric"] for regression in regressions] == [
+        "records_per_second"
+    ]
+
+
+def test_cli_writes_json(tmp_path):
+    output = tmp_path / "run.json"
+    arguments = ["--records", "4", "--latency", "0", "--paths", "sync"]
+    assert main(arguments + ["--output", str(output)]) == 0
+    assert list(json.loads(output.read_text())["paths"]) == ["sync"]
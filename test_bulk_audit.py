@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import dns_cache
+from bulk_audit import audit_domains, main
+from results import loads
+
+DOMAINS = [f"domain{number}.example" for number in range(20)]
+
+
+@pytest.fixture(autouse=True)
+def network(zone_with):
+    records = {}
+    for domain in DOMAINS:
+        records["_dmarc." + domain, "TXT"] = ["v=DMARC1; p=reject;"]
+        if domain != "domain3.example":
+            records[domain, "TXT"] = [
+                "google-site-verification=abc",
+                "v=spf1 ip4:8.8.8.8 -all",
+            ]
+    zone_with(records)
+
+
+@pytest.mark.parametrize("mode", ["thread", "async", "batch"])
+def test_audits_every_domain(mode):
+    results = list(audit_domains(DOMAINS, workers=4, mode=mode))
+    assert sorted(result["index"] for result in results) == list(range(20))
+    by_domain = {result["domain"]: result for result in results}
+    assert by_domain["domain0.example"]["spf"]["status"]
+    assert by_domain["domain0.example"]["dmarc"]["status"]
+    assert not by_domain["domain3.example"]["spf"]["status"]
+
+
+def test_resume_from_offset():
+    results = list(audit_domains(DOMAINS, workers=4, offset=15))
+    assert sorted(result["index"] for result in results) == [15, 16, 17, 18, 19]
+
+
+def test_cli_writes_ndjson(tmp_path):
+    domains = tmp_path / "domains.txt"
+    domains.write_text("\n".join(DOMAINS[:5]) + "\n")
+    output = tmp_path / "results.ndjson"
+    main([str(domains), "--workers", "2", "--output", str(output)])
+    lines = output.read_text().splitlines()
+    assert len(lines) == 5
+    assert {json.loads(line)["domain"] for line in lines} == set(DOMAINS[:5])
+
+
+def test_missing_records_are_issues(tmp_path):
+    domains = tmp_path / "domains.txt"
+    domains.write_text("domain3.example\n")
+    output = tmp_path / "results.ndjson"
+    main([str(domains), "--compact", "--output", str(output)])
+    assert '"issues":[["RECORD_MISSING","SPF"]]' in output.read_text()
+    [issue] = loads(output.read_text())["spf"]["issues"]
+    assert issue.code == "RECORD_MISSING"
+
+
+@pytest.mark.parametrize("mode", ["thread", "async", "batch"])
+def test_timeout_bounds_each_query_without_changing_the_resolver(mode):
+    import dns.asyncresolver
+    import dns.resolver
+
+    lifetimes = (
+        dns.resolver.get_default_resolver().lifetime,
+        dns.asyncresolver.get_default_resolver().lifetime,
+    )
+    resolver = dns_cache.get_resolver()
+    resolver.latency = lambda name, rdtype: 1 if name == "domain1.example" else 0
+    results = list(audit_domains(DOMAINS[:3], workers=4, mode=mode, timeout=0.05))
+    by_domain = {result["domain"]: result for result in results}
+    assert by_domain["domain0.example"]["spf"]["status"]
+    slow = by_domain["domain1.example"]
+    if mode == "async":
+        # The timeout bounds the audit of the whole domain as well
+        assert slow["error"] == "timed out"
+    else:
+        assert slow["spf"]["record"] is None
+    assert lifetimes == (
+        dns.resolver.get_default_resolver().lifetime,
+        dns.asyncresolver.get_default_resolver().lifetime,
+    )
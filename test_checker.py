@@ -0,0 +1,82 @@
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+from checker import check_domain, main, make_server, parse_request, serve_lines
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_checks_the_records_of_a_domain():
+    result = check_domain("ikea.com")
+    assert result["spf"]["record"] == "v=spf1 include:_spf.ikea.com -all"
+    assert result["spf"]["status"]
+    assert result["dmarc"]["record"] == "v=DMARC1; p=reject; rua=mailto:dmarc@ikea.com;"
+
+
+def test_missing_record():
+    result = check_domain("makrosystem.com", ("dmarc",))
+    assert result["dmarc"]["issues"] == [
+        {"severity": "critical", "message": "No DMARC record found"}
+    ]
+
+
+def test_exit_status_tells_whether_records_pass(capsys):
+    assert main(["spf", "ikea.com"]) == 0
+    assert json.loads(capsys.readouterr().out)["spf"]["status"]
+    assert main(["dmarc", "x.example", "--record", "v=DMARC1; p=none;"]) == 1
+    [issue] = json.loads(capsys.readouterr().out)["dmarc"]["issues"]
+    assert issue["code"] == "DMARC_POLICY_NONE"
+
+
+def test_offline_checks_do_not_import_dnspython():
+    code = (
+        "import sys, checker; "
+        "checker.main(['spf', 'example.com', '--record', 'v=spf1 a -all', '--offline']); "
+        "print(sorted(name for name in sys.modules if name.startswith(('dns.', 'asyncio'))))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True
+    ).stdout
+    assert output.splitlines()[-1] == "[]"
+
+
+def test_parse_request():
+    assert parse_request("ikea.com\n") == ("ikea.com", ("spf", "dmarc"))
+    assert parse_request("DMARC ikea.com") == ("ikea.com", ("dmarc",))
+    assert parse_request("   ") is None
+
+
+def test_serve_lines():
+    output = io.StringIO()
+    serve_lines(["ikea.com\n", "\n", "spf group-ib.com\n"], output)
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [sorted(line) for line in lines] == [
+        ["dmarc", "domain", "spf"],
+        ["domain", "spf"],
+    ]
+
+
+def test_serve_socket(tmp_path):
+    path = str(tmp_path / "checker.sock")
+    server = make_server(path, compact=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(path)
+            client.sendall(b"spf ikea.com\ndmarc group-ib.com\n")
+            client.shutdown(socket.SHUT_WR)
+            lines = client.makefile().read().splitlines()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert [json.loads(line)["domain"] for line in lines] == [
+        "ikea.com",
+        "group-ib.com",
+    ]
@@ -35,3 +35,56 @@ def test_validate_dmarc_invalid_rua_value():
     # Test case for an invalid rua value in DMARC record
     dmarc_record = "v=DMARC1; p=none; rua=invalid"
     assert not validate_dmarc(dmarc_record, "group-ib.com")["status"]
+
+
+def test_syntax_mode_returns_report_authorization_dependencies(zone):
+    dmarc_record = "v=DMARC1; p=reject; rua=mailto:a@reports.net,mailto:b@group-ib.com; ruf=mailto:f@reports.net;"
+    result = validate_dmarc(dmarc_record, "group-ib.com", resolve=False)
+    assert result["status"]
+    assert zone.log == []
+    assert result["dependencies"] == [
+        ("*._report._dmarc.reports.net", "TXT"),
+        ("group-ib.com._report._dmarc.reports.net", "TXT"),
+    ]
+
+
+def test_validate_dmarc_deadline(zone):
+    zone.latency = 0.05
+    dmarc_record = (
+        "v=DMARC1; p=reject; rua=mailto:a@group-ib.tech,mailto:b@reports.net;"
+    )
+    result = validate_dmarc(dmarc_record, "group-ib.com", timeout=0.01)
+    assert not result["status"]
+    assert result["issues"] == [
+        {
+            "severity": "critical",
+            "message": "DMARC validation timed out, the result is partial",
+        }
+    ]
+
+
+def test_validate_dmarc_duplicate_and_missing_policy():
+    result = validate_dmarc("v=DMARC1; p=none; p=reject;", "group-ib.com")
+    assert "Duplicate tag: p" in str(result["issues"])
+    result = validate_dmarc("v=DMARC1; adkim=s;", "group-ib.com")
+    assert not result["status"]
+    assert result["issues"] == [
+        {"severity": "error", "message": "DMARC record has no p tag, it is required"}
+    ]
+
+
+def test_size_limits_are_not_part_of_report_hosts(zone):
+    zone.add("*._report._dmarc.reports.net", "TXT", "v=DMARC1")
+    record = "v=DMARC1; p=reject; rua=mailto:a@reports.net!10m;"
+    assert validate_dmarc(record, "group-ib.com")["status"]
+    assert zone.log == [("*._report._dmarc.reports.net", "TXT")]
+
+
+def test_report_uri_errors_have_codes():
+    record = "v=DMARC1; p=reject; rua=https://x.example,mailto:.a@x.example; ruf=x;"
+    result = validate_dmarc(record, "group-ib.com", resolve=False)
+    assert [(issue.code, issue.args) for issue in result["issues"]] == [
+        ("DMARC_INVALID_EMAIL", ("rua",)),
+        ("DMARC_EMAIL_LOCAL_DOT", ("rua",)),
+        ("DMARC_INVALID_EMAIL", ("ruf",)),
+    ]
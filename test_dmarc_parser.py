@@ -0,0 +1,55 @@
+from dmarc_parser import FO_ALL, FO_DKIM, FO_SPF, parse_dmarc
+
+
+def test_parses_typed_values():
+    record = parse_dmarc(
+        "v=DMARC1; p=reject; sp=quarantine; rua=mailto:a@reports.net!10m,"
+        "https://reports.example/dmarc; fo=d:s; adkim=s; ri=3600; pct=50;"
+    )
+    assert (record.policy, record.subdomain_policy) == ("reject", "quarantine")
+    assert [(uri.scheme, uri.host, uri.size) for uri in record.rua] == [
+        ("mailto", "reports.net", 10 * 1024 * 1024),
+        ("https", None, None),
+    ]
+    assert record.fo == FO_DKIM | FO_SPF
+    assert (record.adkim, record.aspf, record.ri, record.pct) == ("s", "r", 3600, 50)
+    assert record.errors == ()
+
+
+def test_defaults():
+    record = parse_dmarc("v=DMARC1; p=none;")
+    assert record.subdomain_policy == "none"
+    assert (record.fo, record.rf, record.ri, record.pct) == (FO_ALL, "afrf", 86400, 100)
+    assert record.rua == record.ruf == ()
+
+
+def test_duplicate_and_missing_policy():
+    assert parse_dmarc("v=DMARC1; p=none; p=reject;").errors == (
+        {"severity": "error", "message": "Duplicate tag: p"},
+    )
+    record = parse_dmarc("v=DMARC1; rua=mailto:a@reports.net")
+    assert record.policy is None
+    assert not record.terminated
+    assert [error.code for error in record.errors] == ["DMARC_POLICY_MISSING"]
+
+
+def test_invalid_values_are_none():
+    record = parse_dmarc("v=DMARC1; p=block; pct=150; ri=x; rua=reports.net;")
+    assert (record.policy, record.pct, record.ri) == (None, None, None)
+    assert record.rua[0].error is not None
+
+
+def test_not_a_dmarc_record():
+    assert parse_dmarc("v=spf1 -all") is None
+
+
+def test_tag_issues_are_aligned_with_tags():
+    record = parse_dmarc("v=DMARC1; p=none; foo=bar; fo=1:1:x; pct=150; ri=-1;")
+    assert [[issue.code for issue in issues] for issues in record.tag_issues] == [
+        ["DMARC_POLICY_NONE"],
+        ["DMARC_INVALID_TAG"],
+        ["DMARC_FO_DUPLICATE", "DMARC_FO_INVALID"],
+        ["DMARC_PCT_RANGE"],
+        ["DMARC_RI_RANGE"],
+    ]
+    assert record.errors == ()
@@ -0,0 +1,74 @@
+import asyncio
+
+import dns.resolver
+import pytest
+
+from dns_backends import ZoneResolver
+from dns_cache import resolve, txt_string
+
+ZONE = """
+$TTL 120
+example.com.        IN TXT "v=spf1 mx -all"
+example.com.        IN MX  10 mx.example.com.
+mx.example.com. 60  IN A   192.0.2.1
+*.wild.example.com. IN A   192.0.2.2
+"""
+
+
+def test_zone_file_is_served(zone):
+    assert txt_string(resolve("ikea.com", "TXT")[0]).startswith("v=spf1")
+    assert resolve("ikea.com", "A") == ["23.55.197.98"]
+
+
+def test_zone_text_keeps_ttls():
+    resolver = ZoneResolver.from_zone_text(ZONE)
+    assert resolver.resolve("example.com", "MX") == (["10 mx.example.com."], 120)
+    assert resolver.resolve("MX.example.com.", "a") == (["192.0.2.1"], 60)
+
+
+def test_missing_names_and_types():
+    resolver = ZoneResolver.from_zone_text(ZONE)
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        resolver.resolve("missing.example.com", "A")
+    with pytest.raises(dns.resolver.NoAnswer):
+        resolver.resolve("example.com", "AAAA")
+
+
+def test_wildcards():
+    resolver = ZoneResolver.from_zone_text(ZONE)
+    assert resolver.resolve("a.b.wild.example.com", "A")[0] == ["192.0.2.2"]
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        resolver.resolve("wild.example.com", "A")
+
+
+def test_dict_records_are_quoted():
+    resolver = ZoneResolver({"example.org": {"TXT": ["v=spf1 -all"], "ttl": 30}})
+    assert resolver.resolve("example.org", "TXT") == (['"v=spf1 -all"'], 30)
+
+
+def test_yaml_fixture():
+    pytest.importorskip("yaml")
+    resolver = ZoneResolver.from_yaml_text(
+        "example.org:\n  A: [192.0.2.3]\n  ttl: 10\n"
+    )
+    assert resolver.resolve("example.org", "A") == (["192.0.2.3"], 10)
+
+
+def test_simulated_latency_overlaps_async_queries():
+    resolver = ZoneResolver.from_zone_text(ZONE, latency=0.01)
+
+    async def run():
+        await asyncio.gather(
+            *(resolver.resolve_async("example.com", "TXT") for _ in range(5))
+        )
+
+    asyncio.run(run())
+    assert resolver.async_queries == 5
+    assert resolver.peak_in_flight == 5
+
+
+def test_queries_slower_than_lifetime_time_out():
+    resolver = ZoneResolver.from_zone_text(ZONE, latency=0.05)
+    with pytest.raises(dns.resolver.LifetimeTimeout):
+        resolver.resolve("example.com", "TXT", lifetime=0.01)
+    assert resolver.resolve("example.com", "TXT", lifetime=0.1)[0]
@@ -0,0 +1,99 @@
+import dns.rdata
+import dns.resolver
+import pytest
+
+import dns_cache
+from dns_backends import ZoneResolver
+from dns_cache import Deadline, DNSCache, resolve, txt_string
+
+NAMES = ("example.com", "a.example", "b.example", "c.example")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def queries(zone):
+    # Record every query that reaches the resolver backend
+    records = {"A": ["192.0.2.1"], "ttl": 60}
+    dns_cache.set_resolver(
+        ZoneResolver({name: records for name in NAMES}, default_ttl=60)
+    )
+    return dns_cache.get_resolver().log
+
+
+def test_answers_are_served_from_cache(queries):
+    cache = DNSCache()
+    assert resolve("example.com", "A", cache) == ["192.0.2.1"]
+    assert resolve("EXAMPLE.com.", "a", cache) == ["192.0.2.1"]
+    assert len(queries) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_with_ttl(queries):
+    clock = FakeClock()
+    cache = DNSCache(clock=clock)
+    resolve("example.com", "A", cache)
+    clock.now = 59
+    resolve("example.com", "A", cache)
+    clock.now = 61
+    resolve("example.com", "A", cache)
+    assert len(queries) == 2
+
+
+def test_negative_answers_are_cached(queries):
+    cache = DNSCache()
+    for _ in range(3):
+        with pytest.raises(dns.resolver.NXDOMAIN):
+            resolve("missing.example", "TXT", cache)
+    assert len(queries) == 1
+
+
+def test_lru_eviction(queries):
+    cache = DNSCache(max_size=2)
+    resolve("a.example", "A", cache)
+    resolve("b.example", "A", cache)
+    resolve("a.example", "A", cache)
+    resolve("c.example", "A", cache)
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("a.example", "A") is not None
+    assert cache.get("b.example", "A") is None
+
+
+def test_default_cache_is_swappable(queries):
+    previous = dns_cache.get_default_cache()
+    cache = DNSCache()
+    dns_cache.set_default_cache(cache)
+    try:
+        resolve("example.com", "A")
+        resolve("example.com", "A")
+    finally:
+        dns_cache.set_default_cache(previous)
+    assert cache.stats()["hits"] == 1
+
+
+def test_deadline_caps_query_lifetime():
+    clock = FakeClock()
+    deadline = Deadline(2.0, query_timeout=0.5, clock=clock)
+    assert deadline.lifetime() == 0.5
+    clock.now = 1.8
+    assert deadline.lifetime() == pytest.approx(0.2)
+    clock.now = 2.5
+    assert deadline.expired()
+    assert deadline.lifetime() == 0.0
+    assert Deadline().lifetime() is None
+
+
+@pytest.mark.parametrize(
+    "record",
+    ['"v=spf1 " "-all"', '"a\\"b" c', '"caf\\195\\169"', "plain", '""', '"\\\\"'],
+)
+def test_txt_string_reads_like_dnspython(record):
+    rdata = dns.rdata.from_text("IN", "TXT", record)
+    assert txt_string(record) == b"".join(rdata.strings).decode()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+from urllib.parse import quote
+
+import pytest
+
+import dns_cache
+from http_service import Histogram, Overloaded, ValidationService, start_server
+
+
+async def get(port: int, path: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nConnection: close\r\n\r\n".encode())
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(body) if body else None
+
+
+def run(test, **options):
+    # Run test(service, port) against a server on a free port
+    async def main():
+        service = ValidationService(**options)
+        server = await start_server(service, port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await test(service, port)
+        finally:
+            server.close()
+            await service.stop()
+
+    return asyncio.run(main())
+
+
+def test_endpoints():
+    async def test(service, port):
+        return (
+            await get(port, "/spf?domain=ikea.com"),
+            await get(port, "/check?domain=ikea.com"),
+            await get(port, "/dmarc?domain=makrosystem.com"),
+        )
+
+    (status, spf), (_, both), (_, dmarc) = run(test)
+    assert status == 200
+    assert spf["domain"] == "ikea.com"
+    assert spf["spf"]["record"] == "v=spf1 include:_spf.ikea.com -all"
+    assert spf["spf"]["status"]
+    assert sorted(both) == ["dmarc", "domain", "spf"]
+    assert both["dmarc"]["record"] == "v=DMARC1; p=reject; rua=mailto:dmarc@ikea.com;"
+    [issue] = dmarc["dmarc"]["issues"]
+    assert issue["code"] == "RECORD_MISSING"
+
+
+def test_given_record():
+    record = quote("v=DMARC1; p=none;")
+
+    async def test(service, port):
+        return await get(port, f"/dmarc?domain=x.example&record={record}")
+
+    status, result = run(test)
+    assert status == 200
+    assert result["dmarc"]["record"] == "v=DMARC1; p=none;"
+    [issue] = result["dmarc"]["issues"]
+    assert issue["code"] == "DMARC_POLICY_NONE"
+
+
+def test_bad_requests():
+    async def test(service, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"nonsense\r\n\r\n")
+        malformed = await reader.read()
+        writer.close()
+        return (
+            await get(port, "/spf"),
+            await get(port, "/unknown?domain=ikea.com"),
+            malformed,
+            await get(port, "/check?domain=ikea.com&record=v%3Dspf1%20-all"),
+        )
+
+    (missing, _), (unknown, _), malformed, (both, body) = run(test)
+    assert missing == 400
+    assert both == 400
+    assert body["error"] == "record is not accepted on /check"
+    assert unknown == 404
+    assert malformed.startswith(b"HTTP/1.1 400 ")
+
+
+def test_keep_alive_connections_answer_several_requests():
+    async def test(service, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        statuses = []
+        for _ in range(3):
+            writer.write(b"GET /spf?domain=ikea.com HTTP/1.1\r\n\r\n")
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            statuses.append(int(head.split()[1]))
+        writer.close()
+        return statuses
+
+    assert run(test) == [200, 200, 200]
+
+
+def test_identical_requests_share_one_computation():
+    async def test(service, port):
+        results = await asyncio.gather(
+            *(service.validate("spf", "ikea.com") for _ in range(5))
+        )
+        cached = await service.validate("spf", "IKEA.com.")
+        return results, cached, service.coalesced, service.results.stats()
+
+    results, cached, coalesced, stats = run(test)
+    assert all(result is results[0] for result in results)
+    assert cached is results[0]
+    assert coalesced == 4
+    assert (stats["hits"], stats["misses"]) == (1, 5)
+
+
+def test_slow_lookups_do_not_hold_up_other_requests():
+    # A TTL of 0 is never cached, the synchronous validation pass queries it
+    # again after the prefetch
+    resolver = dns_cache.get_resolver()
+    resolver.add("slow.example", "TXT", ["v=spf1 a:slow.example -all"])
+    resolver.add("slow.example", "A", ["8.8.4.4"], ttl=0)
+    resolver.latency = lambda name, rdtype: 0.3 if rdtype == "A" else 0
+
+    async def test(service, port):
+        slow = asyncio.create_task(get(port, "/spf?domain=slow.example"))
+        # Past the prefetch, into the validation pass
+        await asyncio.sleep(0.4)
+        start = asyncio.get_running_loop().time()
+        other = await get(port, "/dmarc?domain=ikea.com")
+        elapsed = asyncio.get_running_loop().time() - start
+        pending = not slow.done()
+        return other, elapsed, pending, await slow
+
+    (status, _), elapsed, pending, (_, slow) = run(test)
+    assert status == 200
+    assert pending
+    assert elapsed < 0.1, elapsed
+    assert slow["spf"]["status"]
+    assert resolver.log.count(("slow.example", "A")) == 2
+
+
+def test_timeout_bounds_the_record_lookup():
+    resolver = dns_cache.get_resolver()
+    resolver.add("slow.example", "TXT", ["v=spf1 -all"])
+    resolver.latency = lambda name, rdtype: 1 if name == "slow.example" else 0
+
+    async def test(service, port):
+        start = asyncio.get_running_loop().time()
+        status, result = await get(port, "/spf?domain=slow.example")
+        elapsed = asyncio.get_running_loop().time() - start
+        return status, result, elapsed, service.results.stats()
+
+    status, result, elapsed, stats = run(test, timeout=0.05)
+    assert status == 200
+    assert elapsed < 0.5, elapsed
+    [issue] = result["spf"]["issues"]
+    assert issue["code"] == "SPF_TIMED_OUT"
+    # A lookup that ran out of time is not a missing record to keep
+    assert stats["size"] == 0
+
+
+def test_stop_cancels_the_computations_in_progress():
+    resolver = dns_cache.get_resolver()
+    resolver.add("slow.example", "TXT", ["v=spf1 -all"])
+    resolver.latency = lambda name, rdtype: 1 if name == "slow.example" else 0
+
+    async def main():
+        service = ValidationService(workers=1)
+        await service.start()
+        waiter = asyncio.create_task(service.validate("spf", "slow.example"))
+        await asyncio.sleep(0.05)
+        await service.stop()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(waiter, 0.5)
+        return service
+
+    service = asyncio.run(main())
+    assert service.in_flight == {}
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        # No workers, the first computation stays queued
+        service = ValidationService(queue_size=1)
+        first = asyncio.create_task(service.validate("spf", "ikea.com"))
+        await asyncio.sleep(0)
+        coalesced = asyncio.create_task(service.validate("spf", "ikea.com"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await service.validate("spf", "group-ib.com")
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        status = await get(port, "/dmarc?domain=ikea.com")
+        server.close()
+        first.cancel()
+        coalesced.cancel()
+        await service.stop()
+        return service, status
+
+    service, (status, body) = asyncio.run(main())
+    assert status == 503
+    assert "queue" in body["error"]
+    assert service.coalesced == 1
+    assert service.rejected == 2
+
+
+def test_metrics():
+    async def test(service, port):
+        await get(port, "/spf?domain=ikea.com")
+        await get(port, "/spf?domain=ikea.com")
+        await get(port, "/nothing")
+        return await get(port, "/metrics")
+
+    status, metrics = run(test)
+    assert status == 200
+    latency = metrics["latency"]["/spf"]
+    assert latency["count"] == 2
+    assert latency["buckets"]["+Inf"] == 2
+    assert metrics["responses"] == {"200": 2, "404": 1}
+    assert metrics["result_cache"]["hit_rate"] == 0.5
+    assert metrics["dns_cache"]["misses"] > 0
+    assert metrics["queue"] == {"depth": 0, "size": 256}
+    assert metrics["in_flight"] == 0
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((0.01, 0.1))
+    for seconds in (0.005, 0.01, 0.05, 3):
+        histogram.observe(seconds)
+    assert histogram.report() == {
+        "count": 4,
+        "sum": 3.065,
+        "buckets": {"0.01": 2, "0.1": 3, "+Inf": 4},
+    }
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+import dns_cache
+import incremental_audit
+import report_authorization
+import spf_record_validator
+from dns_cache import DNSCache
+from incremental_audit import load_snapshot, main, reaudit_domains, save_snapshot
+
+DOMAINS = ["ikea.com", "group-ib.com", "makrosystem.com"]
+
+
+@pytest.fixture
+def validations(monkeypatch):
+    # Count the records that are validated again
+    counts = {"spf": 0, "dmarc": 0}
+    audit_spf = incremental_audit.audit_spf
+    audit_dmarc = incremental_audit.audit_dmarc
+
+    def counted_spf(domain, records=None):
+        counts["spf"] += 1
+        return audit_spf(domain, records)
+
+    def counted_dmarc(domain, records=None):
+        counts["dmarc"] += 1
+        return audit_dmarc(domain, records)
+
+    monkeypatch.setattr(incremental_audit, "audit_spf", counted_spf)
+    monkeypatch.setattr(incremental_audit, "audit_dmarc", counted_dmarc)
+    return counts
+
+
+def run(snapshot):
+    results = reaudit_domains(DOMAINS, snapshot, workers=2)
+    return {result["domain"]: result for result in results}
+
+
+def fresh_caches(zone):
+    dns_cache.set_default_cache(DNSCache())
+    spf_record_validator.subtree_cache.clear()
+    report_authorization.authorization_cache.clear()
+
+
+def test_unchanged_domains_are_not_revalidated(zone, validations):
+    snapshot = {}
+    first = run(snapshot)
+    assert validations == {"spf": 3, "dmarc": 3}
+    assert set(snapshot["ikea.com"]["spf"]["dependencies"]) == {
+        "_spf.ikea.com TXT",
+        "spf.protection.outlook.com TXT",
+    }
+
+    fresh_caches(zone)
+    second = run(snapshot)
+    assert validations == {"spf": 3, "dmarc": 3}
+    assert second["ikea.com"]["changed"] == {"spf": False, "dmarc": False}
+    assert second["ikea.com"]["spf"] == first["ikea.com"]["spf"]
+
+
+def test_changed_include_target_revalidates_its_dependents(zone, validations):
+    snapshot = {}
+    run(snapshot)
+    fresh_caches(zone)
+    zone.add("spf.protection.outlook.com", "TXT", ["v=spf1 ip4:40.92.0.0/15 -all"])
+    results = run(snapshot)
+    # group-ib.com includes it directly, ikea.com and makrosystem.com through
+    # _spf.ikea.com and a redirect
+    assert [results[domain]["changed"]["spf"] for domain in DOMAINS] == [
+        True,
+        True,
+        True,
+    ]
+    assert not any(results[domain]["changed"]["dmarc"] for domain in DOMAINS)
+    assert results["group-ib.com"]["spf"]["networks"] == ["40.92.0.0/15"]
+
+
+def test_changed_report_authorization_revalidates_dmarc(zone, validations):
+    snapshot = {}
+    run(snapshot)
+    fresh_caches(zone)
+    zone.remove("group-ib.com._report._dmarc.group-ib.tech")
+    results = run(snapshot)
+    assert results["group-ib.com"]["changed"] == {"spf": False, "dmarc": True}
+    assert not results["group-ib.com"]["dmarc"]["status"]
+
+
+def test_cli_keeps_the_snapshot(tmp_path, zone):
+    domains = tmp_path / "domains.txt"
+    domains.write_text("\n".join(DOMAINS) + "\n")
+    snapshot = tmp_path / "snapshot.ndjson"
+    output = tmp_path / "results.ndjson"
+    arguments = [str(domains), "--snapshot", str(snapshot), "--output", str(output)]
+    main(arguments)
+    fresh_caches(zone)
+    main(arguments)
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [line["changed"]["spf"] for line in lines[3:]] == [False] * 3
+    assert set(load_snapshot(str(snapshot))) == set(DOMAINS)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.ndjson")
+    snapshot = {"example.com": {"spf": {"records": []}, "dmarc": None}}
+    save_snapshot(snapshot, path)
+    assert load_snapshot(path) == snapshot
+    assert load_snapshot(str(tmp_path / "missing.ndjson")) == {}
@@ -0,0 +1,29 @@
+from ip_ranges import classify, is_public, parse_network
+
+
+def test_classifies_special_purpose_ranges():
+    assert classify("8.8.8.8") == ("public", True)
+    assert classify("10.1.2.3") == ("private", False)
+    assert classify("172.31.255.255") == ("private", False)
+    assert classify("172.32.0.0") == ("public", True)
+    assert classify("198.51.100.7") == ("documentation", False)
+    assert classify("2a00:1450:4001::/48") == ("public", True)
+    assert classify("fd12:3456::1") == ("unique local", False)
+
+
+def test_nested_ranges_use_the_most_specific_entry():
+    assert classify("192.0.0.9") == ("port control protocol anycast", True)
+    assert classify("192.0.0.8") == ("ietf protocol assignments", False)
+    assert classify("2001:1::1") == ("port control protocol anycast", True)
+
+
+def test_networks_spanning_a_special_range_are_not_public():
+    assert not is_public("8.0.0.0/5")
+    assert is_public("8.0.0.0/7")
+
+
+def test_invalid_addresses():
+    assert classify("999.1.1.1") is None
+    assert classify("10.0.0.0/52") is None
+    assert parse_network("2001:db8::/32", 4) is None
+    assert not is_public("2001:4860::/32", 4)
@@ -0,0 +1,93 @@
+import asyncio
+
+import dns.exception
+
+import dns_cache
+from async_validator import validate_spf_async
+from dmarc_syntaxchecker import validate_dmarc
+from dns_backends import ZoneResolver
+from observers import EventLog
+from spf_record_validator import validate_spf
+
+
+class TimeoutResolver(ZoneResolver):
+    def resolve(self, name, rdtype, lifetime=None):
+        raise dns.exception.Timeout()
+
+
+def test_query_events_report_outcome_and_cache_hits():
+    log = EventLog()
+    record = "v=spf1 include:_spf.ikea.com a:missing.example a:missing.example -all"
+    validate_spf(record, "ikea.com", observer=log)
+    queries = [
+        (event["name"], event["outcome"], event["cached"]) for event in log.queries()
+    ]
+    assert queries[0] == ("_spf.ikea.com", "answer", False)
+    assert queries[-2:] == [
+        ("missing.example", "nxdomain", False),
+        ("missing.example", "nxdomain", True),
+    ]
+    assert all(event["duration"] >= 0 for event in log.queries())
+
+
+def test_mechanism_events_nest_included_records():
+    log = EventLog()
+    validate_spf("v=spf1 include:_spf.ikea.com -all", "ikea.com", observer=log)
+    kinds = [(kind, event["term"]) for kind, event in log.events if kind != "query"]
+    assert kinds[:2] == [
+        ("mechanism_start", "include:_spf.ikea.com"),
+        ("mechanism_start", "ip4:193.108.42.0/24"),
+    ]
+    include = [event for kind, event in kinds if event == "include:_spf.ikea.com"]
+    assert len(include) == 2
+    closed = [event for kind, event in log.events if kind == "mechanism"]
+    assert closed[-2]["term"] == "include:_spf.ikea.com"
+    assert closed[-2]["lookups"] == 2
+
+
+def test_timing_tree_is_attached():
+    result = validate_spf("v=spf1 include:_spf.ikea.com -all", "ikea.com", timings=True)
+    tree = result["timings"]
+    assert tree["name"] == "ikea.com"
+    include = tree["children"][0]
+    assert include["name"] == "ikea.com include:_spf.ikea.com"
+    assert include["children"][0]["name"] == "_spf.ikea.com TXT"
+    assert include["duration"] <= tree["duration"]
+    assert "timings" not in validate_spf("v=spf1 -all", "ikea.com")
+
+
+def test_failed_queries_are_not_reported_as_missing_records():
+    dns_cache.set_resolver(TimeoutResolver())
+    log = EventLog()
+    result = validate_spf("v=spf1 a:slow.example -all", "ikea.com", observer=log)
+    assert result["issues"][0]["message"] == (
+        "No A record found, the DNS query failed (timeout)"
+    )
+    assert log.queries()[0]["outcome"] == "timeout"
+
+
+def test_dmarc_events():
+    log = EventLog()
+    record = "v=DMARC1; p=reject; rua=mailto:dmarc_rua@group-ib.tech;"
+    result = validate_dmarc(record, "group-ib.com", observer=log, timings=True)
+    assert result["status"]
+    assert [event["name"] for event in log.queries()] == [
+        "*._report._dmarc.group-ib.tech",
+        "group-ib.com._report._dmarc.group-ib.tech",
+    ]
+    assert [node["name"] for node in result["timings"]["children"]] == [
+        "group-ib.com p=reject",
+        "group-ib.com rua=mailto:dmarc_rua@group-ib.tech",
+    ]
+
+
+def test_async_prefetch_is_observed():
+    log = EventLog()
+    asyncio.run(
+        validate_spf_async("v=spf1 include:_spf.ikea.com -all", "ikea.com", log)
+    )
+    queries = log.queries()
+    assert not queries[0]["cached"]
+    assert [event for event in queries if event["name"] == "_spf.ikea.com"][-1][
+        "cached"
+    ]
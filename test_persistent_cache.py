@@ -0,0 +1,103 @@
+import multiprocessing
+
+import dns.exception
+import dns.resolver
+import pytest
+
+import dns_cache
+from dns_backends import ZoneResolver
+from dns_cache import DNSCache, resolve
+from persistent_cache import SQLiteStore, open_default_store, validate_spf_cached
+
+
+class TimeoutResolver(ZoneResolver):
+    def resolve(self, name, rdtype, lifetime=None):
+        raise dns.exception.Timeout()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def restart(store):
+    # A new process starts with an empty memory cache over the same file
+    dns_cache.set_default_cache(DNSCache(store=store))
+
+
+def test_answers_survive_a_restart(zone, tmp_path):
+    path = str(tmp_path / "cache.db")
+    store = open_default_store(path)
+    resolve("ikea.com", "A")
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        resolve("missing.example", "A")
+
+    zone.reset_stats()
+    restart(SQLiteStore(path))
+    assert resolve("ikea.com", "A") == ["23.55.197.98"]
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        resolve("missing.example", "A")
+    assert zone.queries == 0
+    assert dns_cache.get_default_cache().stats()["store_hits"] == 2
+    assert store.stats()["answers"] == 2
+
+
+def test_entries_expire_and_are_purged(tmp_path):
+    clock = FakeClock()
+    store = SQLiteStore(str(tmp_path / "cache.db"), clock=clock)
+    store.set_answer("example.com", "A", ["192.0.2.1"], 60)
+    store.set_result("spf", "example.com", "v=spf1 -all", {"status": True}, 30)
+    clock.now += 45
+    assert store.get_answer("example.com", "A")[2] == pytest.approx(15)
+    assert store.get_result("spf", "example.com", "v=spf1 -all") is None
+    clock.now += 30
+    assert store.get_answer("example.com", "A") is None
+    assert store.compact() == 2
+    assert store.stats() == {"answers": 0, "results": 0}
+
+
+def test_results_are_reused(zone, tmp_path):
+    path = str(tmp_path / "cache.db")
+    open_default_store(path)
+    record = "v=spf1 include:_spf.ikea.com mx -all"
+    first = validate_spf_cached(record, "ikea.com")
+
+    zone.reset_stats()
+    restart(SQLiteStore(path))
+    second = validate_spf_cached(record, "ikea.com")
+    assert second == first
+    assert zone.queries == 0
+
+
+def test_results_of_failed_queries_are_not_stored(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    restart(store)
+    dns_cache.set_resolver(TimeoutResolver())
+    record = "v=spf1 a:slow.example -all"
+    result = validate_spf_cached(record, "ikea.com", store)
+    assert "timeout" in result["issues"][0]["message"]
+    assert store.stats()["results"] == 0
+
+
+def write_answers(path, worker):
+    store = SQLiteStore(path)
+    for number in range(100):
+        store.set_answer(f"host{number}.worker{worker}.example", "A", ["192.0.2.1"], 60)
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteStore(path)
+    processes = [
+        multiprocessing.Process(target=write_answers, args=(path, worker))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0, 0]
+    assert SQLiteStore(path).stats()["answers"] == 400
@@ -0,0 +1,41 @@
+import dns_cache
+from dns_cache import DNSCache
+from process_pool import WorkerStats, imap, warm_up
+
+
+def square(number: int):
+    return number * number
+
+
+def cached_answer(name: str):
+    entry = dns_cache.get_default_cache().get(name, "TXT")
+    return None if entry is None else entry.records
+
+
+def test_results_in_input_order():
+    stats = WorkerStats()
+    results = list(imap(square, range(1000), workers=2, chunk_size=9, stats=stats))
+    assert results == [(number, number * number) for number in range(1000)]
+    report = stats.report()
+    assert report["items"] == 1000
+    assert 1 <= len(report["workers"]) <= 2
+    assert all(worker["items"] for worker in report["workers"].values())
+
+
+def test_results_in_completion_order():
+    results = list(imap(square, range(100), workers=3, chunk_size=4, ordered=False))
+    assert sorted(results) == [(number, number * number) for number in range(100)]
+
+
+def test_workers_see_the_parent_cache():
+    dns_cache.get_default_cache().set("example.com", "TXT", ['"v=spf1 -all"'], 300)
+    results = list(imap(cached_answer, ["example.com"], workers=1))
+    assert results == [(0, ['"v=spf1 -all"'])]
+
+
+def test_snapshot_seeds_the_cache_of_spawned_workers():
+    cache = DNSCache()
+    cache.set("Example.com.", "txt", ['"v=spf1 -all"'], 300)
+    warm_up(cache.snapshot())
+    assert cached_answer("example.com") == ['"v=spf1 -all"']
+    assert dns_cache.get_default_cache().ttl("example.com", "TXT") <= 300
@@ -0,0 +1,64 @@
+import time
+
+import dns_cache
+from dmarc_syntaxchecker import validate_dmarc
+from report_authorization import authorization_cache, authorize_hosts, tag_hosts
+
+SENDERS = ["one.example", "two.example", "three.example"]
+
+
+def test_tag_hosts():
+    tag = "rua=mailto:a@reports.net,https://x.example,mailto:b@agg.example!10m"
+    assert tag_hosts(tag) == ["reports.net", "agg.example"]
+    assert tag_hosts("p=reject") == []
+
+
+def test_wildcard_is_checked_once_per_host(zone):
+    zone.add("*._report._dmarc.agg.example", "TXT", "v=DMARC1")
+    for domain in SENDERS:
+        result = validate_dmarc(
+            f"v=DMARC1; p=reject; rua=mailto:a@agg.example;", domain
+        )
+        assert result["status"]
+    assert zone.log == [("*._report._dmarc.agg.example", "TXT")]
+
+
+def test_hosts_without_wildcard_are_checked_per_domain(zone):
+    zone.add("one.example._report._dmarc.reports.net", "TXT", "v=DMARC1")
+    record = "v=DMARC1; p=reject; rua=mailto:a@reports.net;"
+    assert validate_dmarc(record, "one.example")["status"]
+    assert not validate_dmarc(record, "two.example")["status"]
+    assert zone.log == [
+        ("*._report._dmarc.reports.net", "TXT"),
+        ("one.example._report._dmarc.reports.net", "TXT"),
+        ("two.example._report._dmarc.reports.net", "TXT"),
+    ]
+
+
+def test_pairs_are_kept_for_the_ttl_of_their_answer(zone):
+    zone.add("one.example._report._dmarc.reports.net", "TXT", "v=DMARC1", ttl=60)
+    record = "v=DMARC1; p=reject; rua=mailto:a@reports.net;"
+    validate_dmarc(record, "one.example")
+    queries = len(zone.log)
+    dns_cache.get_default_cache().clear()
+    assert validate_dmarc(record, "one.example")["status"]
+    assert len(zone.log) == queries
+    assert (
+        0
+        < authorization_cache.ttl("one.example._report._dmarc.reports.net", "AUTH")
+        <= 60
+    )
+
+
+def test_hosts_of_a_record_are_checked_concurrently(zone):
+    hosts = [f"reports{number}.example" for number in range(4)]
+    for host in hosts:
+        zone.add(f"one.example._report._dmarc.{host}", "TXT", "v=DMARC1")
+    zone.latency = 0.05
+    start = time.perf_counter()
+    results = authorize_hosts("one.example", hosts + ["one.example"])
+    elapsed = time.perf_counter() - start
+    assert all(results.values())
+    assert zone.peak_in_flight == 4
+    # Two queries per host, serially they would take 0.4s
+    assert elapsed < 0.3
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from dmarc_syntaxchecker import validate_dmarc
+from results import CRITICAL, Issue, Result, dumps, jsonable, loads, timed_out
+from spf_record_validator import validate_spf
+
+
+def test_issue_reads_like_a_dict():
+    issue = Issue("DMARC_INVALID_TAG", ("x",))
+    assert issue == {"severity": "error", "message": "Invalid tag: x"}
+    assert issue["severity"] == "error"
+    assert str(issue.severity) == "error"
+    with pytest.raises(ValueError):
+        Issue("NO_SUCH_CODE")
+
+
+def test_validators_return_codes():
+    result = validate_spf("v=spf1 -all ip4:8.8.8.8", "example.com", [], resolve=False)
+    assert isinstance(result, Result)
+    assert [issue.code for issue in result["issues"]] == [
+        "SPF_ALL_FIRST",
+        "SPF_ALL_NOT_LAST",
+    ]
+    assert result["issues"][0].severity is CRITICAL
+
+    result = validate_dmarc("v=DMARC1; p=none; pct=50;", "example.com", resolve=False)
+    assert [issue.code for issue in result["issues"]] == [
+        "DMARC_POLICY_NONE",
+        "DMARC_PCT_LT_100",
+    ]
+    assert result["issues"][0]["message"].startswith("Tag p is set to none")
+
+
+def test_result_is_a_mapping():
+    result = Result(status=True, issues=[])
+    assert dict(result) == {"status": True, "issues": []}
+    result["lookups"] = 3
+    assert list(result) == ["status", "issues", "lookups"]
+    with pytest.raises(KeyError):
+        result["domain"] = "example.com"
+    assert {"domain": "example.com", **result}["lookups"] == 3
+
+
+def test_dumps_and_loads_roundtrip():
+    result = validate_dmarc(
+        "v=DMARC1; p=reject; rua=mailto:a@reports.net;", "example.com", resolve=False
+    )
+    line = dumps(result)
+    assert '["DMARC_' not in line
+    result = validate_spf("v=spf1 ip4:10.0.0.1 ~all", "example.com", [], resolve=False)
+    line = dumps(result)
+    assert '"issues":[["SPF_PRIVATE_ADDRESS","10.0.0.1",4,"private"]]' in line
+    loaded = loads(line)
+    assert isinstance(loaded, Result)
+    assert loaded == result
+    assert loaded["issues"][0].code == "SPF_PRIVATE_ADDRESS"
+
+
+def test_timed_out_reads_codes():
+    result = validate_spf("v=spf1 -all", "example.com", [], resolve=False)
+    assert not timed_out(result)
+    result["issues"].append(Issue("SPF_TIMED_OUT", ()))
+    assert timed_out(result)
+    assert timed_out(loads(dumps(result)))
+    # Plain JSON has messages only
+    assert not timed_out(json.loads(json.dumps(result, default=jsonable)))
+
+
+def test_jsonable_renders_messages():
+    result = validate_dmarc("v=DMARC1; p=none;", "example.com", resolve=False)
+    [issue] = json.loads(json.dumps(result, default=jsonable))["issues"]
+    assert issue == {
+        "code": "DMARC_POLICY_NONE",
+        "severity": "warning",
+        "message": "Tag p is set to none. It is recommended to set it to quarantine or reject",
+    }
+
+
+def test_compact_lines_are_smaller():
+    record = "v=DMARC1; p=none; pct=5; fo=0:x; ruf=mailto:a..b@example.com"
+    result = validate_dmarc(record, "example.com", resolve=False)
+    assert len(dumps(result)) * 3 < len(json.dumps(result, default=dict))
@@ -1,3 +1,8 @@
+import time
+
+import pytest
+
+import spf_record_validator
 from spf_record_validator import validate_spf
 
 
@@ -29,15 +34,26 @@ def test_validates_mx_mechanism():
 
 
 def test_validates_ip4_mechanism():
-    assert validate_spf("v=spf1 ip4:192.0.2.0/24 -all", "ikea.com")["status"]
+    assert validate_spf("v=spf1 ip4:8.8.4.0/24 -all", "ikea.com")["status"]
     assert not validate_spf("v=spf1 ip4:10.0.2.0/52 -all", "example.org")["status"]
 
 
 def test_validates_ip6_mechanism():
-    assert validate_spf("v=spf1 ip6:2001:db8::/32 -all", "ikea.com")["status"]
+    assert validate_spf("v=spf1 ip6:2001:4860::/32 -all", "ikea.com")["status"]
     assert not validate_spf("v=spf1 ip6:001:db8:::/764 -all", "example.org")["status"]
 
 
+def test_special_purpose_ranges_are_not_public():
+    result = validate_spf(
+        "v=spf1 ip4:192.0.2.0/24 ip4:100.64.1.1 ip6:2001:db8::/32 ip6:fe80::1 -all",
+        "example.org",
+    )
+    assert [issue["severity"] for issue in result["issues"]] == ["warning"] * 4
+    assert "(documentation)" in result["issues"][0]["message"]
+    assert "(shared address space)" in result["issues"][1]["message"]
+    assert "(link local)" in result["issues"][3]["message"]
+
+
 def test_validates_all_mechanism():
     assert not validate_spf("v=spf1 -all", "example.org")["status"]
 
@@ -47,3 +63,180 @@ def test_validates_redirect_mechanism():
     assert not validate_spf(
         "v=spf1 redirect=ikea.com redirect=makrosystem.com", "ikea.com"
     )["status"]
+
+
+PROVIDER = {
+    ("_spf.provider.net", "TXT"): [
+        '"v=spf1 include:_nested.provider.net ip4:8.8.8.0/24 -all"'
+    ],
+    ("_nested.provider.net", "TXT"): ['"v=spf1 ip4:9.9.9.0/24 -all"'],
+    ("_loop.example", "TXT"): ['"v=spf1 include:_loop.example -all"'],
+    ("_ping.example", "TXT"): ['"v=spf1 include:_pong.example -all"'],
+    ("_pong.example", "TXT"): ['"v=spf1 include:_ping.example -all"'],
+    **{
+        (f"_chain{n}.example", "TXT"): [f'"v=spf1 include:_chain{n + 1}.example -all"']
+        for n in range(20)
+    },
+    ("_chain20.example", "TXT"): ['"v=spf1 ip4:8.8.8.8 -all"'],
+}
+
+
+@pytest.fixture
+def provider_dns(zone):
+    for (name, rdtype), values in PROVIDER.items():
+        zone.add(name, rdtype, values)
+    zone.reset_stats()
+    return zone.log
+
+
+def test_include_subtrees_are_memoized(provider_dns):
+    first = validate_spf("v=spf1 include:_spf.provider.net -all", "a.example")
+    second = validate_spf("v=spf1 include:_spf.provider.net -all", "b.example")
+    assert first["lookups"] == second["lookups"] == 2
+    assert second["networks"] == ["9.9.9.0/24", "8.8.8.0/24"]
+    assert len(provider_dns) == 2
+    assert spf_record_validator.subtree_cache.stats()["hits"] == 1
+
+
+def test_self_include_is_a_permerror(provider_dns):
+    result = validate_spf("v=spf1 include:_loop.example -all", "a.example")
+    assert not result["status"]
+    assert "includes itself" in result["issues"][0]["message"]
+
+
+def test_include_loop_is_a_permerror(provider_dns):
+    result = validate_spf("v=spf1 include:_ping.example -all", "a.example")
+    assert not result["status"]
+    assert "_ping.example -> _pong.example -> _ping.example" in str(result["issues"])
+
+
+def test_lookup_limit_stops_the_walk(provider_dns):
+    result = validate_spf("v=spf1 include:_chain0.example -all", "a.example")
+    assert not result["status"]
+    assert "more than 10 DNS lookups" in result["issues"][0]["message"]
+    assert result["lookups"] == 11
+    assert len(provider_dns) == 10
+
+
+def test_void_lookup_limit(provider_dns):
+    record = "v=spf1 exists:a.missing exists:b.missing exists:c.missing -all"
+    result = validate_spf(record, "a.example")
+    assert not result["status"]
+    assert "more than 2 void DNS lookups" in str(result["issues"])
+    assert len(provider_dns) == 3
+
+
+def test_lookup_budget_includes_memoized_subtrees(provider_dns):
+    validate_spf("v=spf1 include:_chain15.example -all", "a.example")
+    result = validate_spf(
+        "v=spf1 include:_chain10.example include:_chain15.example -all", "a.example"
+    )
+    assert "more than 10 DNS lookups" in str(result["issues"])
+
+
+def test_syntax_mode_makes_no_queries(provider_dns):
+    record = "v=spf1 include:_spf.provider.net a mx:mail.example exists:%{i}.x.example ip4:8.8.8.8 -all"
+    result = validate_spf(record, "a.example", resolve=False)
+    assert result["status"]
+    assert provider_dns == []
+    assert result["lookups"] == 4
+    assert result["dependencies"] == [
+        ("_spf.provider.net", "TXT"),
+        ("a.example", "A"),
+        ("mail.example", "MX"),
+        ("%{i}.x.example", "A"),
+    ]
+
+
+def slow_chain(zone, seconds):
+    # _chain0 -> ... -> _chain20, every query takes seconds
+    for (name, rdtype), values in PROVIDER.items():
+        zone.add(name, rdtype, values)
+    zone.latency = seconds
+
+
+def test_deadline_returns_partial_results(zone):
+    slow_chain(zone, 0.02)
+    record = "v=spf1 ip4:8.8.4.0/24 include:_chain0.example -all"
+    start = time.monotonic()
+    result = validate_spf(record, "a.example", timeout=0.05)
+    assert time.monotonic() - start < 0.5
+    assert not result["status"]
+    assert "SPF validation timed out, the result is partial" in str(result["issues"])
+    assert "8.8.4.0/24" in result["networks"]
+    assert zone.queries < 10
+
+
+def test_query_timeout_fails_single_queries(zone):
+    slow_chain(zone, 0.05)
+    result = validate_spf(
+        "v=spf1 a:_chain0.example -all", "a.example", query_timeout=0.01
+    )
+    assert result["issues"] == [
+        {
+            "severity": "critical",
+            "message": "No A record found, the DNS query failed (timeout)",
+        }
+    ]
+
+
+def test_timed_out_subtrees_are_not_memoized(zone):
+    slow_chain(zone, 0.02)
+    validate_spf("v=spf1 include:_chain15.example -all", "a.example", timeout=0.03)
+    zone.latency = 0.0
+    result = validate_spf("v=spf1 include:_chain15.example -all", "a.example")
+    assert result["status"]
+    assert result["networks"] == ["8.8.8.8/32"]
+
+
+def test_errors_of_included_records_are_reported(zone):
+    zone.add("_bad.example", "TXT", ["v=spf1 ip4:999.1.1.1 foo:bar ptr -all"])
+    record = "v=spf1 include:_bad.example -all"
+    for _ in range(2):
+        result = validate_spf(record, "a.example")
+        assert not result["status"]
+        [issue] = result["issues"]
+        assert issue.code == "SPF_INCLUDE_ERRORS"
+        assert issue["message"] == (
+            "include target _bad.example has errors: "
+            "Invalid ipv4 address: 999.1.1.1; Invalid mechanism: foo:bar"
+        )
+    assert spf_record_validator.subtree_cache.stats()["hits"] == 1
+
+
+def test_malformed_macros_in_domain_specs_are_reported():
+    record = "v=spf1 ip4:8.8.8.8 exists:%{i0}.example redirect=%{z}.example"
+    result = validate_spf(record, "a.example", [], resolve=False)
+    assert not result["status"]
+    assert [issue["message"] for issue in result["issues"]] == [
+        "Invalid macro in the exists domain-spec: exists:%{i0}.example",
+        "Invalid macro in the redirect domain-spec: redirect=%{z}.example",
+    ]
+
+
+def test_several_records_of_an_included_domain_are_an_error(zone):
+    zone.add("_two.example", "TXT", ["v=spf1 ip4:8.8.4.4 -all", "v=spf1 +all"])
+    result = validate_spf("v=spf1 include:_two.example -all", "a.example")
+    assert not result["status"]
+    [issue] = result["issues"]
+    assert issue.code == "RECORD_MULTIPLE"
+    assert issue["message"] == "Multiple SPF records found, there must be exactly one"
+    assert result["networks"] == []
+
+
+def test_macro_domains_count_as_lookups_but_are_not_queried(provider_dns):
+    record = (
+        "v=spf1 exists:%{i}._spf.a.example exists:%{i}._spf.b.example "
+        "exists:%{i}.c.example include:%{d}._spf.example a:%{h}.example "
+        "mx:%{d} ip4:8.8.8.8 -all"
+    )
+    result = validate_spf(record, "a.example")
+    assert result["status"], result["issues"]
+    assert (result["lookups"], result["void_lookups"]) == (6, 0)
+    assert provider_dns == []
+
+
+def test_uppercase_check_reads_the_version_token():
+    assert validate_spf(" v=spf1 ip4:8.8.8.8 -all", "a.example")["status"]
+    [issue] = validate_spf("V=SPF1 ip4:8.8.8.8 -all", "a.example")["issues"]
+    assert issue.code == "SPF_UPPERCASE"
@@ -0,0 +1,136 @@
+import ipaddress
+
+import pytest
+
+from spf_check import _Check, check_host, check_hosts, compile_policy, expand
+
+RECORDS = {
+    ("example.com", "TXT"): [
+        '"v=spf1 ip4:8.8.8.0/25 include:_spf.provider.net mx a:relay.example.com/28 ~all"'
+    ],
+    ("_spf.provider.net", "TXT"): ['"v=spf1 ip4:9.9.0.0/16 ip6:2a00:1450::/32 -all"'],
+    ("example.com", "MX"): ["10 mx.example.com."],
+    ("mx.example.com", "A"): ["64.233.160.1"],
+    ("relay.example.com", "A"): ["1.1.1.20"],
+    ("macro.example", "TXT"): [
+        '"v=spf1 -ip4:8.8.8.8 exists:%{ir}.%{l1r-}.allow.macro.example -all"'
+    ],
+    ("4.3.2.1.alice.allow.macro.example", "A"): ["127.0.0.2"],
+    ("redirect.example", "TXT"): ['"v=spf1 ip4:7.7.7.7 redirect=example.com"'],
+    ("missing.example", "TXT"): ['"v=spf1 include:nothing.example -all"'],
+    ("void.example", "TXT"): ['"v=spf1 a:n1.example a:n2.example a:n3.example -all"'],
+    ("broken.example", "TXT"): ['"v=spf1 ip4:300.1.1.1 -all"'],
+    ("two.example", "TXT"): ['"v=spf1 -all"', '"v=spf1 +all"'],
+}
+
+
+@pytest.fixture(autouse=True)
+def network(zone_with):
+    return zone_with(RECORDS)
+
+
+@pytest.mark.parametrize(
+    "ip, result",
+    [
+        ("8.8.8.1", "pass"),
+        ("9.9.1.1", "pass"),
+        ("2a00:1450::1", "pass"),
+        ("64.233.160.1", "pass"),
+        ("1.1.1.17", "pass"),
+        ("::ffff:9.9.1.1", "pass"),
+        ("8.8.8.200", "softfail"),
+        ("2001:4860::1", "softfail"),
+    ],
+)
+def test_evaluates_the_record(ip, result):
+    assert check_host(ip, "example.com") == result
+
+
+def test_static_terms_compile_into_one_table():
+    policy = compile_policy("example.com")
+    assert [step.kind for step in policy.steps] == ["table"]
+    assert (policy.lookups, policy.voids) == (3, 0)
+    table = policy.steps[0].table
+    # The result of the include, and the lookups spent once it is reached
+    assert table.get(int(ipaddress.ip_address("9.9.1.1"))) == ("pass", 1, 0)
+
+
+def test_checks_after_the_first_need_no_queries(network):
+    check_host("8.8.8.1", "example.com")
+    queries = network.queries
+    assert check_host("9.9.1.1", "example.com") == "pass"
+    assert network.queries == queries
+
+
+def test_macros_are_expanded_per_check():
+    assert [step.kind for step in compile_policy("macro.example").steps] == [
+        "table",
+        "exists",
+        "table",
+    ]
+    assert check_host("1.2.3.4", "macro.example", "alice@macro.example") == "pass"
+    assert check_host("1.2.3.4", "macro.example", "bob@macro.example") == "fail"
+    assert check_host("8.8.8.8", "macro.example", "alice@macro.example") == "fail"
+
+
+def test_expand_follows_the_rfc_examples():
+    check = _Check("192.0.2.3", "email.example.com", "strong-bad@email.example.com")
+    assert expand("%{ir}.%{v}._spf.%{d2}", "email.example.com", check) == (
+        "3.2.0.192.in-addr._spf.example.com"
+    )
+    assert expand("%{lr-}.lp._spf.%{d2}", "email.example.com", check) == (
+        "bad.strong.lp._spf.example.com"
+    )
+    assert expand("%{l1r-}", "email.example.com", check) == "strong"
+    check = _Check("2001:db8::cb01", "email.example.com")
+    assert expand("%{ir}", "email.example.com", check) == (
+        "1.0.b.c.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.8.b.d.0.1.0.0.2"
+    )
+
+
+@pytest.mark.parametrize(
+    "domain, result",
+    [
+        ("redirect.example", "softfail"),
+        ("missing.example", "permerror"),
+        ("void.example", "permerror"),
+        ("broken.example", "permerror"),
+        ("two.example", "permerror"),
+        ("nothing.example", "none"),
+        ("localhost", "none"),
+    ],
+)
+def test_error_results(domain, result):
+    assert check_host("5.5.5.5", domain) == result
+
+
+def test_lookup_limit_counts_only_the_terms_reached(network):
+    includes = " ".join(f"include:n{n}.example" for n in range(11))
+    network.add("limit.example", "TXT", f"v=spf1 ip4:6.6.6.6 {includes} -all")
+    for n in range(11):
+        network.add(f"n{n}.example", "TXT", "v=spf1 -all")
+    assert check_host("6.6.6.6", "limit.example") == "pass"
+    assert check_host("6.6.6.7", "limit.example") == "permerror"
+
+
+def test_check_hosts_keeps_the_order():
+    queries = [
+        ("8.8.8.1", "example.com"),
+        ("1.2.3.4", "macro.example", "alice@macro.example"),
+        ("7.7.7.7", "redirect.example"),
+        ("8.8.8.200", "redirect.example"),
+    ]
+    assert check_hosts(queries) == ["pass", "pass", "pass", "softfail"]
+
+
+def test_check_hosts_reports_a_bad_address_on_its_own_entry(network):
+    network.add("t.example", "TXT", "v=spf1 ip4:1.2.3.4 -all")
+    queries = [("1.2.3.4", "t.example"), ("bogus", "t.example")]
+    assert check_hosts(queries) == ["pass", "permerror"]
+
+
+def test_a_malformed_macro_in_a_modifier_is_a_permerror(network):
+    network.add("badmacro.example", "TXT", "v=spf1 ip4:8.8.8.8 redirect=%{z}.example")
+    assert check_host("8.8.8.8", "badmacro.example") == "permerror"
+    queries = [("8.8.8.8", "badmacro.example"), ("8.8.8.1", "example.com")]
+    assert check_hosts(queries) == ["permerror", "pass"]
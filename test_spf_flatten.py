@@ -0,0 +1,99 @@
+import pytest
+
+import dns_cache
+from spf_flatten import flatten_spf, txt_strings
+from spf_record_validator import validate_spf
+
+RECORDS = {
+    ("example.com", "TXT"): [
+        '"v=spf1 include:_spf.provider.net mx ip4:8.8.8.0/25 exists:%{i}.wl.example.com -all"'
+    ],
+    ("_spf.provider.net", "TXT"): [
+        '"v=spf1 include:_a.provider.net include:_b.provider.net ~all"'
+    ],
+    ("_a.provider.net", "TXT"): ['"v=spf1 ip4:8.8.8.128/25 ip6:2a00:1450::/32 ~all"'],
+    ("_b.provider.net", "TXT"): ['"v=spf1 ip4:8.8.8.0/24 a:relay.provider.net ~all"'],
+    ("relay.provider.net", "A"): ["9.9.9.9"],
+    ("relay.provider.net", "AAAA"): ["2a00:1450::1"],
+    ("example.com", "MX"): ["10 mx.example.com."],
+    ("mx.example.com.", "A"): ["64.233.160.1"],
+    ("big.example", "TXT"): [
+        '"v=spf1 '
+        + " ".join(f"ip4:{n}.{n}.{n}.0/24" for n in range(11, 91, 2))
+        + ' -all"'
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def network(zone_with):
+    zone_with(RECORDS)
+
+
+def test_flattens_the_include_tree_into_collapsed_networks():
+    result = flatten_spf("example.com")
+    assert result["status"]
+    assert result["networks"] == [
+        "8.8.8.0/24",
+        "9.9.9.9/32",
+        "64.233.160.1/32",
+        "2a00:1450::/32",
+    ]
+    assert result["records"] == [
+        {
+            "name": "example.com",
+            "record": "v=spf1 ip4:8.8.8.0/24 ip4:9.9.9.9/32 ip4:64.233.160.1/32 "
+            "ip6:2a00:1450::/32 exists:%{i}.wl.example.com -all",
+            "txt": '"v=spf1 ip4:8.8.8.0/24 ip4:9.9.9.9/32 ip4:64.233.160.1/32 '
+            'ip6:2a00:1450::/32 exists:%{i}.wl.example.com -all"',
+        }
+    ]
+    assert result["lookups"] == 6
+    assert result["flattened_lookups"] == 1
+
+
+def test_long_records_are_chained_with_includes():
+    result = flatten_spf("big.example", max_length=255)
+    records = result["records"]
+    assert len(records) > 2
+    assert all(len(record["record"]) <= 255 for record in records)
+    assert records[0]["record"].startswith("v=spf1 include:_spf1.big.example")
+    assert result["flattened_lookups"] == len(records) - 1
+    for record in records[1:]:
+        assert validate_spf(record["record"], record["name"], resolve=False)["status"]
+
+
+def test_txt_strings_split_at_255_bytes():
+    assert [len(string) for string in txt_strings("x" * 600)] == [255, 255, 90]
+
+
+def test_kept_terms_keep_their_place():
+    result = flatten_spf("example.com", "v=spf1 ip4:1.2.3.0/24 -ip4:1.2.3.4 ~all")
+    assert [record["record"] for record in result["records"]] == [
+        "v=spf1 ip4:1.2.3.0/24 -ip4:1.2.3.4 ~all"
+    ]
+    record = "v=spf1 -ip4:8.8.8.8 include:big.example ?exists:%{i}.x.example mx -all"
+    records = flatten_spf("example.com", record, max_length=255)["records"]
+    top = records[0]["record"].split()
+    assert top[:2] == ["v=spf1", "-ip4:8.8.8.8"]
+    assert top[-3:] == [
+        "?exists:%{i}.x.example",
+        f"include:{records[-1]['name']}",
+        "-all",
+    ]
+    assert records[-1]["record"] == "v=spf1 ip4:64.233.160.1/32 -all"
+
+
+def test_invalid_addresses_are_reported():
+    result = flatten_spf(
+        "example.com", "v=spf1 ip4:999.1.1.1 ip6:8.8.8.8 ip4:8.8.8.8 -all"
+    )
+    assert not result["status"]
+    assert [issue.code for issue in result["issues"]] == ["SPF_INVALID_ADDRESS"] * 2
+    assert result["networks"] == ["8.8.8.8/32"]
+
+
+def test_includes_that_pass_everything_are_kept():
+    dns_cache.get_resolver().add("open.example", "TXT", ["v=spf1 ip4:8.8.8.8 +all"])
+    result = flatten_spf("example.com", "v=spf1 include:open.example -all")
+    assert result["records"][0]["record"] == "v=spf1 include:open.example -all"
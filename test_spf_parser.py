@@ -0,0 +1,43 @@
+from spf_parser import parse_spf
+
+
+def test_parses_terms_in_one_pass():
+    terms = parse_spf(
+        "v=spf1  -ip4:192.0.2.0/24\tinclude:_spf.example.com mx:mail.example.com/24//64 ~all"
+    )
+    assert [term.name for term in terms] == ["ip4", "include", "mx", "all"]
+    assert [term.qualifier for term in terms] == ["-", None, None, "~"]
+    assert (terms[0].value, terms[0].cidr4) == ("192.0.2.0", 24)
+    assert terms[1].value == "_spf.example.com"
+    assert (terms[2].value, terms[2].cidr4, terms[2].cidr6) == (
+        "mail.example.com",
+        24,
+        64,
+    )
+
+
+def test_modifiers():
+    terms = parse_spf("v=spf1 redirect=_spf.example.com exp=explain.example.com")
+    assert [(term.kind, term.name, term.value) for term in terms] == [
+        ("modifier", "redirect", "_spf.example.com"),
+        ("modifier", "exp", "explain.example.com"),
+    ]
+
+
+def test_invalid_terms_carry_an_error():
+    terms = parse_spf("v=spf1 a/f::f ip6:2001:db8::/129 foo ip4 a: all")
+    assert [term.error is not None for term in terms] == [
+        True,
+        True,
+        True,
+        True,
+        True,
+        False,
+    ]
+    assert terms[2].kind == "unknown"
+
+
+def test_not_an_spf_record():
+    assert parse_spf("v=spf10 -all") is None
+    assert parse_spf("google-site-verification=abc") is None
+    assert parse_spf("") is None
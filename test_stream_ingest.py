@@ -0,0 +1,96 @@
+import json
+
+from stream_ingest import (
+    ingest,
+    main,
+    read_csv,
+    read_lines,
+    read_ndjson,
+    read_zone,
+    select_cases,
+    validate_stream,
+)
+
+ZONE = """$ORIGIN example.com.
+$TTL 300
+@       IN SOA ns1 hostmaster (
+            2024010101 ; serial
+            3600 900 604800 300 )
+@       3600 IN TXT "v=spf1 include:_spf.example.net " "-all" ; split string
+        IN MX 10 mx1
+_dmarc  IN TXT ( "v=DMARC1; p=reject;"
+                 " rua=mailto:a@reports.net;" )
+www     IN TXT "google-site-verification=abc"
+other.org. TXT "v=spf1 ip4:192.0.2.1 ~all"
+"""
+
+
+def test_reads_zone_files(tmp_path):
+    path = tmp_path / "dump.zone"
+    path.write_text(ZONE)
+    assert list(read_zone(read_lines(str(path)))) == [
+        ("example.com", "TXT", "v=spf1 include:_spf.example.net -all"),
+        (
+            "_dmarc.example.com",
+            "TXT",
+            "v=DMARC1; p=reject; rua=mailto:a@reports.net;",
+        ),
+        ("www.example.com", "TXT", "google-site-verification=abc"),
+        ("other.org", "TXT", "v=spf1 ip4:192.0.2.1 ~all"),
+    ]
+
+
+def test_reads_csv_with_and_without_header():
+    with_header = ["rrname,rrtype,rdata\n", 'example.com.,TXT,"v=spf1 -all"\n']
+    assert list(read_csv(with_header)) == [("example.com", "TXT", "v=spf1 -all")]
+    without_header = ['example.com,"""v=spf1 "" ""-all"""\n']
+    assert list(read_csv(without_header)) == [("example.com", "TXT", "v=spf1 -all")]
+
+
+def test_reads_ndjson():
+    lines = [
+        '{"rrname": "_dmarc.example.com", "rrtype": "TXT", "rdata": ["v=DMARC1; p=none;", "x"]}\n',
+        "not json\n",
+        '{"rrname": "example.com", "rrtype": "A", "rdata": "192.0.2.1"}\n',
+    ]
+    records = list(read_ndjson(lines))
+    assert records[0] == ("_dmarc.example.com", "TXT", "v=DMARC1; p=none;")
+    assert [case[0] for case in select_cases(records)] == ["dmarc"]
+
+
+def test_results_keep_input_order(zone):
+    cases = (
+        ("spf", f"domain{number}.example", f"v=spf1 ip4:8.8.8.{number % 250} -all")
+        for number in range(300)
+    )
+    results = list(validate_stream(cases, workers=2, chunk_size=7))
+    assert [result["index"] for result in results] == list(range(300))
+    assert [result["domain"] for result in results[:2]] == [
+        "domain0.example",
+        "domain1.example",
+    ]
+    assert all(result["status"] for result in results)
+    assert zone.queries == 0
+
+
+def test_ingest_is_offline(tmp_path, zone):
+    path = tmp_path / "dump.zone"
+    path.write_text(ZONE)
+    results = list(ingest(str(path), workers=1))
+    assert [(result["kind"], result["domain"]) for result in results] == [
+        ("spf", "example.com"),
+        ("dmarc", "example.com"),
+        ("spf", "other.org"),
+    ]
+    assert zone.queries == 0
+
+
+def test_cli_writes_ndjson(tmp_path):
+    dump = tmp_path / "dump.ndjson"
+    dump.write_text(
+        '{"name": "example.com", "type": "TXT", "value": "v=spf1 foo -all"}\n'
+    )
+    output = tmp_path / "results.ndjson"
+    main([str(dump), "--workers", "1", "--output", str(output)])
+    [result] = [json.loads(line) for line in output.read_text().splitlines()]
+    assert not result["status"]